@@ -5,10 +5,12 @@ from starlette.requests import Request
 from typing import Annotated
 
 from sqlalchemy.orm import Session
-from db import models, crud
+from db import crud
 
 from handle_db import *
+from query_budget import query_budget
 from security import create_user, get_current_user
+from principal_cache import Principal
 from app_initialize import templates
 
 account_router = APIRouter()
@@ -29,27 +31,27 @@ async def register_user(
         'username': username,
         'password': password
     }
-    create_user(user, db)
+    await create_user(user, db)
     return RedirectResponse("/auth", 303)
 
 
 @account_router.get("/account")
-async def get_account(
+@query_budget(2)
+def get_account(
     request: Request,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     authorization: str = Header(None),
-    user: models.User = Depends(get_current_user),
+    user: Principal = Depends(get_current_user),
 ):
     if authorization is None:
         if token := request.cookies.get("access_token"):
             authorization = f"Bearer {token}"
 
-    account = crud.get_user(db, username=user.username)
     context = {
         'request': request,
-        'username': account.username,
-        'bio': account.bio,
-        'playlists': account.playlists
+        'username': user.username,
+        'bio': user.bio,
+        'playlists': crud.get_playlists_by_creator(db, user.id)
     }
     return templates.TemplateResponse(
         "my_account.html",
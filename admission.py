@@ -0,0 +1,221 @@
+import asyncio
+import json
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from ipaddress import ip_address, ip_network
+from typing import NamedTuple
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from metrics import LATENCY_BUCKETS, metrics, route_name
+
+# Every request is put in a class by its route. A class runs a bounded number
+# of requests at once and queues a bounded number more, each for a bounded
+# time, so a burst on one class is shed with a 503 instead of slowing down
+# the others. Per-client token buckets answer floods from one client with 429.
+ADMISSION_CONTROL = os.environ.get("ADMISSION_CONTROL", "1") == "1"
+# Off unless asked for: behind a reverse proxy that is not in TRUSTED_PROXIES
+# every user would share the proxy's buckets.
+RATE_LIMITS = os.environ.get("RATE_LIMITS", "0") == "1"
+RATE_LIMIT_CLIENTS = 100_000  # token buckets kept, least recently used go first
+# addresses or networks of the proxies whose X-Forwarded-For is believed, e.g. "10.0.0.0/8,::1"
+TRUSTED_PROXIES = [
+    ip_network(proxy.strip()) for proxy in os.environ.get("TRUSTED_PROXIES", "").split(",") if proxy.strip()
+]
+
+
+class RouteClass(NamedTuple):
+    concurrency: int
+    queue_limit: int
+    queue_timeout: float  # seconds
+    rate: float  # requests per second and client, refilling a bucket of `burst`
+    burst: int
+
+
+# Streams hold their slot until the last byte, the other limits keep them
+# from competing with bursts of catalog requests for the worker threads.
+ROUTE_CLASSES = {
+    "auth": RouteClass(concurrency=4, queue_limit=16, queue_timeout=2.0, rate=1, burst=10),
+    "heavy_read": RouteClass(concurrency=4, queue_limit=16, queue_timeout=5.0, rate=5, burst=20),
+    "light_read": RouteClass(concurrency=24, queue_limit=96, queue_timeout=2.0, rate=50, burst=200),
+    "write": RouteClass(concurrency=8, queue_limit=32, queue_timeout=5.0, rate=10, burst=50),
+    "streaming": RouteClass(concurrency=256, queue_limit=64, queue_timeout=2.0, rate=20, burst=200),
+}
+
+# (method, route path) -> class, anything else is a light read or a write by its method
+ROUTES = {
+    ("POST", "/token"): "auth",
+    ("POST", "/register"): "auth",
+    ("GET", "/"): "heavy_read",
+    ("GET", "/tracks/all"): "heavy_read",
+    ("GET", "/playlists/all"): "heavy_read",
+    ("GET", "/search"): "heavy_read",
+    ("GET", "/api/v1/authors"): "heavy_read",
+    ("GET", "/api/v1/playlists"): "heavy_read",
+    ("GET", "/stream/{track_alias}"): "streaming",
+    ("HEAD", "/stream/{track_alias}"): "streaming",
+    ("GET", "/tracks/{track_alias}/peaks"): "streaming",
+    ("POST", "/tracks/{track_alias}/play"): "light_read",
+}
+
+
+def route_class(scope: Scope) -> str:
+    method = scope["method"]
+    name = ROUTES.get((method, route_name(scope)))
+    if name is not None:
+        return name
+    return "light_read" if method in ("GET", "HEAD") else "write"
+
+
+def is_trusted_proxy(address: str) -> bool:
+    try:
+        address = ip_address(address)
+    except ValueError:
+        return False
+    return any(address in network for network in TRUSTED_PROXIES)
+
+
+def client_address(scope: Scope) -> str:
+    """The peer, or the nearest address a chain of trusted proxies forwarded for."""
+    address = scope["client"][0] if scope.get("client") else ""
+    if not TRUSTED_PROXIES or not is_trusted_proxy(address):
+        return address
+
+    forwarded = b",".join(value for name, value in scope["headers"] if name == b"x-forwarded-for")
+    # each proxy appends the address it got the request from, only the
+    # entries added by trusted proxies can be believed
+    for hop in reversed(forwarded.decode("latin-1").split(",")):
+        if not (hop := hop.strip()):
+            continue
+        address = hop
+        if not is_trusted_proxy(hop):
+            break
+    return address
+
+
+class ConcurrencyLimiter:
+    """Admits `concurrency` requests at once and queues up to `queue_limit` in order.
+
+    Runs on the event loop only, so it needs no lock.
+    """
+
+    def __init__(self, concurrency: int, queue_limit: int):
+        self.concurrency = concurrency
+        self.queue_limit = queue_limit
+        self.active = 0
+        self.waiters: deque[asyncio.Future] = deque()
+
+    def full(self) -> bool:
+        return self.active >= self.concurrency and len(self.waiters) >= self.queue_limit
+
+    async def acquire(self, timeout: float) -> bool:
+        """Waits up to `timeout` for a slot, call full() first to not queue past the limit."""
+        if self.active < self.concurrency and not self.waiters:
+            self.active += 1
+            return True
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait({waiter}, timeout=timeout)
+        finally:
+            if not waiter.done():
+                # timed out, or the client went away while queued
+                waiter.cancel()
+                self.waiters.remove(waiter)
+            elif asyncio.current_task().cancelling():
+                # handed a slot just as the client went away
+                self.release()
+        return waiter.done() and not waiter.cancelled()
+
+    def release(self):
+        # the slot goes straight to the next waiter, so `active` stays the same
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+
+class TokenBuckets:
+    def __init__(self, max_clients: int):
+        self.max_clients = max_clients
+        # (client, class) -> (tokens, last refill)
+        self.buckets: OrderedDict[tuple[str, str], tuple[float, float]] = OrderedDict()
+
+    def take(self, key: tuple[str, str], rate: float, burst: int) -> float:
+        """Takes a token from `key`'s bucket, returns 0 or the seconds until one is available."""
+        now = time.monotonic()
+        tokens, refilled_at = self.buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - refilled_at) * rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate
+
+        self.buckets[key] = (tokens, now)
+        self.buckets.move_to_end(key)
+        while len(self.buckets) > self.max_clients:
+            self.buckets.popitem(last=False)
+        return wait
+
+
+class AdmissionMiddleware:
+    def __init__(self, app: ASGIApp, classes: dict[str, RouteClass] = ROUTE_CLASSES):
+        self.app = app
+        self.classes = classes
+        self.limiters = {
+            name: ConcurrencyLimiter(route.concurrency, route.queue_limit) for name, route in classes.items()
+        }
+        self.buckets = TokenBuckets(RATE_LIMIT_CLIENTS)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        name = route_class(scope)
+        route = self.classes[name]
+
+        if RATE_LIMITS and route.rate:
+            if wait := self.buckets.take((client_address(scope), name), route.rate, route.burst):
+                metrics.inc("admission_rejected_total", (("class", name), ("reason", "rate_limited")))
+                await reject(send, 429, "Too many requests, slow down", wait)
+                return
+
+        limiter = self.limiters[name]
+        started = time.perf_counter()
+        if limiter.full():
+            reason = "queue_full"
+        elif not await limiter.acquire(route.queue_timeout):
+            reason = "queue_timeout"
+        else:
+            reason = None
+        if reason is not None:
+            metrics.inc("admission_rejected_total", (("class", name), ("reason", reason)))
+            await reject(send, 503, "The server is busy, try again later", route.queue_timeout)
+            return
+
+        metrics.observe("admission_queue_seconds", (("class", name),), time.perf_counter() - started, LATENCY_BUCKETS)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
+
+
+async def reject(send: Send, status: int, detail: str, retry_after: float):
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(math.ceil(retry_after), 1)).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,187 @@
+from functools import cache
+
+from fastapi import Depends, HTTPException, APIRouter, Path, Query
+from fastapi.responses import Response
+from pydantic import BaseModel, ConfigDict, TypeAdapter, create_model
+from starlette.requests import Request
+from typing import Annotated
+
+from sqlalchemy.orm import Session
+from db import crud, schemas
+
+from handle_db import get_read_db
+from query_budget import query_budget
+from page_cache import cache_page
+
+api_router = APIRouter(prefix="/api/v1", tags=["api"])
+
+Cursor = Annotated[str | None, Query()]
+Limit = Annotated[int, Query(ge=1, le=500)]
+Fields = Annotated[str | None, Query(description="Comma-separated list of fields to return")]
+Alias = Annotated[str, Path(min_length=3, max_length=50)]
+
+
+@cache
+def adapter_for(schema) -> TypeAdapter:
+    return TypeAdapter(schema)
+
+
+def parse_fields(model: type[BaseModel], fields: str | None) -> set[str] | None:
+    if not fields:
+        return None
+
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    if unknown := requested - model.model_fields.keys():
+        raise HTTPException(400, f"Unknown fields: {', '.join(sorted(unknown))}")
+    return requested
+
+
+@cache
+def projection(model: type[BaseModel], fields: frozenset[str]) -> type[BaseModel]:
+    """`model` with only `fields`, so validating an ORM object reads no other
+    attribute and loads no relation that was not asked for."""
+    return create_model(
+        f"{model.__name__}Fields",
+        __config__=ConfigDict(from_attributes=True),
+        **{name: (field.annotation, field) for name, field in model.model_fields.items() if name in fields}
+    )
+
+
+def project(model: type[BaseModel], fields: set[str] | None) -> type[BaseModel]:
+    return model if fields is None else projection(model, frozenset(fields))
+
+
+# Validates straight from ORM objects and serializes with pydantic-core,
+# skipping FastAPI's jsonable_encoder pass over the result.
+def json_response(schema, value, fields: set[str] | None = None) -> Response:
+    adapter = adapter_for(project(schema, fields))
+    model = adapter.validate_python(value, from_attributes=True)
+    return Response(adapter.dump_json(model), media_type="application/json")
+
+
+def page_response(item_schema, page, fields: set[str] | None) -> Response:
+    return json_response(schemas.Page[project(item_schema, fields)], page)
+
+
+@api_router.get("/authors", response_model=schemas.Page[schemas.Author])
+@query_budget(2)
+def list_authors(
+    request: Request,
+    cursor: Cursor = None,
+    limit: Limit = 100,
+    fields: Fields = None,
+    db: Session = Depends(get_read_db)
+):
+    fields = parse_fields(schemas.Author, fields)
+    with_tracks = fields is None or "tracks" in fields
+    page = crud.get_authors(db, cursor=cursor, limit=limit, with_tracks=with_tracks)
+
+    cache_page(request, "authors")
+    schema = schemas.Author if with_tracks else schemas.AuthorSummary
+    return page_response(schema, page, fields)
+
+
+@api_router.get("/authors/{author_alias}", response_model=schemas.Author)
+@query_budget(2)
+def read_author(
+    request: Request,
+    author_alias: Alias,
+    fields: Fields = None,
+    db: Session = Depends(get_read_db)
+):
+    fields = parse_fields(schemas.Author, fields)
+    author = crud.get_author(db, author_alias=author_alias)
+    if author is None:
+        raise HTTPException(404, "Author not found")
+
+    cache_page(request, f"author:{author.id}")
+    return json_response(schemas.Author, author, fields)
+
+
+@api_router.get("/authors/{author_alias}/tracks", response_model=schemas.Page[schemas.Track])
+@query_budget(2)
+def list_author_tracks(
+    request: Request,
+    author_alias: Alias,
+    cursor: Cursor = None,
+    limit: Limit = 100,
+    fields: Fields = None,
+    db: Session = Depends(get_read_db)
+):
+    fields = parse_fields(schemas.Track, fields)
+    author = crud.get_author(db, author_alias=author_alias)
+    if author is None:
+        raise HTTPException(404, "Author not found")
+
+    page = crud.get_tracks_by_an_author(db, author.id, cursor=cursor, limit=limit)
+    cache_page(request, f"author:{author.id}")
+    return page_response(schemas.Track, page, fields)
+
+
+@api_router.get("/tracks", response_model=schemas.Page[schemas.Track])
+@query_budget(1)
+def list_tracks(
+    request: Request,
+    cursor: Cursor = None,
+    limit: Limit = 100,
+    fields: Fields = None,
+    db: Session = Depends(get_read_db)
+):
+    fields = parse_fields(schemas.Track, fields)
+    page = crud.get_tracks(db, cursor=cursor, limit=limit)
+    cache_page(request, "tracks")
+    return page_response(schemas.Track, page, fields)
+
+
+@api_router.get("/tracks/{track_alias}", response_model=schemas.Track)
+@query_budget(1)
+def read_track(
+    request: Request,
+    track_alias: Alias,
+    fields: Fields = None,
+    db: Session = Depends(get_read_db)
+):
+    fields = parse_fields(schemas.Track, fields)
+    track = crud.get_track(db, track_alias=track_alias)
+    if track is None:
+        raise HTTPException(404, "Track not found")
+
+    cache_page(request, f"track:{track_alias}", f"author-tracks:{track.author_id}")
+    return json_response(schemas.Track, track, fields)
+
+
+@api_router.get("/playlists", response_model=schemas.Page[schemas.Playlist])
+@query_budget(2)
+def list_playlists(
+    request: Request,
+    cursor: Cursor = None,
+    limit: Limit = 100,
+    fields: Fields = None,
+    db: Session = Depends(get_read_db)
+):
+    fields = parse_fields(schemas.Playlist, fields)
+    # playlists hold up to a thousand tracks, so they are only loaded on request
+    with_tracks = fields is not None and "tracks" in fields
+    page = crud.get_playlists(db, cursor=cursor, limit=limit, with_tracks=with_tracks)
+
+    cache_page(request, "playlists")
+    schema = schemas.Playlist if with_tracks else schemas.PlaylistSummary
+    return page_response(schema, page, fields)
+
+
+@api_router.get("/playlists/{playlist_alias}", response_model=schemas.Playlist)
+@query_budget(2)
+def read_playlist(
+    request: Request,
+    playlist_alias: Alias,
+    fields: Fields = None,
+    db: Session = Depends(get_read_db)
+):
+    fields = parse_fields(schemas.Playlist, fields)
+    with_tracks = fields is None or "tracks" in fields
+    playlist = crud.get_playlist(db, playlist_alias=playlist_alias, load_tracks=with_tracks)
+    if playlist is None:
+        raise HTTPException(404, "Playlist not found")
+
+    cache_page(request, "playlists")
+    return json_response(schemas.Playlist, playlist, fields)
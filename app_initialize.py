@@ -1,8 +1,98 @@
-from fastapi import FastAPI
+import os
+
+import anyio
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 
+from admission import ADMISSION_CONTROL, AdmissionMiddleware
+from audio_metadata import format_duration
+from db import migrations
+from db.database import engine, read_engine
+from db.pagination import InvalidCursor
+from db.snapshot import catalog_snapshot
+from metadata_scanner import METADATA_SCANNER, metadata_scanner
+from metrics import MetricsMiddleware, TimedTemplate, instrument_engine
+from page_cache import PageCacheMiddleware
+from query_budget import QUERY_BUDGET_MODE, QueryBudgetMiddleware, watch_engine
+from password_pool import password_pool
+from play_recorder import play_recorder
+
+# Routes that touch the database are plain `def` handlers, so FastAPI runs
+# them (and their sync dependencies) in anyio's worker thread pool instead of
+# on the event loop. This bounds how many of them run at once.
+THREAD_POOL_SIZE = int(os.environ.get("THREAD_POOL_SIZE", 40))
+MIGRATE_ON_STARTUP = os.environ.get("MIGRATE_ON_STARTUP", "1") == "1"
+
 app = FastAPI()
+if ADMISSION_CONTROL:
+    # inside the page cache, cached pages cost too little to be worth shedding
+    app.add_middleware(AdmissionMiddleware)
+app.add_middleware(PageCacheMiddleware)
+if QUERY_BUDGET_MODE != "off":
+    app.add_middleware(QueryBudgetMiddleware)
+# added last so it is outermost and also times page cache hits
+app.add_middleware(MetricsMiddleware)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+for db_engine in {engine, read_engine}:
+    instrument_engine(db_engine)
+    if QUERY_BUDGET_MODE != "off":
+        watch_engine(db_engine)
+
 templates = Jinja2Templates(directory="templates")
+templates.env.template_class = TimedTemplate
+templates.env.filters["duration"] = format_duration
+
+
+@app.on_event("startup")
+async def limit_thread_pool():
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREAD_POOL_SIZE
+
+
+@app.on_event("startup")
+def apply_migrations():
+    if MIGRATE_ON_STARTUP:
+        migrations.migrate(engine)
+
+
+@app.on_event("startup")
+def start_metadata_scanner():
+    if METADATA_SCANNER:
+        metadata_scanner.start()
+
+
+@app.on_event("startup")
+def start_catalog_snapshot():
+    catalog_snapshot.start()
+
+
+@app.on_event("startup")
+def start_play_recorder():
+    play_recorder.start()
+
+
+@app.on_event("shutdown")
+def stop_password_pool():
+    password_pool.shutdown()
+
+
+@app.on_event("shutdown")
+def stop_metadata_scanner():
+    metadata_scanner.stop()
+
+
+@app.on_event("shutdown")
+def stop_catalog_snapshot():
+    catalog_snapshot.stop()
+
+
+@app.on_event("shutdown")
+def stop_play_recorder():
+    play_recorder.stop()
+
+
+@app.exception_handler(InvalidCursor)
+async def invalid_cursor_handler(request: Request, exc: InvalidCursor):
+    return JSONResponse({"detail": str(exc)}, status_code=400)
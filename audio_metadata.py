@@ -0,0 +1,371 @@
+import os
+import struct
+from mimetypes import guess_type
+from typing import BinaryIO, NamedTuple
+
+# Pure Python readers for the headers of the formats handle_post_request
+# accepts. They seek to the few places that describe the stream and never
+# decode audio, so probing a file costs a handful of small reads.
+
+
+class AudioInfo(NamedTuple):
+    duration: float | None
+    bitrate: int | None  # bits per second, averaged over the file
+    sample_rate: int | None
+    codec: str | None
+    mime_type: str
+
+
+class UnsupportedAudio(ValueError):
+    pass
+
+
+def probe(path: str | os.PathLike) -> AudioInfo:
+    with open(path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        head = file.read(12)
+        file.seek(0)
+
+        if head.startswith(b"OggS"):
+            parser = parse_ogg
+        elif head.startswith(b"RIFF") and head[8:12] == b"WAVE":
+            parser = parse_wav
+        elif head[4:8] == b"ftyp":
+            parser = parse_mp4
+        elif head.startswith(b"ID3") or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+            parser = parse_mp3
+        else:
+            raise UnsupportedAudio(f"Unrecognised audio container in {os.fspath(path)!r}")
+
+        try:
+            return parser(file, size)
+        except (struct.error, IndexError, ZeroDivisionError) as e:
+            raise UnsupportedAudio(f"Truncated or corrupt header in {os.fspath(path)!r}") from e
+
+
+def guess_mime_type(track_url: str) -> str | None:
+    return guess_type(track_url)[0]
+
+
+def format_duration(seconds: float | None) -> str:
+    if seconds is None:
+        return ""
+    minutes, seconds = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02}:{seconds:02}" if hours else f"{minutes}:{seconds:02}"
+
+
+def _average_bitrate(audio_bytes: int, duration: float | None) -> int | None:
+    return round(audio_bytes * 8 / duration) if duration else None
+
+
+# MP3
+
+
+# kbit/s by bitrate index, keyed by (MPEG-1?, layer)
+MP3_BITRATES = {
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+# Hz by sample rate index, keyed by the version bits (0 is MPEG-2.5, 2 MPEG-2, 3 MPEG-1)
+MP3_SAMPLE_RATES = {0: (11025, 12000, 8000), 2: (22050, 24000, 16000), 3: (44100, 48000, 32000)}
+MP3_SYNC_SEARCH = 64 * 1024
+
+
+class MP3Frame(NamedTuple):
+    mpeg1: bool
+    layer: int
+    bitrate: int  # bits per second
+    sample_rate: int
+    samples: int
+    length: int
+    mono: bool
+
+
+def parse_mp3_frame(header: bytes) -> MP3Frame | None:
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+
+    version = (header[1] >> 3) & 3
+    layer = 4 - ((header[1] >> 1) & 3)
+    bitrate_index = header[2] >> 4
+    rate_index = (header[2] >> 2) & 3
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+
+    mpeg1 = version == 3
+    bitrate = MP3_BITRATES[mpeg1, layer][bitrate_index] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version][rate_index]
+    padding = (header[2] >> 1) & 1
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples = 1152 if mpeg1 or layer == 2 else 576
+        length = samples // 8 * bitrate // sample_rate + padding
+    return MP3Frame(mpeg1, layer, bitrate, sample_rate, samples, length, header[3] >> 6 == 3)
+
+
+def _find_first_frame(file: BinaryIO, start: int) -> tuple[int, MP3Frame]:
+    file.seek(start)
+    data = file.read(MP3_SYNC_SEARCH)
+    position = data.find(b"\xff")
+    while position != -1:
+        frame = parse_mp3_frame(data[position:position + 4])
+        # a lone sync word is common inside cover art, so the next frame must line up too
+        if frame is not None:
+            following = data[position + frame.length:position + frame.length + 4]
+            if len(following) < 4 or parse_mp3_frame(following) is not None:
+                return start + position, frame
+        position = data.find(b"\xff", position + 1)
+    raise UnsupportedAudio("No MPEG audio frame found")
+
+
+def parse_mp3(file: BinaryIO, size: int) -> AudioInfo:
+    audio_start = 0
+    tag = file.read(10)
+    if tag.startswith(b"ID3") and len(tag) == 10:
+        tag_size = (tag[6] << 21) | (tag[7] << 14) | (tag[8] << 7) | tag[9]
+        audio_start = 10 + tag_size + (10 if tag[5] & 0x10 else 0)
+
+    offset, frame = _find_first_frame(file, audio_start)
+    audio_end = size
+    if size >= 128:
+        file.seek(size - 128)
+        if file.read(3) == b"TAG":
+            audio_end -= 128
+
+    file.seek(offset)
+    data = file.read(frame.length or 4)
+    side_info = (32 if not frame.mono else 17) if frame.mpeg1 else (17 if not frame.mono else 9)
+
+    frames = audio_bytes = None
+    xing = data[4 + side_info:4 + side_info + 16]
+    if xing[:4] in (b"Xing", b"Info"):
+        flags = struct.unpack(">I", xing[4:8])[0]
+        fields = xing[8:16]
+        if flags & 1:
+            frames = struct.unpack(">I", fields[:4])[0]
+            fields = fields[4:]
+        if flags & 2 and len(fields) >= 4:
+            audio_bytes = struct.unpack(">I", fields[:4])[0]
+    elif data[36:40] == b"VBRI":
+        audio_bytes, frames = struct.unpack(">II", data[46:54])
+
+    if frames:
+        duration = frames * frame.samples / frame.sample_rate
+        bitrate = _average_bitrate(audio_bytes or audio_end - offset, duration)
+    else:
+        # no VBR header, assume the first frame's bitrate holds for the file
+        duration = (audio_end - offset) * 8 / frame.bitrate
+        bitrate = frame.bitrate
+
+    codec = {1: "mp1", 2: "mp2", 3: "mp3"}[frame.layer]
+    return AudioInfo(duration, bitrate, frame.sample_rate, codec, "audio/mpeg")
+
+
+# OGG
+
+
+OGG_TAIL_SEARCH = 64 * 1024
+
+
+def _ogg_page(data: bytes, offset: int = 0) -> tuple[int, int, bytes]:
+    """Returns the granule position, serial number and first packet of the page at `offset`."""
+    if data[offset:offset + 4] != b"OggS" or len(data) < offset + 27:
+        raise UnsupportedAudio("Not an Ogg page")
+    granule, serial = struct.unpack_from("<qI", data, offset + 6)
+    segments = data[offset + 26]
+    table = data[offset + 27:offset + 27 + segments]
+    body = offset + 27 + segments
+    packet_length = 0
+    for lacing in table:
+        packet_length += lacing
+        if lacing < 255:
+            break
+    return granule, serial, data[body:body + packet_length]
+
+
+def parse_ogg(file: BinaryIO, size: int) -> AudioInfo:
+    _, serial, packet = _ogg_page(file.read(4096))
+
+    pre_skip = 0
+    if packet.startswith(b"\x01vorbis") and len(packet) >= 16:
+        codec = "vorbis"
+        sample_rate = rate = struct.unpack_from("<I", packet, 12)[0]
+    elif packet.startswith(b"OpusHead") and len(packet) >= 16:
+        codec = "opus"
+        pre_skip, sample_rate = struct.unpack_from("<HI", packet, 10)
+        rate = 48000  # Opus granule positions always count 48 kHz samples
+    elif packet.startswith(b"\x7fFLAC") and len(packet) >= 30:
+        codec = "flac"
+        sample_rate = rate = int.from_bytes(packet[27:30], "big") >> 4
+    else:
+        raise UnsupportedAudio("Unknown Ogg codec")
+
+    # the last page of the stream carries the total sample count
+    granule = None
+    window = OGG_TAIL_SEARCH
+    while granule is None:
+        start = max(size - window, 0)
+        file.seek(start)
+        data = file.read(size - start)
+        position = data.rfind(b"OggS")
+        while position != -1:
+            try:
+                page_granule, page_serial, _ = _ogg_page(data, position)
+            except UnsupportedAudio:
+                page_granule, page_serial = -1, None
+            if page_serial == serial and page_granule >= 0:
+                granule = page_granule
+                break
+            position = data.rfind(b"OggS", 0, position)
+        if start == 0:
+            break
+        window *= 4
+
+    duration = max(granule - pre_skip, 0) / rate if granule is not None and rate else None
+    return AudioInfo(
+        duration, _average_bitrate(size, duration), sample_rate, codec, f"audio/ogg; codecs={codec}"
+    )
+
+
+# WAV
+
+
+WAV_CODECS = {1: "pcm", 3: "pcm_float", 6: "alaw", 7: "mulaw"}
+WAV_EXTENSIBLE = 0xFFFE
+
+
+class WavLayout(NamedTuple):
+    format_tag: int
+    channels: int
+    sample_rate: int
+    byte_rate: int
+    block_align: int
+    bits_per_sample: int
+    data_offset: int | None
+    data_size: int | None
+
+
+def wav_layout(file: BinaryIO, size: int) -> WavLayout:
+    file.seek(12)
+    fmt = data_offset = data_size = None
+    position = 12
+    while position + 8 <= size and data_size is None:
+        chunk_id, chunk_size = struct.unpack("<4sI", file.read(8))
+        if chunk_id == b"fmt ":
+            fmt = file.read(min(chunk_size, 40))
+        elif chunk_id == b"data":
+            data_offset = position + 8
+            # streamed recordings leave the size at 0 or 0xFFFFFFFF
+            data_size = min(chunk_size, size - data_offset) or size - data_offset
+        position += 8 + chunk_size + (chunk_size & 1)
+        file.seek(position)
+
+    if fmt is None:
+        raise UnsupportedAudio("WAV file without a fmt chunk")
+    format_tag, channels, sample_rate, byte_rate, block_align, bits = struct.unpack_from("<HHIIHH", fmt)
+    if format_tag == WAV_EXTENSIBLE and len(fmt) >= 26:
+        # the real format is the first two bytes of the SubFormat GUID
+        format_tag = struct.unpack_from("<H", fmt, 24)[0]
+    return WavLayout(format_tag, channels, sample_rate, byte_rate, block_align, bits, data_offset, data_size)
+
+
+def parse_wav(file: BinaryIO, size: int) -> AudioInfo:
+    layout = wav_layout(file, size)
+    codec = WAV_CODECS.get(layout.format_tag, f"wav_{layout.format_tag:#x}")
+    duration = layout.data_size / layout.byte_rate if layout.data_size is not None and layout.byte_rate else None
+    return AudioInfo(duration, layout.byte_rate * 8, layout.sample_rate, codec, "audio/wav")
+
+
+# MP4
+
+
+MP4_CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl"}
+MP4_CODECS = {b"mp4a": "aac", b"alac": "alac", b"Opus": "opus", b"fLaC": "flac", b".mp3": "mp3"}
+MP4_MAX_MOOV = 64 * 1024 * 1024
+
+
+def _mp4_boxes(data: bytes, start: int = 0, end: int | None = None):
+    end = len(data) if end is None else end
+    position = start
+    while position + 8 <= end:
+        box_size, box_type = struct.unpack_from(">I4s", data, position)
+        header = 8
+        if box_size == 1:
+            box_size = struct.unpack_from(">Q", data, position + 8)[0]
+            header = 16
+        elif box_size == 0:
+            box_size = end - position
+        if box_size < header:
+            return
+        yield box_type, position + header, min(position + box_size, end)
+        position += box_size
+
+
+def parse_mp4(file: BinaryIO, size: int) -> AudioInfo:
+    # walk the top-level boxes, seeking over mdat, until the moov box is found
+    moov = None
+    mdat_bytes = 0
+    position = 0
+    while position + 8 <= size:
+        file.seek(position)
+        box_size, box_type = struct.unpack(">I4s", file.read(8))
+        header = 8
+        if box_size == 1:
+            box_size = struct.unpack(">Q", file.read(8))[0]
+            header = 16
+        elif box_size == 0:
+            box_size = size - position
+        if box_size < header:
+            break
+
+        if box_type == b"moov" and box_size <= MP4_MAX_MOOV:
+            moov = file.read(box_size - header)
+        elif box_type == b"mdat":
+            mdat_bytes += box_size - header
+        position += box_size
+
+    if moov is None:
+        raise UnsupportedAudio("MP4 file without a moov box")
+
+    duration = sample_rate = codec = None
+    pending = [(moov, 0, len(moov), None)]
+    while pending:
+        data, start, end, handler = pending.pop()
+        for box_type, body, box_end in _mp4_boxes(data, start, end):
+            if box_type == b"mvhd":
+                if data[body] == 1:
+                    timescale, length = struct.unpack_from(">IQ", data, body + 20)
+                else:
+                    timescale, length = struct.unpack_from(">II", data, body + 12)
+                duration = length / timescale if timescale else None
+            elif box_type == b"trak":
+                # the handler is only known after reading mdia/hdlr, so look it up first
+                pending.append((data, body, box_end, _mp4_handler(data, body, box_end)))
+            elif box_type in MP4_CONTAINERS:
+                pending.append((data, body, box_end, handler))
+            elif box_type == b"stsd" and handler == b"soun" and codec is None:
+                # full box header and entry count, then the first sample entry
+                entry = body + 8
+                entry_type = data[entry + 4:entry + 8]
+                codec = MP4_CODECS.get(entry_type, entry_type.decode("latin-1").strip())
+                sample_rate = struct.unpack_from(">I", data, entry + 32)[0] >> 16
+
+    return AudioInfo(
+        duration, _average_bitrate(mdat_bytes or size, duration), sample_rate, codec, "audio/mp4"
+    )
+
+
+def _mp4_handler(data: bytes, start: int, end: int) -> bytes | None:
+    for box_type, body, box_end in _mp4_boxes(data, start, end):
+        if box_type == b"mdia":
+            for inner_type, inner_body, _ in _mp4_boxes(data, body, box_end):
+                if inner_type == b"hdlr":
+                    return data[inner_body + 8:inner_body + 12]
+    return None
@@ -0,0 +1,194 @@
+import hashlib
+import os
+import tempfile
+from typing import AsyncIterator, NamedTuple
+
+from fastapi import HTTPException
+from multipart.exceptions import MultipartParseError
+from multipart.multipart import MultipartParser, parse_options_header
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+
+from streaming import AUDIO_DIRECTORY
+
+# Uploaded audio is written to disk as it arrives and stored under its
+# SHA-256, so uploading the same master twice keeps a single file.
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", 1024 * 1024))
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", 4 * 1024 ** 3))
+MAX_FIELD_BYTES = 64 * 1024
+
+INCOMING_DIRECTORY = AUDIO_DIRECTORY / ".incoming"
+
+
+class StoredFile(NamedTuple):
+    track_url: str  # relative to AUDIO_DIRECTORY
+    created: bool  # False if an identical file was already stored
+
+
+def content_path(content_hash: str, extension: str) -> str:
+    return f"{content_hash[:2]}/{content_hash}.{extension}"
+
+
+class AudioUpload:
+    """Receives a multipart body with one audio file and any number of text fields."""
+
+    def __init__(self, headers: Headers, file_field: str, allowed_extensions: tuple[str, ...]):
+        content_type, options = parse_options_header(headers.get("content-type", ""))
+        if content_type != b"multipart/form-data" or b"boundary" not in options:
+            raise HTTPException(400, "Expected a multipart/form-data body")
+        try:
+            content_length = int(headers.get("content-length") or 0)
+        except ValueError:
+            raise HTTPException(400, "Invalid Content-Length header")
+        if content_length > MAX_UPLOAD_BYTES + MAX_FIELD_BYTES:
+            raise HTTPException(413, "The upload is too large")
+
+        self.file_field = file_field
+        self.allowed_extensions = allowed_extensions
+        self.fields: dict[str, str] = {}
+        self.extension = None
+        self.size = 0
+        self.hash = hashlib.sha256()
+        self.temp_path = None
+        self.file = None
+
+        self._headers: dict[bytes, bytes] = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._field_name = None
+        self._field_data = bytearray()
+        self._in_file = False
+        self._pending: list[bytes] = []
+        self._pending_size = 0
+        self._complete = False
+
+        self.parser = MultipartParser(options[b"boundary"], {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+            "on_end": self._on_end,
+        })
+
+    @property
+    def content_hash(self) -> str:
+        return self.hash.hexdigest()
+
+    # parser callbacks, these only collect data, the file is written by _flush
+
+    def _on_part_begin(self):
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode("utf-8", "replace")
+        filename = options.get(b"filename")
+
+        if filename is None:
+            self._in_file = False
+            self._field_name = name
+            self._field_data = bytearray()
+            return
+
+        if name != self.file_field or self.extension is not None:
+            raise HTTPException(400, f"Expected a single file in the '{self.file_field}' field")
+        extension = filename.decode("utf-8", "replace").rpartition(".")[2].lower()
+        if extension not in self.allowed_extensions:
+            raise HTTPException(400, "The file extension is not allowed")
+        self.extension = extension
+        self._in_file = True
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._in_file:
+            self.size += end - start
+            if self.size > MAX_UPLOAD_BYTES:
+                raise HTTPException(413, "The upload is too large")
+            self._pending.append(data[start:end])
+            self._pending_size += end - start
+        else:
+            self._field_data += data[start:end]
+            if len(self._field_data) > MAX_FIELD_BYTES:
+                raise HTTPException(413, f"The '{self._field_name}' field is too large")
+
+    def _on_part_end(self):
+        if not self._in_file:
+            self.fields[self._field_name] = self._field_data.decode("utf-8", "replace")
+
+    def _on_end(self):
+        self._complete = True
+
+    # disk side, run in the thread pool
+
+    def _flush(self):
+        if self.file is None:
+            INCOMING_DIRECTORY.mkdir(parents=True, exist_ok=True)
+            descriptor, self.temp_path = tempfile.mkstemp(dir=INCOMING_DIRECTORY)
+            self.file = os.fdopen(descriptor, "wb", buffering=0)
+
+        chunk = b"".join(self._pending)
+        self._pending = []
+        self._pending_size = 0
+        self.hash.update(chunk)
+        self.file.write(chunk)
+
+    def _close(self):
+        if self._pending or self.file is None:
+            self._flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        self.file = None
+
+    async def receive(self, stream: AsyncIterator[bytes]):
+        try:
+            async for chunk in stream:
+                self.parser.write(chunk)
+                if self._pending_size >= UPLOAD_CHUNK_SIZE:
+                    await run_in_threadpool(self._flush)
+            self.parser.finalize()
+            if not self._complete:
+                raise HTTPException(400, "The multipart body ended early")
+            if self.extension is None:
+                raise HTTPException(400, f"The '{self.file_field}' field with the audio file is missing")
+            await run_in_threadpool(self._close)
+        except MultipartParseError as e:
+            await run_in_threadpool(self.discard)
+            raise HTTPException(400, f"Malformed multipart body: {e}")
+        except BaseException:
+            await run_in_threadpool(self.discard)
+            raise
+
+    def store(self) -> StoredFile:
+        track_url = content_path(self.content_hash, self.extension)
+        path = AUDIO_DIRECTORY / track_url
+        if path.exists():
+            self.discard()
+            return StoredFile(track_url, created=False)
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(self.temp_path, path)
+        self.temp_path = None
+        return StoredFile(track_url, created=True)
+
+    def discard(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.temp_path is not None:
+            try:
+                os.unlink(self.temp_path)
+            except FileNotFoundError:
+                pass
+            self.temp_path = None
@@ -0,0 +1,183 @@
+"""Seeded generator for synthetic SQLite catalogs.
+
+The same spec always produces the same database, so benchmark runs on
+different commits measure the same data. Usage::
+
+    python -m benchmarks.catalog catalog.db --preset large
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from itertools import islice
+from pathlib import Path
+from typing import NamedTuple
+
+from sqlalchemy import insert, text
+
+from db import cooccurrence, crud, fulltext, migrations, models, snapshot
+from db.database import make_engine
+
+INSERT_CHUNK = 10_000
+# part of the cached catalog's file name, bump it when the generated data changes
+GENERATOR_VERSION = 1
+
+BENCH_USERNAME = "bench"
+BENCH_PASSWORD = "bench-password"
+
+WORDS = (
+    "love night summer blue fire dream heart rain city light shadow river road wild "
+    "gold echo dance sky stone ghost electric midnight ocean silver storm song home "
+    "young broken paper glass velvet neon sugar winter desert thunder garden mirror"
+).split()
+
+
+class CatalogSpec(NamedTuple):
+    authors: int
+    tracks: int
+    playlists: int
+    users: int
+    seed: int = 1
+
+
+PRESETS = {
+    "tiny": CatalogSpec(authors=50, tracks=2_000, playlists=200, users=20),
+    "small": CatalogSpec(authors=500, tracks=50_000, playlists=5_000, users=200),
+    "medium": CatalogSpec(authors=2_000, tracks=200_000, playlists=20_000, users=1_000),
+    "large": CatalogSpec(authors=10_000, tracks=1_000_000, playlists=100_000, users=5_000),
+}
+
+
+def skewed_index(rng: random.Random, size: int, skew: float) -> int:
+    """An index in [0, size) where low indexes are much more likely, like popularity."""
+    return min(int(size * rng.random() ** skew), size - 1)
+
+
+def playlist_length(rng: random.Random) -> int:
+    # log-normal, median around 20 tracks with a long tail of huge playlists
+    return max(1, min(int(rng.lognormvariate(3.0, 0.9)), 1_000))
+
+
+def title(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).title()
+
+
+def chunked(rows, size: int = INSERT_CHUNK):
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+def author_rows(spec: CatalogSpec, rng: random.Random):
+    for i in range(1, spec.authors + 1):
+        yield {"id": i, "name": f"{title(rng, 2)} {i}", "alias": f"author{i}"}
+
+
+def track_rows(spec: CatalogSpec, rng: random.Random):
+    for i in range(1, spec.tracks + 1):
+        extension = rng.choices(("mp3", "ogg", "m4a", "wav"), weights=(70, 15, 10, 5))[0]
+        yield {
+            "id": i,
+            "title": title(rng, rng.randint(1, 4)),
+            "alias": f"track{i}",
+            "description": None if rng.random() < 0.7 else title(rng, 8),
+            "track_url": f"track{i}.{extension}",
+            "image_url": f"track{i}.png",
+            # a few prolific authors and a long tail of one-album ones
+            "author_id": skewed_index(rng, spec.authors, 1.5) + 1,
+            "duration": round(rng.uniform(90, 420), 2),
+            "mime_type": {"mp3": "audio/mpeg", "ogg": "audio/ogg", "m4a": "audio/mp4", "wav": "audio/wav"}[extension],
+        }
+
+
+def user_rows(spec: CatalogSpec, hashed_password: str, salt: str):
+    # every user shares the bench password, so only one bcrypt hash is computed
+    yield {"id": 1, "username": BENCH_USERNAME, "hashed_password": hashed_password, "salt": salt, "rights": "user"}
+    for i in range(2, spec.users + 1):
+        yield {"id": i, "username": f"user{i}", "hashed_password": hashed_password, "salt": salt, "rights": "user"}
+
+
+def playlist_rows(spec: CatalogSpec, rng: random.Random):
+    for i in range(1, spec.playlists + 1):
+        yield {
+            "id": i,
+            "title": title(rng, rng.randint(1, 3)),
+            "alias": f"playlist{i}",
+            "description": title(rng, 6),
+            "creator_id": skewed_index(rng, spec.users, 2) + 1,
+        }
+
+
+def association_rows(spec: CatalogSpec, rng: random.Random):
+    for playlist_id in range(1, spec.playlists + 1):
+        length = min(playlist_length(rng), spec.tracks)
+        track_ids = set()
+        while len(track_ids) < length:
+            track_ids.add(skewed_index(rng, spec.tracks, 2) + 1)
+        for position, track_id in enumerate(track_ids, 1):
+            yield {"playlist_id": playlist_id, "track_id": track_id, "position": position * crud.POSITION_GAP}
+
+
+def generate(path: str, spec: CatalogSpec):
+    rng = random.Random(spec.seed)
+    salt = "bench-salt"
+    hashed_password = crud.get_password_hash(BENCH_PASSWORD + salt)
+
+    engine = make_engine(f"sqlite:///{path}")
+    migrations.migrate(engine)
+    with engine.begin() as connection:
+        # filling the derived tables once at the end beats one trigger call per row
+        for name, in connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'trigger'")).all():
+            connection.execute(text(f"DROP TRIGGER {name}"))
+        connection.execute(text("DROP TABLE IF EXISTS search_index"))
+        connection.execute(text("DROP TABLE IF EXISTS track_pairs"))
+
+        for table, rows in (
+            (models.Author, author_rows(spec, rng)),
+            (models.Track, track_rows(spec, rng)),
+            (models.User, user_rows(spec, hashed_password, salt)),
+            (models.Playlist, playlist_rows(spec, rng)),
+            (models.association_table, association_rows(spec, rng)),
+        ):
+            for chunk in chunked(rows):
+                connection.execute(insert(table), chunk)
+
+        fulltext.create_search_index(connection)
+        cooccurrence.create_cooccurrence_index(connection)
+        snapshot.create_change_log(connection)
+    with engine.connect() as connection:
+        connection.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+    engine.dispose()
+
+
+def cached_catalog(preset: str, spec: CatalogSpec) -> Path:
+    """The path of the catalog for `spec` in the temp directory, generated on first use."""
+    # a new migration or generator version gets a new catalog
+    name = f"audio-server-bench-{preset}-{spec.seed}-g{GENERATOR_VERSION}-v{migrations.LATEST_VERSION}.db"
+    path = Path(tempfile.gettempdir()) / name
+    if not path.exists():
+        print(f"generating {path} ...", flush=True)
+        started = time.perf_counter()
+        generate(str(path) + ".partial", spec)
+        os.replace(str(path) + ".partial", path)
+        print(f"generated in {time.perf_counter() - started:.1f}s", flush=True)
+    return path
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(description="Generate a synthetic catalog database.")
+    parser.add_argument("path")
+    parser.add_argument("--preset", choices=PRESETS, default="small")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    spec = PRESETS[args.preset]._replace(seed=args.seed)
+    generate(args.path, spec)
+    print(f"{args.path}: {spec}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
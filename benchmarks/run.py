@@ -0,0 +1,358 @@
+"""Per-route latency and throughput of the app against a synthetic catalog.
+
+Requests are sent in-process straight to the ASGI app, so the numbers
+include routing, the database and template rendering but no network or
+server overhead. Each run works on a fresh copy of a seeded catalog (see
+benchmarks/catalog.py), which is generated once and kept in the temp
+directory.
+
+Usage::
+
+    python -m benchmarks.run                     # compare with baseline.json
+    python -m benchmarks.run --preset large      # 10k authors, 1M tracks
+    python -m benchmarks.run --update-baseline   # store this run as the baseline
+
+Requests go one at a time unless --concurrency is raised, which keeps the
+percentiles about the routes rather than about queueing. A route regresses
+when its p50 or p95 latency is more than --tolerance (25%) plus --slack
+(2 ms) above the baseline. Baselines are only comparable on the machine
+that recorded them.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from http.cookies import SimpleCookie
+from pathlib import Path
+from typing import Callable, NamedTuple
+from urllib.parse import urlencode
+
+# db/database.py binds its engine at import time, so the run's database is
+# chosen before anything from the app is imported
+RUN_DIRECTORY = Path(tempfile.mkdtemp(prefix="audio-server-bench-"))
+RUN_DATABASE = RUN_DIRECTORY / "catalog.db"
+os.environ["DATABASE_URL"] = f"sqlite:///{RUN_DATABASE}"
+os.environ["METADATA_SCANNER"] = "0"
+# the benchmark client would soon run out of its rate limit
+os.environ["RATE_LIMITS"] = "0"
+
+from benchmarks import catalog
+from db.snapshot import catalog_snapshot
+
+REPO_DIRECTORY = Path(__file__).resolve().parent.parent
+BASELINE_PATH = Path(__file__).resolve().parent / "baseline.json"
+WARMUP_REQUESTS = 20
+
+
+class Response(NamedTuple):
+    status: int
+    headers: list[tuple[bytes, bytes]]
+    body: bytes
+
+
+class Client:
+    """A minimal ASGI client that keeps cookies, enough for the app's routes."""
+
+    def __init__(self, app):
+        self.app = app
+        self.cookies: dict[str, str] = {}
+
+    async def request(self, method: str, url: str, *, json_body=None, form=None) -> Response:
+        path, _, query = url.partition("?")
+        headers = [(b"host", b"bench")]
+        body = b""
+        if json_body is not None:
+            body = json.dumps(json_body).encode()
+            headers.append((b"content-type", b"application/json"))
+        elif form is not None:
+            body = urlencode(form).encode()
+            headers.append((b"content-type", b"application/x-www-form-urlencoded"))
+        if body:
+            headers.append((b"content-length", str(len(body)).encode()))
+        if self.cookies:
+            cookie = "; ".join(f"{name}={value}" for name, value in self.cookies.items())
+            headers.append((b"cookie", cookie.encode()))
+
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "root_path": "",
+            "query_string": query.encode(),
+            "headers": headers,
+            "client": ("127.0.0.1", 50000),
+            "server": ("bench", 80),
+        }
+        finished = asyncio.Event()
+        sent_body = False
+        status = 0
+        response_headers = []
+        chunks = []
+
+        async def receive():
+            nonlocal sent_body
+            if not sent_body:
+                sent_body = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await finished.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status, response_headers
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                response_headers = message.get("headers", [])
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body", False):
+                    finished.set()
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            finished.set()
+
+        for name, value in response_headers:
+            if name == b"set-cookie":
+                for morsel in SimpleCookie(value.decode("latin-1")).values():
+                    self.cookies[morsel.key] = morsel.value
+        return Response(status, response_headers, b"".join(chunks))
+
+
+class Scenario(NamedTuple):
+    name: str
+    method: str
+    # called with the request number, returns the url and request options
+    make_request: Callable[[int], tuple[str, dict]]
+    requests: int
+
+
+class Result(NamedTuple):
+    name: str
+    requests: int
+    errors: int
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    max_ms: float
+    rps: float
+
+
+def build_scenarios(spec: catalog.CatalogSpec, requests: int, seed: int) -> list[Scenario]:
+    rng = random.Random(seed)
+    # popular authors and playlists are requested more often, as in the catalog itself
+    author_aliases = [f"author{catalog.skewed_index(rng, spec.authors, 2) + 1}" for _ in range(requests)]
+    playlist_aliases = [f"playlist{catalog.skewed_index(rng, spec.playlists, 2) + 1}" for _ in range(requests)]
+    track_aliases = [f"track{catalog.skewed_index(rng, spec.tracks, 2) + 1}" for _ in range(requests)]
+    limits = [rng.choice((20, 50, 100)) for _ in range(requests)]
+
+    # the write scenarios run in this order on playlists of their own
+    writes = max(requests // 4, 2)
+
+    def own_playlist(i: int) -> str:
+        return f"bench-playlist-{i % writes}"
+
+    return [
+        Scenario("GET /", "GET", lambda i: (f"/?limit={limits[i]}", {}), requests),
+        Scenario("GET /tracks/all", "GET", lambda i: (f"/tracks/all?limit={limits[i]}", {}), requests),
+        Scenario("GET /authors/{alias}", "GET", lambda i: (f"/authors/{author_aliases[i]}", {}), requests),
+        Scenario("GET /playlists/all", "GET", lambda i: (f"/playlists/all?limit={limits[i]}", {}), requests),
+        Scenario("GET /playlists/{alias}", "GET", lambda i: (f"/playlists/{playlist_aliases[i]}", {}), requests),
+        # bcrypt makes every login cost tens of milliseconds of CPU
+        Scenario(
+            "POST /token", "POST",
+            lambda i: ("/token", {"form": {"username": catalog.BENCH_USERNAME, "password": catalog.BENCH_PASSWORD}}),
+            max(requests // 10, 2),
+        ),
+        Scenario(
+            "POST /playlists/", "POST",
+            lambda i: ("/playlists/", {"json_body": {
+                "title": f"Bench playlist {i}", "alias": own_playlist(i), "description": "benchmark"
+            }}),
+            writes,
+        ),
+        Scenario(
+            "POST /playlists/{alias}/tracks/{track}", "POST",
+            lambda i: (f"/playlists/{own_playlist(i)}/tracks/{track_aliases[i]}", {}),
+            requests,
+        ),
+        Scenario(
+            "PATCH /playlists/{alias}/tracks", "PATCH",
+            lambda i: (f"/playlists/{own_playlist(i)}/tracks", {"json_body": {"operations": [
+                {"op": "move", "track": track_aliases[i], "position": 0},
+            ]}}),
+            requests,
+        ),
+        Scenario(
+            "DELETE /playlists/{alias}", "DELETE",
+            lambda i: (f"/playlists/{own_playlist(i)}", {}),
+            writes,
+        ),
+    ]
+
+
+async def run_scenario(client: Client, scenario: Scenario, concurrency: int) -> Result:
+    latencies = []
+    errors = 0
+    numbers = iter(range(scenario.requests))
+
+    async def worker():
+        nonlocal errors
+        for i in numbers:
+            url, options = scenario.make_request(i)
+            started = time.perf_counter()
+            response = await client.request(scenario.method, url, **options)
+            latencies.append(time.perf_counter() - started)
+            errors += response.status != 200
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return Result(
+        name=scenario.name,
+        requests=len(latencies),
+        errors=errors,
+        p50_ms=percentiles[49] * 1000,
+        p95_ms=percentiles[94] * 1000,
+        p99_ms=percentiles[98] * 1000,
+        max_ms=max(latencies) * 1000,
+        rps=len(latencies) / elapsed,
+    )
+
+
+async def run_benchmarks(app, scenarios: list[Scenario], concurrency: int) -> list[Result]:
+    client = Client(app)
+    await app.router.startup()
+    try:
+        if catalog_snapshot.enabled:
+            await asyncio.to_thread(catalog_snapshot.loaded.wait)
+
+        login = await client.request("POST", "/token", form={
+            "username": catalog.BENCH_USERNAME, "password": catalog.BENCH_PASSWORD
+        })
+        if login.status != 200:
+            raise RuntimeError(f"could not log in as {catalog.BENCH_USERNAME}: {login.status} {login.body!r}")
+
+        for scenario in scenarios:
+            if scenario.method == "GET":
+                await run_scenario(client, scenario._replace(requests=WARMUP_REQUESTS), concurrency)
+
+        results = []
+        for scenario in scenarios:
+            result = await run_scenario(client, scenario, concurrency)
+            print(format_result(result), flush=True)
+            results.append(result)
+        return results
+    finally:
+        await app.router.shutdown()
+
+
+def format_result(result: Result) -> str:
+    return (
+        f"{result.name:<42} {result.requests:>6} {result.errors:>6} {result.p50_ms:>9.2f} "
+        f"{result.p95_ms:>9.2f} {result.p99_ms:>9.2f} {result.max_ms:>9.2f} {result.rps:>9.1f}"
+    )
+
+
+def compare(results: list[Result], baseline: dict, tolerance: float, slack: float) -> list[str]:
+    regressions = []
+    for result in results:
+        if result.errors:
+            regressions.append(f"{result.name}: {result.errors} failed requests")
+        expected = baseline["routes"].get(result.name)
+        if expected is None:
+            continue
+        for metric in ("p50_ms", "p95_ms"):
+            limit = expected[metric] * (1 + tolerance) + slack
+            if getattr(result, metric) > limit:
+                regressions.append(
+                    f"{result.name}: {metric} {getattr(result, metric):.2f} > {limit:.2f} "
+                    f"(baseline {expected[metric]:.2f})"
+                )
+    return regressions
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the app's routes against a synthetic catalog.")
+    parser.add_argument("--preset", choices=catalog.PRESETS, default="small")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--requests", type=int, default=200, help="requests per read route, at least 2")
+    parser.add_argument("--concurrency", type=int, default=1, help="requests in flight at once")
+    parser.add_argument("--page-cache", action="store_true", help="keep the page cache on")
+    parser.add_argument("--snapshot", action="store_true", help="serve catalog reads from db.snapshot")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--slack", type=float, default=2.0, help="milliseconds")
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args(argv)
+    if args.requests < 2:
+        parser.error("--requests must be at least 2")
+
+    spec = catalog.PRESETS[args.preset]._replace(seed=args.seed)
+    path = catalog.cached_catalog(args.preset, spec)
+
+    try:
+        # every run starts from the same data, the write routes change it
+        shutil.copyfile(path, RUN_DATABASE)
+        if not args.page_cache:
+            os.environ["PAGE_CACHE_BYTES"] = "0"
+        # db.snapshot read its setting when benchmarks.catalog imported it
+        catalog_snapshot.enabled = args.snapshot
+        os.chdir(REPO_DIRECTORY)
+        from main import app
+
+        print(f"{'route':<42} {'count':>6} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} "
+              f"{'p99 ms':>9} {'max ms':>9} {'req/s':>9}")
+        scenarios = build_scenarios(spec, args.requests, args.seed)
+        results = asyncio.run(run_benchmarks(app, scenarios, args.concurrency))
+    finally:
+        shutil.rmtree(RUN_DIRECTORY, ignore_errors=True)
+
+    run = {
+        "spec": spec._asdict(),
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "page_cache": args.page_cache,
+        "snapshot": args.snapshot,
+        "routes": {
+            result.name: {"p50_ms": round(result.p50_ms, 3), "p95_ms": round(result.p95_ms, 3)}
+            for result in results
+        },
+    }
+    baselines = json.loads(BASELINE_PATH.read_text()) if BASELINE_PATH.exists() else {}
+
+    if args.update_baseline:
+        baselines[args.preset] = run
+        BASELINE_PATH.write_text(json.dumps(baselines, indent=2) + "\n")
+        print(f"baseline for {args.preset} written to {BASELINE_PATH}")
+        return 0
+
+    baseline = baselines.get(args.preset)
+    if baseline is None:
+        print(f"no baseline for {args.preset}, run with --update-baseline first", file=sys.stderr)
+        return 2
+    settings = ("spec", "requests", "concurrency", "page_cache", "snapshot")
+    if any(baseline[key] != run[key] for key in settings):
+        print(f"the baseline was recorded with different settings: "
+              f"{ {key: baseline[key] for key in settings} }", file=sys.stderr)
+        return 2
+
+    regressions = compare(results, baseline, args.tolerance, args.slack)
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,92 @@
+"""Resident memory of the catalog snapshot next to the ORM identity map.
+
+Each mode loads every author and track of a generated catalog in a fresh
+child process and reports how much its resident set grew:
+
+- ``snapshot``: db.snapshot.CatalogState, what CATALOG_SNAPSHOT=1 keeps
+- ``orm``: models.Author with their tracks held in one Session
+
+Usage::
+
+    python -m benchmarks.snapshot_memory --preset large
+"""
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+import time
+
+from benchmarks import catalog
+
+MODES = ("snapshot", "orm")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def resident_bytes() -> int:
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * PAGE_SIZE
+
+
+def measure(mode: str, path: str) -> dict:
+    from sqlalchemy.orm import Session, selectinload
+
+    from db import models
+    from db.database import make_engine
+    from db.snapshot import CatalogState
+
+    engine = make_engine(f"sqlite:///{path}")
+    gc.collect()
+    before = resident_bytes()
+    started = time.perf_counter()
+
+    if mode == "snapshot":
+        with engine.connect() as connection:
+            held = CatalogState.load(connection)
+        tracks = len(held.tracks)
+    else:
+        held = Session(engine)
+        authors = held.query(models.Author).options(selectinload(models.Author.tracks)).all()
+        tracks = sum(len(author.tracks) for author in authors)
+
+    seconds = time.perf_counter() - started
+    gc.collect()
+    return {
+        "mode": mode,
+        "tracks": tracks,
+        "load_seconds": round(seconds, 2),
+        "resident_mb": round((resident_bytes() - before) / 2**20, 1),
+    }
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(description="Compare the memory of the catalog snapshot and the ORM.")
+    parser.add_argument("--preset", choices=catalog.PRESETS, default="small")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--measure", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--path", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.measure:
+        print(json.dumps(measure(args.measure, args.path)))
+        return 0
+
+    spec = catalog.PRESETS[args.preset]._replace(seed=args.seed)
+    path = catalog.cached_catalog(args.preset, spec)
+    print(f"{'mode':<10} {'tracks':>9} {'load s':>8} {'resident MB':>12} {'bytes/track':>12}")
+    for mode in MODES:
+        # a process of its own, so neither mode inherits the other's heap
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.snapshot_memory", "--measure", mode, "--path", str(path)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        result = json.loads(output.splitlines()[-1])
+        per_track = result["resident_mb"] * 2**20 / max(result["tracks"], 1)
+        print(f"{mode:<10} {result['tracks']:>9} {result['load_seconds']:>8.2f} "
+              f"{result['resident_mb']:>12.1f} {per_track:>12.0f}", flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
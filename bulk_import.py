@@ -0,0 +1,257 @@
+import argparse
+import csv
+import io
+import json
+import sys
+import tempfile
+from typing import IO, Annotated, Iterator, Literal, NamedTuple
+
+from fastapi import Depends, APIRouter, Query
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+
+from db import crud
+from handle_db import get_db
+from handle_post_request import ALLOWED_EXTENSIONS
+from metadata_scanner import metadata_scanner
+from page_cache import invalidate
+from principal_cache import Principal
+from security import get_current_user, check_admin_rights
+
+import_router = APIRouter()
+
+CHUNK_SIZE = 1000
+SPOOL_MAX_MEMORY = 8 * 1024 * 1024
+MAX_REPORTED_ERRORS = 1000
+
+REQUIRED_FIELDS = ("author_alias", "title", "alias", "track_url")
+OPTIONAL_FIELDS = ("author_name", "description", "image_url")
+TRACK_FIELDS = ("title", "alias", "description", "track_url", "image_url")
+
+
+class RowError(NamedTuple):
+    line: int
+    error: str
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        self.failed = 0
+        self.authors_created = 0
+        self.errors: list[RowError] = []
+        self.author_ids: set[int] = set()
+
+    def fail(self, line: int, error: str):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(RowError(line, error))
+
+    def as_dict(self):
+        return {
+            "rows": self.rows,
+            "imported": self.imported,
+            "failed": self.failed,
+            "authors_created": self.authors_created,
+            "errors": [error._asdict() for error in self.errors],
+        }
+
+
+def read_rows(file: IO[bytes], file_format: str) -> Iterator[tuple[int, dict] | RowError]:
+    text = io.TextIOWrapper(file, encoding="utf-8", newline="")
+    if file_format == "csv":
+        reader = csv.DictReader(text)
+        try:
+            for row in reader:
+                yield reader.line_num, row
+        except (csv.Error, UnicodeDecodeError) as e:
+            yield RowError(reader.line_num, f"Malformed CSV, import stopped: {e}")
+        return
+
+    line_number = 0
+    try:
+        for line_number, line in enumerate(text, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield RowError(line_number, f"Malformed JSON: {e.msg}")
+                continue
+            if not isinstance(row, dict):
+                yield RowError(line_number, "Expected a JSON object")
+                continue
+            yield line_number, row
+    except UnicodeDecodeError as e:
+        yield RowError(line_number + 1, f"Malformed UTF-8, import stopped: {e}")
+
+
+def validate_row(row: dict) -> str | None:
+    for field in REQUIRED_FIELDS:
+        value = row.get(field)
+        if not isinstance(value, str) or not value.strip():
+            return f"Missing {field}"
+    for field in OPTIONAL_FIELDS:
+        # JSON lines can hold numbers or objects, which the API could not serve back
+        if row.get(field) is not None and not isinstance(row[field], str):
+            return f"{field} must be a string"
+    if row["track_url"].split(".")[-1] not in ALLOWED_EXTENSIONS:
+        return "The file extension is not allowed"
+    return None
+
+
+def insert_rows(db: Session, create, rows: list[dict]) -> tuple[list[dict], list[int]]:
+    """Inserts `rows` in one executemany, retrying one by one if any of them conflicts.
+
+    Returns the inserted rows and the indexes of the rejected ones.
+    """
+    try:
+        create(db, rows)
+        db.commit()
+        return rows, []
+    except IntegrityError:
+        db.rollback()
+
+    inserted, rejected = [], []
+    for index, row in enumerate(rows):
+        try:
+            create(db, [row])
+            db.commit()
+            inserted.append(row)
+        except IntegrityError:
+            db.rollback()
+            rejected.append(index)
+    return inserted, rejected
+
+
+def import_chunk(db: Session, chunk: list[tuple[int, dict]], author_ids: dict[str, int], report: ImportReport):
+    unresolved = list({row["author_alias"] for _, row in chunk} - author_ids.keys())
+    if unresolved:
+        author_ids.update(crud.get_author_ids_by_alias(db, unresolved))
+
+    new_authors: dict[str, dict] = {}
+    for _, row in chunk:
+        alias = row["author_alias"]
+        if alias not in author_ids and alias not in new_authors and row.get("author_name"):
+            new_authors[alias] = {"alias": alias, "name": row["author_name"]}
+
+    author_errors = {}
+    if new_authors:
+        authors = list(new_authors.values())
+        created, rejected = insert_rows(db, crud.bulk_create_authors, authors)
+        report.authors_created += len(created)
+        for index in rejected:
+            author_errors[authors[index]["alias"]] = (
+                f"Could not create author '{authors[index]['alias']}', the name is already taken"
+            )
+        author_ids.update(crud.get_author_ids_by_alias(db, list(new_authors)))
+
+    taken_aliases, taken_urls = crud.get_taken_track_keys(
+        db,
+        [row["alias"] for _, row in chunk],
+        [row["track_url"] for _, row in chunk]
+    )
+    tracks, lines = [], []
+    for line, row in chunk:
+        author_id = author_ids.get(row["author_alias"])
+        if author_id is None:
+            report.fail(line, author_errors.get(
+                row["author_alias"], f"Unknown author '{row['author_alias']}'"
+            ))
+        elif row["alias"] in taken_aliases:
+            report.fail(line, "Track with this alias already exists")
+        elif row["track_url"] in taken_urls:
+            report.fail(line, "Track with this track_url already exists")
+        else:
+            taken_aliases.add(row["alias"])
+            taken_urls.add(row["track_url"])
+            # CSV has no nulls, so empty optional columns become NULL
+            track = {field: row.get(field) or None for field in TRACK_FIELDS}
+            tracks.append(track | {"author_id": author_id})
+            lines.append(line)
+
+    created, rejected = insert_rows(db, crud.bulk_create_tracks, tracks)
+    for index in rejected:
+        report.fail(lines[index], "Track conflicts with an existing track")
+    report.imported += len(created)
+    report.author_ids.update(track["author_id"] for track in created)
+
+
+def import_catalog(db: Session, file: IO[bytes], file_format: str, chunk_size: int = CHUNK_SIZE) -> ImportReport:
+    report = ImportReport()
+    author_ids: dict[str, int] = {}
+    chunk: list[tuple[int, dict]] = []
+
+    for item in read_rows(file, file_format):
+        report.rows += 1
+        if isinstance(item, RowError):
+            report.fail(*item)
+            continue
+
+        line, row = item
+        if error := validate_row(row):
+            report.fail(line, error)
+            continue
+
+        chunk.append((line, row))
+        if len(chunk) >= chunk_size:
+            import_chunk(db, chunk, author_ids, report)
+            chunk = []
+
+    if chunk:
+        import_chunk(db, chunk, author_ids, report)
+    return report
+
+
+@import_router.post("/import")
+async def import_tracks(
+    request: Request,
+    file_format: Annotated[Literal["csv", "jsonl"], Query(alias="format")] = "csv",
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    check_admin_rights(current_user)
+
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY) as spool:
+        async for body_chunk in request.stream():
+            spool.write(body_chunk)
+        spool.seek(0)
+        report = await run_in_threadpool(import_catalog, db, spool, file_format)
+
+    invalidate("authors", "tracks", *(f"author:{author_id}" for author_id in report.author_ids))
+    if report.imported:
+        metadata_scanner.wake()
+    return report.as_dict()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import authors and tracks from a CSV or JSONL file.")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=("csv", "jsonl"), help="defaults to the file extension")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    from db.database import SessionLocal
+
+    file_format = args.format or ("jsonl" if args.path.endswith((".jsonl", ".ndjson")) else "csv")
+    db = SessionLocal()
+    try:
+        with open(args.path, "rb") as file:
+            report = import_catalog(db, file, file_format, args.chunk_size)
+    finally:
+        db.close()
+
+    for error in report.errors:
+        print(f"line {error.line}: {error.error}", file=sys.stderr)
+    print(
+        f"{report.rows} rows, {report.imported} tracks imported, "
+        f"{report.authors_created} authors created, {report.failed} failed"
+    )
+    return 1 if report.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
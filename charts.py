@@ -0,0 +1,49 @@
+from typing import Annotated, Literal
+
+from fastapi import APIRouter, Depends, Path, Query
+from fastapi.responses import Response
+from sqlalchemy.orm import Session
+from starlette.requests import Request
+
+from db import crud
+
+from handle_db import get_read_db
+from query_budget import query_budget
+from app_initialize import templates
+from page_cache import cache_page
+from display_tracks import change_track_data
+from play_recorder import play_recorder, today
+
+charts_router = APIRouter()
+
+CHART_SIZE = 50
+
+
+# sent by the players in static/script.js with navigator.sendBeacon, unknown
+# aliases are only sorted out when the plays are written
+@charts_router.post("/tracks/{track_alias}/play", status_code=202)
+@query_budget(0)
+async def record_play(track_alias: Annotated[str, Path(min_length=3, max_length=50)]):
+    play_recorder.record(track_alias)
+    return Response(status_code=202)
+
+
+@charts_router.get("/charts")
+@query_budget(1)
+def read_chart(
+    request: Request,
+    period: Literal["day", "week"] = "day",
+    limit: Annotated[int, Query(ge=1, le=CHART_SIZE)] = CHART_SIZE,
+    db: Session = Depends(get_read_db)
+):
+    day = today()
+    entries = crud.get_chart(db, period, day, limit)
+    cache_page(request, "charts")
+    return templates.TemplateResponse(
+        "charts.html",
+        {"request": request,
+         "period": period,
+         "start": crud.period_start(period, day),
+         "songs": change_track_data([entry.track for entry in entries]),
+         "plays": [entry.plays for entry in entries]}
+    )
@@ -0,0 +1,239 @@
+"""How often two tracks are in the same playlist, for "related tracks".
+
+``track_pairs`` holds one row per pair of tracks that share a playlist, with
+the lower track id first. Triggers on ``association`` keep it up to date, so
+adding a track to a playlist of n tracks updates n - 1 pairs, however the
+track got there, and deleting a track cascades into the pairs. Moving a track
+updates its position, which no trigger watches. A deleted playlist takes back
+all of its pairs at once, its cascaded rows then skip the triggers.
+
+Playlists longer than MAX_PLAYLIST_TRACKS are not counted: their pairs grow
+with the square of their length and say little about any two of their
+tracks. The triggers add or remove a playlist's pairs when it crosses the
+limit. Changing it means rebuilding the table.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event, select, text
+from sqlalchemy.orm import Session
+
+from . import models
+
+MAX_PLAYLIST_TRACKS = 100
+RELATED_CACHE_TTL = float(os.environ.get("RELATED_CACHE_TTL", 300))  # seconds
+RELATED_CACHE_SIZE = int(os.environ.get("RELATED_CACHE_SIZE", 10_000))
+# related tracks kept per cached track, the most a page shows
+RELATED_LIMIT = 50
+
+# tracks of the playlist, other than the one that triggered
+OTHER_TRACKS = "SELECT track_id FROM association WHERE playlist_id = {row}.playlist_id AND track_id != {row}.track_id"
+PLAYLIST_SIZE = "(SELECT count(*) FROM association WHERE playlist_id = {row}.playlist_id)"
+# false while a deleted playlist's rows cascade, checked before the count
+PLAYLIST_EXISTS = "EXISTS (SELECT 1 FROM playlists WHERE id = {row}.playlist_id)"
+ALL_PAIRS = """
+    SELECT a.track_id, b.track_id FROM association a
+    JOIN association b ON b.playlist_id = a.playlist_id AND b.track_id > a.track_id
+    WHERE a.playlist_id = {row}.playlist_id AND a.track_id != {row}.track_id AND b.track_id != {row}.track_id
+"""
+# all pairs of a playlist, from a trigger on playlists
+PLAYLIST_PAIRS = """
+    SELECT a.track_id, b.track_id FROM association a
+    JOIN association b ON b.playlist_id = a.playlist_id AND b.track_id > a.track_id
+    WHERE a.playlist_id = old.id
+"""
+
+
+def add_pairs(pairs: str) -> str:
+    return f"""
+        INSERT INTO track_pairs (low_id, high_id, playlists)
+        SELECT *, 1 FROM ({pairs}) WHERE true
+        ON CONFLICT (low_id, high_id) DO UPDATE SET playlists = playlists + 1;
+    """
+
+
+def remove_pairs(pairs: str) -> str:
+    return f"""
+        UPDATE track_pairs SET playlists = playlists - 1 WHERE (low_id, high_id) IN ({pairs});
+        DELETE FROM track_pairs WHERE playlists = 0 AND (low_id, high_id) IN ({pairs});
+    """
+
+
+def pairs_with(row: str) -> str:
+    return (
+        f"SELECT min({row}.track_id, track_id), max({row}.track_id, track_id) "
+        f"FROM ({OTHER_TRACKS.format(row=row)})"
+    )
+
+
+COOCCURRENCE_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS track_pairs (
+        low_id INTEGER NOT NULL,
+        high_id INTEGER NOT NULL,
+        playlists INTEGER NOT NULL,
+        PRIMARY KEY (low_id, high_id)
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_track_pairs_high_id ON track_pairs (high_id)",
+    # a playlist still within the limit pairs the new track with the others
+    f"""
+    CREATE TRIGGER IF NOT EXISTS association_pairs_insert AFTER INSERT ON association
+    WHEN {PLAYLIST_SIZE.format(row="new")} <= {MAX_PLAYLIST_TRACKS} BEGIN
+        {add_pairs(pairs_with("new"))}
+    END
+    """,
+    # one track over the limit, the pairs it had so far are taken back
+    f"""
+    CREATE TRIGGER IF NOT EXISTS association_pairs_over_limit AFTER INSERT ON association
+    WHEN {PLAYLIST_SIZE.format(row="new")} = {MAX_PLAYLIST_TRACKS + 1} BEGIN
+        {remove_pairs(ALL_PAIRS.format(row="new"))}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS association_pairs_delete AFTER DELETE ON association
+    WHEN {PLAYLIST_EXISTS.format(row="old")} AND {PLAYLIST_SIZE.format(row="old")} < {MAX_PLAYLIST_TRACKS} BEGIN
+        {remove_pairs(pairs_with("old"))}
+    END
+    """,
+    # back within the limit, all its pairs count again
+    f"""
+    CREATE TRIGGER IF NOT EXISTS association_pairs_within_limit AFTER DELETE ON association
+    WHEN {PLAYLIST_EXISTS.format(row="old")} AND {PLAYLIST_SIZE.format(row="old")} = {MAX_PLAYLIST_TRACKS} BEGIN
+        {add_pairs(ALL_PAIRS.format(row="old"))}
+    END
+    """,
+    # a deleted playlist takes back its pairs in one statement, a long one
+    # would otherwise shrink back within the limit row by row on its way out
+    f"""
+    CREATE TRIGGER IF NOT EXISTS playlists_pairs_delete BEFORE DELETE ON playlists
+    WHEN (SELECT count(*) FROM association WHERE playlist_id = old.id) <= {MAX_PLAYLIST_TRACKS} BEGIN
+        {remove_pairs(PLAYLIST_PAIRS)}
+    END
+    """,
+]
+
+REBUILD_COOCCURRENCE = [
+    "DELETE FROM track_pairs",
+    f"""
+    INSERT INTO track_pairs (low_id, high_id, playlists)
+    SELECT a.track_id, b.track_id, count(*) FROM association a
+    JOIN association b ON b.playlist_id = a.playlist_id AND b.track_id > a.track_id
+    WHERE a.playlist_id IN (
+        SELECT playlist_id FROM association GROUP BY playlist_id HAVING count(*) <= {MAX_PLAYLIST_TRACKS}
+    )
+    GROUP BY a.track_id, b.track_id
+    """,
+]
+
+
+def create_cooccurrence_index(connection):
+    """Creates track_pairs and its triggers, filling it on first creation."""
+    exists = connection.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'track_pairs'"
+    )).first()
+    for statement in COOCCURRENCE_DDL:
+        connection.execute(text(statement))
+    if not exists:
+        for statement in REBUILD_COOCCURRENCE:
+            connection.execute(text(statement))
+
+
+def related_track_ids(db: Session, track_id: int, limit: int = RELATED_LIMIT) -> list[tuple[int, int]]:
+    """(track id, shared playlists) of the tracks most often in a playlist with `track_id`."""
+    related = related_cache.get(track_id)
+    if related is None:
+        rows = db.execute(
+            text(
+                "SELECT high_id, playlists FROM track_pairs WHERE low_id = :id "
+                "UNION ALL "
+                "SELECT low_id, playlists FROM track_pairs WHERE high_id = :id "
+                "ORDER BY playlists DESC, 1 LIMIT :limit"
+            ),
+            {"id": track_id, "limit": RELATED_LIMIT}
+        ).all()
+        related = [tuple(row) for row in rows]
+        related_cache.put(track_id, related)
+    return related[:limit]
+
+
+class RelatedCache:
+    """related_track_ids results by track id, least recently used first."""
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries: OrderedDict[int, tuple[list, float]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, track_id: int) -> list | None:
+        with self.lock:
+            entry = self.entries.get(track_id)
+            if entry is None:
+                return None
+
+            related, expires_at = entry
+            if expires_at <= time.time():
+                del self.entries[track_id]
+                return None
+
+            self.entries.move_to_end(track_id)
+            return related
+
+    def put(self, track_id: int, related: list):
+        with self.lock:
+            self.entries[track_id] = (related, time.time() + self.ttl)
+            self.entries.move_to_end(track_id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, track_ids):
+        with self.lock:
+            for track_id in track_ids:
+                self.entries.pop(track_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+# other processes' changes show up once their entries expire
+related_cache = RelatedCache(RELATED_CACHE_TTL, RELATED_CACHE_SIZE)
+
+
+def mark_playlist_changed(db: Session, playlist_id: int | None = None, playlist_alias: str | None = None,
+                          track_ids=()):
+    """Called by crud functions before they change the tracks of a playlist, with
+    any tracks that are not in it yet. Their cached related tracks are dropped on commit."""
+    association = models.association_table
+    query = select(association.c.track_id)
+    if playlist_id:
+        query = query.where(association.c.playlist_id == playlist_id)
+    else:
+        query = query.join(models.Playlist, models.Playlist.id == association.c.playlist_id).where(
+            models.Playlist.alias == playlist_alias
+        )
+    changed = db.info.setdefault("related_changed", set())
+    changed.update(db.execute(query).scalars())
+    changed.update(track_ids)
+
+
+def mark_tracks_deleted(db: Session):
+    # the pairs of every playlist the tracks were in are gone
+    db.info["related_cleared"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def invalidate_related(session: Session):
+    if session.info.pop("related_cleared", False):
+        related_cache.clear()
+    if changed := session.info.pop("related_changed", None):
+        related_cache.invalidate(changed)
+
+
+@event.listens_for(Session, "after_rollback")
+def forget_related_changes(session: Session):
+    session.info.pop("related_cleared", None)
+    session.info.pop("related_changed", None)
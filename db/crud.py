@@ -1,6 +1,13 @@
-from sqlalchemy.orm import Session, joinedload
-from . import models, schemas
+from collections import Counter
+from datetime import date, timedelta
+
+from sqlalchemy import bindparam, delete, func, insert, select, text, update
+from sqlalchemy.orm import Session, selectinload
+from . import cooccurrence, models, schemas
+from .pagination import Page, keyset_page, list_page
+from .snapshot import catalog_snapshot, mark_catalog_changed
 from passlib.context import CryptContext
+from typing import NamedTuple
 
 import secrets
 
@@ -21,9 +28,12 @@ def authenticate_user(db: Session, username: str, password: str):
 
 
 def create_user(db: Session, username: str, password: str, rights: str = "user"):
-    salt = str(secrets.token_bytes(16))
-    
+    salt = make_salt()
     hashed_password = get_password_hash(password + salt)
+    return create_user_with_hash(db, username, hashed_password, salt, rights)
+
+
+def create_user_with_hash(db: Session, username: str, hashed_password: str, salt: str, rights: str = "user"):
     db_user = models.User(username=username, hashed_password=hashed_password, salt=salt, rights=rights)
     db.add(db_user)
     db.commit()
@@ -31,6 +41,10 @@ def create_user(db: Session, username: str, password: str, rights: str = "user")
     return db_user
 
 
+def make_salt():
+    return str(secrets.token_bytes(16))
+
+
 def get_password_hash(password):
     return pwd_context.hash(password)
 
@@ -42,94 +56,350 @@ def verify_password(plain_password, hashed_password, salt):
 # AUTHOR
 
 
+# The reads of authors and tracks below are served from the catalog snapshot
+# when it is enabled and `db` is a read session, and fall back to SQL for
+# anything the snapshot does not have.
+
+
 def get_author(db: Session, author_id: int | None = None, author_alias: str | None = None):
+    if (snapshot := catalog_snapshot.serving(db)) is not None:
+        if author := snapshot.get_author(author_id, author_alias):
+            return author
     if author_id:
         return db.query(models.Author).filter(models.Author.id == author_id).first()
     if author_alias:
         return db.query(models.Author).filter(models.Author.alias == author_alias).first()
 
 
-def get_authors(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Author).offset(skip).limit(limit).all()
+def get_authors(db: Session, cursor: str | None = None, limit: int = 100, with_tracks: bool = False) -> Page:
+    if (snapshot := catalog_snapshot.serving(db)) is not None:
+        return list_page(snapshot.author_list, cursor, limit)
+    query = db.query(models.Author)
+    if with_tracks:
+        query = query.options(selectinload(models.Author.tracks))
+    return keyset_page(query, [models.Author.id], cursor, limit)
 
 
 def create_author(db: Session, author: schemas.AuthorCreate):
     db_author = models.Author(**author.model_dump())
 
     db.add(db_author)
+    mark_catalog_changed(db)
     db.commit()
     db.refresh(db_author)
 
     return db_author
 
+# The deletes below are single statements, the database cascades them to
+# tracks and playlist entries (see the ondelete rules in models).
 def delete_author_with_tracks(db: Session, author_id: int | None = None, author_alias: str | None = None):
-    author = db.query(models.Author)
+    statement = delete(models.Author)
     if author_id:
-        author = author.filter(models.Author.id == author_id).first()
+        statement = statement.where(models.Author.id == author_id)
     else:
-        author = author.filter(models.Author.alias == author_alias).first()
-
-    if author:
-        tracks = db.query(models.Track).filter(models.Track.author_id == author_id).all()
-        for track in tracks:
-            db.delete(track)
-        
-        db.delete(author)
-        db.commit()
-        return True
-    return False
+        statement = statement.where(models.Author.alias == author_alias)
+
+    deleted = db.execute(statement, execution_options={"synchronize_session": False}).rowcount
+    mark_catalog_changed(db)
+    cooccurrence.mark_tracks_deleted(db)
+    db.commit()
+    return deleted > 0
 
 
 # TRACK
 
 
 def get_track(db: Session, track_id:int | None = None, track_alias: str | None = None):
+    if (snapshot := catalog_snapshot.serving(db)) is not None:
+        if track := snapshot.get_track(track_id, track_alias):
+            return track
     if track_id:
         return db.query(models.Track).filter(models.Track.id == track_id).first()
     if track_alias:
         return db.query(models.Track).filter(models.Track.alias == track_alias).first()
 
 
-def get_tracks(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Track).offset(skip).limit(limit).all()
+def get_track_by_content_hash(db: Session, content_hash: str):
+    return db.query(models.Track).filter(models.Track.content_hash == content_hash).first()
+
+
+def get_tracks(db: Session, cursor: str | None = None, limit: int = 100) -> Page:
+    if (snapshot := catalog_snapshot.serving(db)) is not None:
+        return list_page(snapshot.tracks, cursor, limit)
+    return keyset_page(db.query(models.Track), [models.Track.id], cursor, limit)
 
 
 def get_tracks_by_an_author(
     db: Session,
     author_id: int | None = None,
     author_alias: str | None = None,
-    skip: int = 0,
+    cursor: str | None = None,
     limit: int = 100
-):
+) -> Page:
     if author_id is None:
-        author_id = get_author(db, author_alias=author_alias)
-    return db.query(models.Track).filter(models.Track.author_id == author_id).offset(skip).limit(limit).all()
-
-
-def create_track(db: Session, track: schemas.TrackCreate, author_id: int| None = None, author_alias: str | None = None):
+        author_id = get_author(db, author_alias=author_alias).id
+    if (snapshot := catalog_snapshot.serving(db)) is not None and author_id in snapshot.authors:
+        return list_page(snapshot.authors[author_id].tracks, cursor, limit)
+    query = db.query(models.Track).filter(models.Track.author_id == author_id)
+    return keyset_page(query, [models.Track.id], cursor, limit)
+
+
+# TRACK LISTINGS
+
+
+class TrackRow(NamedTuple):
+    id: int
+    title: str
+    alias: str
+    track_url: str
+    image_url: str | None
+    author_id: int | None
+    author: str | None
+    duration: float | None
+    mime_type: str | None
+
+
+def _track_rows(db: Session):
+    return db.query(
+        models.Track.id,
+        models.Track.title,
+        models.Track.alias,
+        models.Track.track_url,
+        models.Track.image_url,
+        models.Track.author_id,
+        models.Author.name,
+        models.Track.duration,
+        models.Track.mime_type,
+    ).outerjoin(models.Author, models.Track.author_id == models.Author.id)
+
+
+def list_tracks(db: Session, cursor: str | None = None, limit: int = 100) -> Page:
+    if (snapshot := catalog_snapshot.serving(db)) is not None:
+        return list_page(snapshot.tracks, cursor, limit, convert=_record_to_track_row)
+    return keyset_page(_track_rows(db), [models.Track.id], cursor, limit, convert=_to_track_row)
+
+
+def list_tracks_by_an_author(db: Session, author_id: int, cursor: str | None = None, limit: int = 100) -> Page:
+    if (snapshot := catalog_snapshot.serving(db)) is not None and author_id in snapshot.authors:
+        return list_page(snapshot.authors[author_id].tracks, cursor, limit, convert=_record_to_track_row)
+    query = _track_rows(db).filter(models.Track.author_id == author_id)
+    return keyset_page(query, [models.Track.id], cursor, limit, convert=_to_track_row)
+
+
+def list_playlist_tracks(db: Session, playlist_id: int):
+    query = _track_rows(db).join(
+        models.association_table,
+        models.association_table.c.track_id == models.Track.id
+    ).filter(
+        models.association_table.c.playlist_id == playlist_id
+    ).order_by(models.association_table.c.position)
+    return [TrackRow(*row) for row in query]
+
+
+def _to_track_row(row):
+    return TrackRow(*row)
+
+
+def _record_to_track_row(track) -> TrackRow:
+    return TrackRow(
+        track.id,
+        track.title,
+        track.alias,
+        track.track_url,
+        track.image_url,
+        track.author_id,
+        track.author.name if track.author else None,
+        track.duration,
+        track.mime_type,
+    )
+
+
+def get_track_rows(db: Session, track_ids: list[int]) -> dict[int, TrackRow]:
+    if (snapshot := catalog_snapshot.serving(db)) is not None:
+        tracks = (snapshot.get_track(track_id) for track_id in track_ids)
+        return {track.id: _record_to_track_row(track) for track in tracks if track is not None}
+    if not track_ids:
+        return {}
+    rows = _track_rows(db).filter(models.Track.id.in_(track_ids))
+    return {row.id: TrackRow(*row) for row in rows}
+
+
+def get_track_row(db: Session, track_alias: str):
+    if (snapshot := catalog_snapshot.serving(db)) is not None:
+        if track := snapshot.get_track(track_alias=track_alias):
+            return _record_to_track_row(track)
+    row = _track_rows(db).filter(models.Track.alias == track_alias).first()
+    return TrackRow(*row) if row else None
+
+
+def create_track(
+    db: Session,
+    track: schemas.TrackCreate,
+    author_id: int| None = None,
+    author_alias: str | None = None,
+    content_hash: str | None = None
+):
     if author_id is None:
         author_id = get_author(db, author_alias=author_alias).id
 
-    db_track = models.Track(**track.model_dump(), author_id = author_id)
+    db_track = models.Track(**track.model_dump(), author_id = author_id, content_hash=content_hash)
 
     db.add(db_track)
+    mark_catalog_changed(db)
     db.commit()
     db.refresh(db_track)
 
     return db_track
 
 def delete_track(db: Session, track_id: int | None = None, track_alias: int | None = None):
-    track = db.query(models.Track)
+    statement = delete(models.Track)
     if track_id:
-        track = track.filter(models.Track.id == track_id).first()
+        statement = statement.where(models.Track.id == track_id)
     else:
-        track = track.filter(models.Track.alias == track_alias).first()
+        statement = statement.where(models.Track.alias == track_alias)
 
-    if track:
-        db.delete(track)
-        db.commit()
-        return True
-    return False
+    deleted = db.execute(statement, execution_options={"synchronize_session": False}).rowcount
+    mark_catalog_changed(db)
+    cooccurrence.mark_tracks_deleted(db)
+    db.commit()
+    return deleted > 0
+
+
+class RelatedTrack(NamedTuple):
+    track: TrackRow
+    playlists: int
+
+
+def get_related_tracks(db: Session, track_id: int, limit: int = 20) -> list[RelatedTrack]:
+    """The tracks most often in the same playlists as `track_id`, see db.cooccurrence."""
+    related = cooccurrence.related_track_ids(db, track_id, limit)
+    rows = get_track_rows(db, [related_id for related_id, _ in related])
+    return [RelatedTrack(rows[related_id], playlists) for related_id, playlists in related if related_id in rows]
+
+
+# BULK IMPORT
+
+
+def get_author_ids_by_alias(db: Session, aliases: list[str]) -> dict[str, int]:
+    rows = db.query(models.Author.alias, models.Author.id).filter(models.Author.alias.in_(aliases))
+    return dict(rows.all())
+
+
+def get_taken_track_keys(db: Session, aliases: list[str], track_urls: list[str]) -> tuple[set, set]:
+    taken_aliases = db.query(models.Track.alias).filter(models.Track.alias.in_(aliases))
+    taken_urls = db.query(models.Track.track_url).filter(models.Track.track_url.in_(track_urls))
+    return {alias for alias, in taken_aliases}, {url for url, in taken_urls}
+
+
+# the bulk inserts below run as one executemany each and leave committing to the caller
+def bulk_create_authors(db: Session, authors: list[dict]):
+    if authors:
+        db.execute(insert(models.Author), authors)
+        mark_catalog_changed(db)
+
+
+def bulk_create_tracks(db: Session, tracks: list[dict]):
+    if tracks:
+        db.execute(insert(models.Track), tracks)
+        mark_catalog_changed(db)
+
+
+# AUDIO METADATA
+
+
+class TrackFile(NamedTuple):
+    id: int
+    alias: str
+    author_id: int | None
+    track_url: str
+    file_size: int | None
+    file_mtime: float | None
+
+
+def get_track_files(db: Session, after_id: int = 0, limit: int = 500) -> list[TrackFile]:
+    rows = db.query(
+        models.Track.id,
+        models.Track.alias,
+        models.Track.author_id,
+        models.Track.track_url,
+        models.Track.file_size,
+        models.Track.file_mtime,
+    ).filter(models.Track.id > after_id).order_by(models.Track.id).limit(limit)
+    return [TrackFile(*row) for row in rows]
+
+
+# one executemany keyed by "id", committing is left to the caller
+def update_track_metadata(db: Session, metadata: list[dict]):
+    if metadata:
+        db.execute(update(models.Track), metadata)
+        mark_catalog_changed(db)
+
+
+# PLAYS
+
+
+CHART_PERIODS = ("day", "week")
+
+
+class ChartEntry(NamedTuple):
+    track: TrackRow
+    plays: int
+
+
+def period_start(period: str, day: date) -> date:
+    # weeks start on Monday
+    return day - timedelta(days=day.weekday()) if period == "week" else day
+
+
+# Plays are counted by alias, so recording one needs no lookup, and plays of
+# tracks deleted in the meantime match no row. Committing is left to the caller.
+def add_plays(db: Session, plays: dict[tuple[str, date], int]):
+    totals = Counter()
+    charts = Counter()
+    for (track_alias, day), count in plays.items():
+        totals[track_alias] += count
+        for period in CHART_PERIODS:
+            charts[period, period_start(period, day).isoformat(), track_alias] += count
+    if not totals:
+        return
+
+    tracks = models.Track.__table__
+    db.execute(
+        update(tracks).where(tracks.c.alias == bindparam("track_alias"))
+        .values(play_count=tracks.c.play_count + bindparam("plays")),
+        [{"track_alias": alias, "plays": count} for alias, count in totals.items()]
+    )
+    db.execute(
+        text(
+            "INSERT INTO charts (period, start, track_id, plays) "
+            "SELECT :period, :start, id, :plays FROM tracks WHERE alias = :track_alias "
+            "ON CONFLICT (period, start, track_id) DO UPDATE SET plays = plays + excluded.plays"
+        ),
+        [
+            {"period": period, "start": start, "track_alias": alias, "plays": count}
+            for (period, start, alias), count in charts.items()
+        ]
+    )
+
+
+def prune_charts(db: Session, today: date, days_kept: int, weeks_kept: int):
+    charts = models.chart_table
+    for period, oldest in (
+        ("day", today - timedelta(days=days_kept - 1)),
+        ("week", period_start("week", today) - timedelta(weeks=weeks_kept - 1)),
+    ):
+        db.execute(delete(charts).where(charts.c.period == period, charts.c.start < oldest.isoformat()))
+
+
+def get_chart(db: Session, period: str, day: date, limit: int = 50) -> list[ChartEntry]:
+    charts = models.chart_table
+    rows = _track_rows(db).add_columns(charts.c.plays).join(
+        charts, charts.c.track_id == models.Track.id
+    ).filter(
+        charts.c.period == period,
+        charts.c.start == period_start(period, day).isoformat()
+    ).order_by(charts.c.plays.desc(), charts.c.track_id.desc()).limit(limit)
+    return [ChartEntry(TrackRow(*row[:-1]), row[-1]) for row in rows]
 
 
 # PLAYLIST
@@ -165,49 +435,317 @@ def add_track_to_playlist(
     track_id: int | None = None,
     track_alias: str | None = None
 ):
-    playlist = ''
-    track = ''
     if playlist_id:
-        playlist = db.query(models.Playlist).filter(models.Playlist.id == playlist_id).first()
+        # the route has usually loaded it already, db.get finds it in the session
+        playlist = db.get(models.Playlist, playlist_id)
     else:
-        playlist = db.query(models.Playlist).filter(models.Playlist.alias == playlist_alias).first()
-    
-    if track_id:
-        track = db.query(models.Track).filter(models.Track.id == track_id).first()
-    else:
-        track = db.query(models.Track).filter(models.Track.alias == track_alias).first()
-
+        playlist = get_playlist(db, playlist_alias=playlist_alias, load_tracks=False)
+    track = get_track(db, track_id, track_alias)
 
     if not playlist or not track:
         return None
 
-    playlist.tracks.append(track)
-    db.commit()
-    db.refresh(playlist)
+    if _track_position(db, playlist.id, track.id) is None:
+        _insert_track(db, playlist.id, track.id, _position_for_index(db, playlist.id, None))
+        cooccurrence.mark_playlist_changed(db, playlist.id)
+        db.commit()
     return playlist
 
 
-def get_playlist(db: Session, playlist_id: int | None = None, playlist_alias: str | None = None):
-    query = db.query(models.Playlist).options(joinedload(models.Playlist.tracks))
+# ORDERED PLAYLIST EDITING
+
+# Positions are sparse sort keys, so inserting or moving a track writes one
+# row. A playlist is only renumbered when two neighbouring keys run out of room.
+# Inserting at one spot halves the gap there, so it takes about 32 inserts
+# before the playlist has to be renumbered.
+POSITION_GAP = 1 << 32
+
+
+class PlaylistEdit(NamedTuple):
+    op: str
+    track: str
+    position: int | None = None
+    after: str | None = None
+
+
+class PlaylistEditError(Exception):
+    def __init__(self, index: int, message: str, not_found: bool = False):
+        super().__init__(f"Operation {index}: {message}")
+        self.index = index
+        self.not_found = not_found
+
+
+def _track_position(db: Session, playlist_id: int, track_id: int) -> int | None:
+    association = models.association_table
+    return db.execute(
+        select(association.c.position).where(
+            association.c.playlist_id == playlist_id,
+            association.c.track_id == track_id
+        )
+    ).scalar()
+
+
+def _renumber_playlist(db: Session, playlist_id: int):
+    association = models.association_table
+    track_ids = db.execute(
+        select(association.c.track_id)
+        .where(association.c.playlist_id == playlist_id)
+        .order_by(association.c.position)
+    ).scalars().all()
+    db.execute(
+        update(association).where(
+            association.c.playlist_id == playlist_id,
+            association.c.track_id == bindparam("moved_track_id")
+        ).values(position=bindparam("new_position")),
+        [
+            {"moved_track_id": track_id, "new_position": (index + 1) * POSITION_GAP}
+            for index, track_id in enumerate(track_ids)
+        ]
+    )
+
+
+def _position_for_index(db: Session, playlist_id: int, index: int | None, moving_id: int | None = None) -> int:
+    association = models.association_table
+    positions = select(association.c.position).where(association.c.playlist_id == playlist_id)
+    if moving_id is not None:
+        # a moved track keeps its row until the update, the index is among the others
+        positions = positions.where(association.c.track_id != moving_id)
+
+    if index is not None and index > 0:
+        # the keys just before and at `index`, read from the (playlist_id, position) index
+        around = db.execute(
+            positions.order_by(association.c.position).offset(index - 1).limit(2)
+        ).scalars().all()
+        if len(around) == 2:
+            before, after = around
+            if after - before > 1:
+                return (before + after) // 2
+            _renumber_playlist(db, playlist_id)
+            return _position_for_index(db, playlist_id, index, moving_id)
+
+    if index == 0:
+        first = db.execute(positions.order_by(association.c.position).limit(1)).scalar()
+        if first is not None:
+            return first - POSITION_GAP
+
+    last = db.execute(positions.order_by(association.c.position.desc()).limit(1)).scalar()
+    return POSITION_GAP if last is None else last + POSITION_GAP
+
+
+def _position_after(db: Session, playlist_id: int, track_id: int, moving_id: int | None = None) -> int:
+    """A free position right after `track_id`'s. Unlike an index it is found
+    from the primary key and one seek, wherever the track is in the playlist."""
+    association = models.association_table
+    before = _track_position(db, playlist_id, track_id)
+    following = select(association.c.position).where(
+        association.c.playlist_id == playlist_id, association.c.position > before
+    )
+    if moving_id is not None:
+        following = following.where(association.c.track_id != moving_id)
+    after = db.execute(following.order_by(association.c.position).limit(1)).scalar()
+    if after is None:
+        return before + POSITION_GAP
+    if after - before > 1:
+        return (before + after) // 2
+    _renumber_playlist(db, playlist_id)
+    return _position_after(db, playlist_id, track_id, moving_id)
+
+
+def _insert_track(db: Session, playlist_id: int, track_id: int, position: int):
+    db.execute(insert(models.association_table).values(
+        playlist_id=playlist_id,
+        track_id=track_id,
+        position=position
+    ))
+
+
+def _move_track(db: Session, playlist_id: int, track_id: int, position: int):
+    # an update fires none of the co-occurrence triggers, the pairs stay as they are
+    association = models.association_table
+    db.execute(update(association).where(
+        association.c.playlist_id == playlist_id,
+        association.c.track_id == track_id
+    ).values(position=position))
+
+
+def _remove_track(db: Session, playlist_id: int, track_id: int):
+    association = models.association_table
+    db.execute(delete(association).where(
+        association.c.playlist_id == playlist_id,
+        association.c.track_id == track_id
+    ))
+
+
+def _edit_position(
+    db: Session,
+    playlist_id: int,
+    index: int,
+    operation: PlaylistEdit,
+    track_ids: dict,
+    moving_id: int | None = None
+) -> int:
+    if operation.after is None:
+        return _position_for_index(db, playlist_id, operation.position, moving_id)
+    if operation.position is not None:
+        raise PlaylistEditError(index, "Give either a position or a track to follow, not both")
+
+    after_id = track_ids.get(operation.after)
+    if after_id is not None and after_id == moving_id:
+        raise PlaylistEditError(index, f"Track '{operation.after}' cannot follow itself")
+    if after_id is None or _track_position(db, playlist_id, after_id) is None:
+        raise PlaylistEditError(index, f"Track '{operation.after}' is not in the playlist", not_found=True)
+    return _position_after(db, playlist_id, after_id, moving_id)
+
+
+def edit_playlist(db: Session, playlist_id: int, operations: list[PlaylistEdit]) -> int:
+    """Applies insert/remove/move operations in order, in one transaction.
+
+    Positions are 0-based indexes into the playlist as it is after the
+    previous operations; a missing position appends. Reaching index i reads
+    i rows, so long playlists are better edited with `after`, the alias of
+    the track to follow, which costs the same anywhere. If any operation
+    fails nothing is applied and PlaylistEditError is raised.
+    """
+    aliases = list({operation.track for operation in operations} | {
+        operation.after for operation in operations if operation.after
+    })
+    track_ids = dict(
+        db.query(models.Track.alias, models.Track.id).filter(models.Track.alias.in_(aliases)).all()
+    )
+
+    try:
+        if any(operation.op != "move" for operation in operations):
+            cooccurrence.mark_playlist_changed(db, playlist_id, track_ids=track_ids.values())
+        for index, operation in enumerate(operations):
+            track_id = track_ids.get(operation.track)
+            if track_id is None:
+                raise PlaylistEditError(index, f"Track '{operation.track}' not found", not_found=True)
+
+            in_playlist = _track_position(db, playlist_id, track_id) is not None
+            if operation.op == "insert":
+                if in_playlist:
+                    raise PlaylistEditError(index, f"Track '{operation.track}' is already in the playlist")
+                _insert_track(db, playlist_id, track_id, _edit_position(db, playlist_id, index, operation, track_ids))
+            elif not in_playlist:
+                raise PlaylistEditError(index, f"Track '{operation.track}' is not in the playlist", not_found=True)
+            elif operation.op == "remove":
+                _remove_track(db, playlist_id, track_id)
+            elif operation.op == "move":
+                position = _edit_position(db, playlist_id, index, operation, track_ids, moving_id=track_id)
+                _move_track(db, playlist_id, track_id, position)
+            else:
+                raise PlaylistEditError(index, f"Unknown operation '{operation.op}'")
+    except Exception:
+        db.rollback()
+        raise
+
+    db.commit()
+    return db.execute(
+        select(func.count()).select_from(models.association_table)
+        .where(models.association_table.c.playlist_id == playlist_id)
+    ).scalar()
+
+
+def get_playlist(
+    db: Session,
+    playlist_id: int | None = None,
+    playlist_alias: str | None = None,
+    load_tracks: bool = True
+):
+    query = db.query(models.Playlist)
+    if load_tracks:
+        query = query.options(selectinload(models.Playlist.tracks))
 
     if playlist_id:
         return query.filter(models.Playlist.id == playlist_id).first()
     return query.filter(models.Playlist.alias == playlist_alias).first()
 
 
-def get_playlists(db: Session):
-    return db.query(models.Playlist).options(joinedload(models.Playlist.tracks)).all()
+def get_playlists(db: Session, cursor: str | None = None, limit: int = 100, with_tracks: bool = False) -> Page:
+    if not with_tracks:
+        return get_playlist_overview(db, cursor, limit, preview_size=0)
+    query = db.query(models.Playlist).options(selectinload(models.Playlist.tracks))
+    return keyset_page(query, [models.Playlist.id], cursor, limit)
+
+
+class TrackPreview(NamedTuple):
+    alias: str
+    title: str
+
+
+class PlaylistRow(NamedTuple):
+    id: int
+    title: str
+    alias: str
+    description: str | None
+    creator: str | None
+    track_count: int
+    tracks: list[TrackPreview]
+
+
+def get_playlist_overview(
+    db: Session,
+    cursor: str | None = None,
+    limit: int = 100,
+    preview_size: int = 5
+) -> Page:
+    track_count = select(func.count()).select_from(models.association_table).where(
+        models.association_table.c.playlist_id == models.Playlist.id
+    ).scalar_subquery()
+
+    query = db.query(
+        models.Playlist.id,
+        models.Playlist.title,
+        models.Playlist.alias,
+        models.Playlist.description,
+        models.User.username,
+        track_count,
+    ).outerjoin(models.User, models.Playlist.creator_id == models.User.id)
+
+    page = keyset_page(
+        query, [models.Playlist.id], cursor, limit,
+        convert=lambda row: PlaylistRow(*row, tracks=[])
+    )
+    if not page.items or not preview_size:
+        return page
+
+    # first `preview_size` tracks of every playlist on the page
+    association = models.association_table
+    position = func.row_number().over(
+        partition_by=association.c.playlist_id,
+        order_by=association.c.position
+    ).label("position")
+    ranked = select(
+        association.c.playlist_id, models.Track.alias, models.Track.title, position
+    ).join(
+        models.Track, models.Track.id == association.c.track_id
+    ).where(
+        association.c.playlist_id.in_([playlist.id for playlist in page.items])
+    ).subquery()
+
+    previews = db.execute(
+        select(ranked.c.playlist_id, ranked.c.alias, ranked.c.title)
+        .where(ranked.c.position <= preview_size)
+        .order_by(ranked.c.playlist_id, ranked.c.position)
+    )
+    playlists = {playlist.id: playlist for playlist in page.items}
+    for playlist_id, alias, title in previews:
+        playlists[playlist_id].tracks.append(TrackPreview(alias, title))
+    return page
+
+
+def get_playlists_by_creator(db: Session, creator_id: int):
+    return db.query(models.Playlist).filter(models.Playlist.creator_id == creator_id).all()
 
 
 def delete_playlist(db: Session, playlist_id: int | None = None, playlist_alias: str | None = None):
-    playlist = db.query(models.Playlist)
+    statement = delete(models.Playlist)
     if playlist_id:
-        playlist = playlist.filter(models.Playlist.id == playlist_id).first()
+        statement = statement.where(models.Playlist.id == playlist_id)
     else:
-        playlist = playlist.filter(models.Playlist.alias == playlist_alias).first()
+        statement = statement.where(models.Playlist.alias == playlist_alias)
 
-    if playlist:
-        db.delete(playlist)
-        db.commit()
-        return True
-    return False
+    cooccurrence.mark_playlist_changed(db, playlist_id, playlist_alias)
+    deleted = db.execute(statement, execution_options={"synchronize_session": False}).rowcount
+    db.commit()
+    return deleted > 0
@@ -1,11 +1,64 @@
-from sqlalchemy import create_engine
+import os
+
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./audio_server.db"
+SQLALCHEMY_DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///./audio_server.db")
+
+# SQLite tuning, applied to every new connection
+SQLITE_PRAGMAS = {
+    "journal_mode": os.environ.get("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "cache_size": int(os.environ.get("SQLITE_CACHE_SIZE", -64_000)),  # negative means KiB
+    "mmap_size": int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)),
+    "busy_timeout": int(os.environ.get("SQLITE_BUSY_TIMEOUT", 5_000)),  # ms
+    # SQLite ignores foreign keys, and so ON DELETE CASCADE, unless asked
+    "foreign_keys": "ON",
+}
+
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+
+# a second, query-only engine for the GET routers
+DB_READ_ENGINE = os.environ.get("DB_READ_ENGINE", "0") == "1"
+
+
+def make_engine(url: str, read_only: bool = False):
+    is_sqlite = url.startswith("sqlite")
+    options = {}
+    if is_sqlite:
+        options["connect_args"] = {"check_same_thread": False}
+    if ":memory:" not in url and url != "sqlite://":
+        options.update(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+        )
+
+    db_engine = create_engine(url, **options)
+
+    if is_sqlite:
+        @event.listens_for(db_engine, "connect")
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in SQLITE_PRAGMAS.items():
+                cursor.execute(f"PRAGMA {name} = {value}")
+            if read_only:
+                cursor.execute("PRAGMA query_only = ON")
+            cursor.close()
+
+    return db_engine
+
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+engine = make_engine(SQLALCHEMY_DATABASE_URL)
+read_engine = make_engine(SQLALCHEMY_DATABASE_URL, read_only=True) if DB_READ_ENGINE else engine
 
 SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+# read sessions may be served from db.snapshot, see crud
+ReadSessionLocal = sessionmaker(
+    bind=read_engine, autocommit=False, autoflush=False, info={"snapshot_reads": True}
+)
 
-Base = declarative_base()
\ No newline at end of file
+Base = declarative_base()
@@ -0,0 +1,180 @@
+import re
+from typing import NamedTuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from . import models
+
+# One FTS5 row per track, author and playlist. The rowid encodes both the
+# entity kind and its primary key (id * 4 + kind), so the triggers below can
+# update or delete an entry by rowid instead of scanning the index.
+TRACK, AUTHOR, PLAYLIST = 1, 2, 3
+KINDS = {TRACK: "track", AUTHOR: "author", PLAYLIST: "playlist"}
+
+# bm25 column weights for title, description and author
+RANK_WEIGHTS = (10.0, 2.0, 5.0)
+
+SEARCH_INDEX_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+        title, description, author,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS tracks_search_insert AFTER INSERT ON tracks BEGIN
+        INSERT INTO search_index(rowid, title, description, author)
+        VALUES (new.id * 4 + {TRACK}, new.title, new.description,
+                (SELECT name FROM authors WHERE id = new.author_id));
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS tracks_search_update
+    AFTER UPDATE OF title, description, author_id ON tracks BEGIN
+        DELETE FROM search_index WHERE rowid = old.id * 4 + {TRACK};
+        INSERT INTO search_index(rowid, title, description, author)
+        VALUES (new.id * 4 + {TRACK}, new.title, new.description,
+                (SELECT name FROM authors WHERE id = new.author_id));
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS tracks_search_delete AFTER DELETE ON tracks BEGIN
+        DELETE FROM search_index WHERE rowid = old.id * 4 + {TRACK};
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS authors_search_insert AFTER INSERT ON authors BEGIN
+        INSERT INTO search_index(rowid, title, description, author)
+        VALUES (new.id * 4 + {AUTHOR}, new.name, NULL, new.name);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS authors_search_update AFTER UPDATE OF name ON authors BEGIN
+        DELETE FROM search_index WHERE rowid = old.id * 4 + {AUTHOR};
+        INSERT INTO search_index(rowid, title, description, author)
+        VALUES (new.id * 4 + {AUTHOR}, new.name, NULL, new.name);
+        UPDATE search_index SET author = new.name
+        WHERE rowid IN (SELECT id * 4 + {TRACK} FROM tracks WHERE author_id = new.id);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS authors_search_delete AFTER DELETE ON authors BEGIN
+        DELETE FROM search_index WHERE rowid = old.id * 4 + {AUTHOR};
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS playlists_search_insert AFTER INSERT ON playlists BEGIN
+        INSERT INTO search_index(rowid, title, description, author)
+        VALUES (new.id * 4 + {PLAYLIST}, new.title, new.description, NULL);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS playlists_search_update
+    AFTER UPDATE OF title, description ON playlists BEGIN
+        DELETE FROM search_index WHERE rowid = old.id * 4 + {PLAYLIST};
+        INSERT INTO search_index(rowid, title, description, author)
+        VALUES (new.id * 4 + {PLAYLIST}, new.title, new.description, NULL);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS playlists_search_delete AFTER DELETE ON playlists BEGIN
+        DELETE FROM search_index WHERE rowid = old.id * 4 + {PLAYLIST};
+    END
+    """,
+]
+
+REBUILD_SEARCH_INDEX = [
+    "DELETE FROM search_index",
+    f"""
+    INSERT INTO search_index(rowid, title, description, author)
+    SELECT tracks.id * 4 + {TRACK}, tracks.title, tracks.description, authors.name
+    FROM tracks LEFT JOIN authors ON authors.id = tracks.author_id
+    """,
+    f"""
+    INSERT INTO search_index(rowid, title, description, author)
+    SELECT id * 4 + {AUTHOR}, name, NULL, name FROM authors
+    """,
+    f"""
+    INSERT INTO search_index(rowid, title, description, author)
+    SELECT id * 4 + {PLAYLIST}, title, description, NULL FROM playlists
+    """,
+]
+
+
+class SearchResult(NamedTuple):
+    kind: str
+    title: str
+    alias: str
+    subtitle: str | None
+
+
+def create_search_index(connection):
+    """Creates the FTS5 table and its triggers, filling it on first creation."""
+    exists = connection.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_index'"
+    )).first()
+    for statement in SEARCH_INDEX_DDL:
+        connection.execute(text(statement))
+    if not exists:
+        for statement in REBUILD_SEARCH_INDEX:
+            connection.execute(text(statement))
+
+
+def rebuild_search_index(db: Session):
+    for statement in REBUILD_SEARCH_INDEX:
+        db.execute(text(statement))
+    db.commit()
+
+
+def to_match_query(query: str) -> str | None:
+    # every word must match, and the last one may be a prefix of a longer word
+    words = re.findall(r"\w+", query)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words[:-1]]
+    terms.append(f'"{words[-1]}"*')
+    return " ".join(terms)
+
+
+def search(db: Session, query: str, limit: int = 50) -> list[SearchResult]:
+    match = to_match_query(query)
+    if match is None:
+        return []
+
+    hits = db.execute(
+        text(
+            "SELECT rowid FROM search_index WHERE search_index MATCH :match "
+            f"ORDER BY bm25(search_index, {', '.join(map(str, RANK_WEIGHTS))}) "
+            "LIMIT :limit"
+        ),
+        {"match": match, "limit": limit}
+    ).scalars().all()
+
+    ids = {kind: [] for kind in KINDS}
+    for rowid in hits:
+        ids[rowid % 4].append(rowid // 4)
+
+    found = {}
+    if ids[TRACK]:
+        rows = db.query(
+            models.Track.id, models.Track.title, models.Track.alias, models.Author.name
+        ).outerjoin(
+            models.Author, models.Track.author_id == models.Author.id
+        ).filter(models.Track.id.in_(ids[TRACK]))
+        for id, title, alias, author in rows:
+            found[id * 4 + TRACK] = SearchResult("track", title, alias, author)
+    if ids[AUTHOR]:
+        rows = db.query(models.Author.id, models.Author.name, models.Author.alias).filter(
+            models.Author.id.in_(ids[AUTHOR])
+        )
+        for id, name, alias in rows:
+            found[id * 4 + AUTHOR] = SearchResult("author", name, alias, None)
+    if ids[PLAYLIST]:
+        rows = db.query(
+            models.Playlist.id, models.Playlist.title, models.Playlist.alias, models.Playlist.description
+        ).filter(models.Playlist.id.in_(ids[PLAYLIST]))
+        for id, title, alias, description in rows:
+            found[id * 4 + PLAYLIST] = SearchResult("playlist", title, alias, description)
+
+    return [found[rowid] for rowid in hits if rowid in found]
@@ -0,0 +1,462 @@
+"""Versioned schema migrations for the SQLite database.
+
+The applied version is kept in ``PRAGMA user_version``. Each migration runs
+in its own transaction together with the version bump, so a failed migration
+leaves the database at the previous version. Migration 1 is the schema of the
+first release and every later one a fixed step from the previous version, so
+none of them may read the models: change the models together with a new
+migration, tests/test_migrations.py checks the two agree. Earlier releases
+built some steps from the models, so tables and indexes are created only if
+they do not exist yet. The search index, change log and track pairs are set
+up by their modules, which create only what is missing, so a change to their
+triggers comes with a migration that drops the old ones.
+
+Usage::
+
+    python -m db.migrations upgrade   # apply pending migrations
+    python -m db.migrations status    # print current and latest version
+    python -m db.migrations check     # EXPLAIN QUERY PLAN every crud query
+"""
+import logging
+import re
+import sys
+from collections import Counter
+from datetime import date
+from typing import Callable, NamedTuple
+
+from sqlalchemy import event, text
+
+from . import cooccurrence, fulltext, snapshot
+from .database import engine as default_engine, make_engine
+
+logger = logging.getLogger(__name__)
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    apply: Callable
+
+
+# The schema of the first release. A database from before the migrations has
+# it already, and those started since 008 the search index of migration 4 too.
+BASELINE_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS authors (
+        id INTEGER NOT NULL,
+        name VARCHAR,
+        alias VARCHAR,
+        PRIMARY KEY (id),
+        UNIQUE (alias)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_authors_id ON authors (id)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_authors_name ON authors (name)",
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER NOT NULL,
+        username VARCHAR,
+        hashed_password VARCHAR,
+        rights VARCHAR,
+        salt VARCHAR,
+        bio VARCHAR,
+        PRIMARY KEY (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_users_id ON users (id)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_users_username ON users (username)",
+    """
+    CREATE TABLE IF NOT EXISTS tracks (
+        id INTEGER NOT NULL,
+        title VARCHAR,
+        alias VARCHAR,
+        description VARCHAR,
+        track_url VARCHAR,
+        image_url VARCHAR,
+        author_id INTEGER,
+        PRIMARY KEY (id),
+        UNIQUE (alias),
+        UNIQUE (track_url),
+        FOREIGN KEY(author_id) REFERENCES authors (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_tracks_id ON tracks (id)",
+    """
+    CREATE TABLE IF NOT EXISTS playlists (
+        id INTEGER NOT NULL,
+        title VARCHAR,
+        alias VARCHAR,
+        description VARCHAR,
+        creator_id INTEGER,
+        PRIMARY KEY (id),
+        FOREIGN KEY(creator_id) REFERENCES users (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_playlists_id ON playlists (id)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_playlists_alias ON playlists (alias)",
+    """
+    CREATE TABLE IF NOT EXISTS association (
+        playlist_id INTEGER,
+        track_id INTEGER,
+        FOREIGN KEY(playlist_id) REFERENCES playlists (id),
+        FOREIGN KEY(track_id) REFERENCES tracks (id)
+    )
+    """,
+]
+
+
+def run(*statements: str):
+    def apply(connection):
+        for statement in statements:
+            connection.execute(text(statement))
+    return apply
+
+
+def replace_table(connection, table: str):
+    """Swaps `table` for `<table>_new`, whose rows the caller filled in.
+
+    SQLite cannot change the constraints of an existing table. The old indexes
+    and triggers go with it. Foreign keys must be off, `migrate` takes care of
+    that, and the legacy rename leaves the triggers of other tables that refer
+    to `table` alone instead of failing on them.
+    """
+    connection.execute(text(f"DROP TABLE {table}"))
+    connection.exec_driver_sql("PRAGMA legacy_alter_table = ON")
+    try:
+        connection.execute(text(f"ALTER TABLE {table}_new RENAME TO {table}"))
+    finally:
+        connection.exec_driver_sql("PRAGMA legacy_alter_table = OFF")
+
+
+def order_playlist_tracks(connection):
+    # Duplicates are dropped and the old insertion order becomes the position.
+    connection.execute(text("""
+        CREATE TABLE association_new (
+            playlist_id INTEGER NOT NULL,
+            track_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            PRIMARY KEY (playlist_id, track_id),
+            FOREIGN KEY(playlist_id) REFERENCES playlists (id),
+            FOREIGN KEY(track_id) REFERENCES tracks (id)
+        )
+    """))
+    connection.execute(text("""
+        INSERT OR IGNORE INTO association_new (playlist_id, track_id, position)
+        SELECT playlist_id, track_id,
+               row_number() OVER (PARTITION BY playlist_id ORDER BY rowid) * 1024
+        FROM association
+        WHERE playlist_id IS NOT NULL AND track_id IS NOT NULL
+        ORDER BY rowid
+    """))
+    replace_table(connection, "association")
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_association_playlist_position ON association (playlist_id, position)"
+    ))
+
+
+def cascade_deletes(connection):
+    # Earlier versions deleted authors and tracks without their dependants,
+    # finish those deletions before the constraints start to hold.
+    connection.execute(text("""
+        DELETE FROM tracks
+        WHERE author_id IS NOT NULL AND author_id NOT IN (SELECT id FROM authors)
+    """))
+    connection.execute(text("""
+        DELETE FROM association
+        WHERE track_id NOT IN (SELECT id FROM tracks)
+           OR playlist_id NOT IN (SELECT id FROM playlists)
+    """))
+
+    connection.execute(text("""
+        CREATE TABLE tracks_new (
+            id INTEGER NOT NULL,
+            title VARCHAR,
+            alias VARCHAR,
+            description VARCHAR,
+            track_url VARCHAR,
+            image_url VARCHAR,
+            author_id INTEGER,
+            PRIMARY KEY (id),
+            UNIQUE (alias),
+            UNIQUE (track_url),
+            FOREIGN KEY(author_id) REFERENCES authors (id) ON DELETE CASCADE
+        )
+    """))
+    connection.execute(text("""
+        INSERT INTO tracks_new (id, title, alias, description, track_url, image_url, author_id)
+        SELECT id, title, alias, description, track_url, image_url, author_id FROM tracks
+    """))
+    replace_table(connection, "tracks")
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_tracks_id ON tracks (id)"))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_tracks_author_id ON tracks (author_id)"))
+    # the search triggers on tracks went with the old table
+    fulltext.create_search_index(connection)
+
+    connection.execute(text("""
+        CREATE TABLE association_new (
+            playlist_id INTEGER NOT NULL,
+            track_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            PRIMARY KEY (playlist_id, track_id),
+            FOREIGN KEY(playlist_id) REFERENCES playlists (id) ON DELETE CASCADE,
+            FOREIGN KEY(track_id) REFERENCES tracks (id) ON DELETE CASCADE
+        )
+    """))
+    connection.execute(text("""
+        INSERT INTO association_new (playlist_id, track_id, position)
+        SELECT playlist_id, track_id, position FROM association
+    """))
+    replace_table(connection, "association")
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_association_playlist_position ON association (playlist_id, position)"
+    ))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_association_track_id ON association (track_id)"))
+
+
+def replace_pair_triggers(connection):
+    connection.execute(text("DROP TRIGGER IF EXISTS association_pairs_delete"))
+    connection.execute(text("DROP TRIGGER IF EXISTS association_pairs_within_limit"))
+    cooccurrence.create_cooccurrence_index(connection)
+
+
+MIGRATIONS = [
+    Migration(1, "baseline schema", run(*BASELINE_SCHEMA)),
+    Migration(2, "ordered, de-duplicated playlist tracks", order_playlist_tracks),
+    Migration(3, "indexes on foreign keys", run(
+        "CREATE INDEX IF NOT EXISTS ix_tracks_author_id ON tracks (author_id)",
+        "CREATE INDEX IF NOT EXISTS ix_playlists_creator_id ON playlists (creator_id)",
+        "CREATE INDEX IF NOT EXISTS ix_association_track_id ON association (track_id)",
+    )),
+    Migration(4, "full-text search index", fulltext.create_search_index),
+    Migration(5, "ON DELETE CASCADE for tracks and playlist entries", cascade_deletes),
+    Migration(6, "audio metadata columns on tracks", run(
+        "ALTER TABLE tracks ADD COLUMN duration FLOAT",
+        "ALTER TABLE tracks ADD COLUMN bitrate INTEGER",
+        "ALTER TABLE tracks ADD COLUMN sample_rate INTEGER",
+        "ALTER TABLE tracks ADD COLUMN codec VARCHAR",
+        "ALTER TABLE tracks ADD COLUMN mime_type VARCHAR",
+        "ALTER TABLE tracks ADD COLUMN file_size INTEGER",
+        "ALTER TABLE tracks ADD COLUMN file_mtime FLOAT",
+    )),
+    Migration(7, "content hashes of uploaded tracks", run(
+        # SQLite cannot add a UNIQUE column, the unique index comes separately
+        "ALTER TABLE tracks ADD COLUMN content_hash VARCHAR",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_tracks_content_hash ON tracks (content_hash)",
+    )),
+    Migration(8, "change log of authors and tracks for the catalog snapshot", snapshot.create_change_log),
+    Migration(9, "play counts and charts", run(
+        "ALTER TABLE tracks ADD COLUMN play_count INTEGER NOT NULL DEFAULT '0'",
+        """
+        CREATE TABLE IF NOT EXISTS charts (
+            period VARCHAR NOT NULL,
+            start VARCHAR NOT NULL,
+            track_id INTEGER NOT NULL,
+            plays INTEGER NOT NULL,
+            PRIMARY KEY (period, start, track_id),
+            FOREIGN KEY(track_id) REFERENCES tracks (id) ON DELETE CASCADE
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS ix_charts_period_start_plays ON charts (period, start, plays, track_id)",
+        "CREATE INDEX IF NOT EXISTS ix_charts_track_id ON charts (track_id)",
+    )),
+    Migration(10, "playlist co-occurrence of tracks", cooccurrence.create_cooccurrence_index),
+    Migration(11, "deleted playlists take back their track pairs at once", replace_pair_triggers),
+]
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def current_version(connection) -> int:
+    return connection.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def broken_foreign_keys(connection) -> Counter:
+    # by table and referenced table, rebuilding a table renumbers its rows
+    return Counter((row[0], row[2]) for row in connection.exec_driver_sql("PRAGMA foreign_key_check"))
+
+
+def describe(broken: Counter) -> str:
+    return ", ".join(f"{count} in {table} to {parent}" for (table, parent), count in sorted(broken.items()))
+
+
+def migrate(engine=default_engine, target: int = LATEST_VERSION) -> list[Migration]:
+    applied = []
+    with engine.connect() as connection:
+        # Rebuilding a table drops it while other tables still reference it.
+        # The pragma is a no-op inside a transaction, so it is set around them.
+        connection.exec_driver_sql("PRAGMA foreign_keys = OFF")
+        connection.commit()
+        # Versions before the constraints held could leave dangling references,
+        # only those a migration adds are its fault.
+        broken = broken_foreign_keys(connection)
+        try:
+            for migration in MIGRATIONS:
+                if migration.version > target or migration.version <= current_version(connection):
+                    continue
+
+                # pysqlite does not open transactions for DDL on its own
+                connection.exec_driver_sql("BEGIN IMMEDIATE")
+                try:
+                    migration.apply(connection)
+                    after = broken_foreign_keys(connection)
+                    if added := after - broken:
+                        raise RuntimeError(f"migration {migration.version} broke foreign keys: {describe(added)}")
+                    connection.exec_driver_sql(f"PRAGMA user_version = {migration.version}")
+                except Exception:
+                    connection.rollback()
+                    raise
+                connection.commit()
+                applied.append(migration)
+                broken = after
+        finally:
+            connection.exec_driver_sql("PRAGMA foreign_keys = ON")
+            connection.commit()
+
+    if applied and broken:
+        logger.warning(
+            "The data was already inconsistent before migrating, references to missing rows remain: %s",
+            describe(broken)
+        )
+    return applied
+
+
+# QUERY PLAN CHECK
+
+
+def exercise_crud(db):
+    """Calls every crud query once against a scratch database."""
+    from . import crud, schemas
+    from .pagination import encode_cursor
+
+    cursor = encode_cursor("next", [1])
+    user = crud.create_user_with_hash(db, "planner", "hash", "salt")
+    crud.get_user(db, "planner")
+    crud.get_playlists_by_creator(db, user.id)
+
+    author = crud.create_author(db, schemas.AuthorCreate(name="Planner", alias="planner"))
+    crud.get_author(db, author.id)
+    crud.get_author(db, author_alias="planner")
+    crud.get_authors(db, cursor=cursor, with_tracks=True)
+    crud.get_author_ids_by_alias(db, ["planner"])
+
+    tracks = [
+        crud.create_track(db, schemas.TrackCreate(
+            title=f"Plan {i}", alias=f"plan{i}", track_url=f"plan{i}.mp3"
+        ), author_id=author.id)
+        for i in range(3)
+    ]
+    crud.get_track(db, tracks[0].id)
+    crud.get_track(db, track_alias="plan0")
+    crud.get_track_row(db, "plan0")
+    crud.get_track_by_content_hash(db, "0" * 64)
+    crud.get_tracks(db, cursor=cursor)
+    crud.get_tracks_by_an_author(db, author.id, cursor=cursor)
+    crud.list_tracks(db, cursor=cursor)
+    crud.list_tracks(db, cursor=encode_cursor("prev", [3]))
+    crud.list_tracks_by_an_author(db, author.id, cursor=cursor)
+    crud.get_taken_track_keys(db, ["plan0"], ["plan0.mp3"])
+    crud.get_track_files(db, after_id=1)
+    crud.update_track_metadata(db, [{"id": tracks[0].id, "duration": 1.0, "file_size": 1}])
+    crud.add_plays(db, {("plan0", date(2024, 1, 1)): 2})
+    crud.prune_charts(db, date(2024, 1, 1), days_kept=30, weeks_kept=12)
+    crud.get_chart(db, "week", date(2024, 1, 1))
+
+    playlist = crud.create_playlist(db, "Plan", "planlist", "", user.id)
+    crud.add_track_to_playlist(db, playlist.id, track_id=tracks[0].id)
+    crud.edit_playlist(db, playlist.id, [
+        crud.PlaylistEdit("insert", "plan1", 0),
+        crud.PlaylistEdit("insert", "plan2", 1),
+        crud.PlaylistEdit("move", "plan0", 0),
+        crud.PlaylistEdit("move", "plan1", after="plan2"),
+        crud.PlaylistEdit("remove", "plan2"),
+    ])
+    crud.list_playlist_tracks(db, playlist.id)
+    crud.get_related_tracks(db, tracks[0].id)
+    crud.get_playlist(db, playlist.id)
+    crud.get_playlist(db, playlist_alias="planlist", load_tracks=False)
+    crud.get_playlists(db, cursor=cursor)
+    crud.get_playlists(db, cursor=cursor, with_tracks=True)
+    crud.get_playlist_overview(db, cursor=cursor)
+    fulltext.search(db, "plan")
+
+    crud.delete_playlist(db, playlist.id)
+    crud.delete_track(db, tracks[1].id)
+    crud.delete_author_with_tracks(db, author.id)
+
+
+def outer_query(statement: str) -> str:
+    previous = None
+    while previous != statement:
+        previous, statement = statement, re.sub(r"\([^()]*\)", "", statement)
+    return " ".join(statement.upper().split())
+
+
+def is_full_scan(detail: str, statement: str) -> bool:
+    # Walking an unfiltered table in key order under a LIMIT (the first page
+    # of a listing) stops early. Any other scan visits every row.
+    if not detail.startswith("SCAN ") or "INDEX" in detail:
+        return False
+
+    table = detail.split()[1].upper()
+    query = outer_query(statement)
+    filtered = re.search(rf"\bWHERE\b.*\b{re.escape(table)}\.", query)
+    return " LIMIT " not in query or bool(filtered)
+
+
+def check_query_plans(engine=default_engine) -> list[tuple[str, str]]:
+    """Returns (statement, plan step) pairs for crud queries that scan a whole table."""
+    from sqlalchemy.orm import Session
+
+    scratch = make_engine("sqlite://")
+    migrate(scratch)
+
+    statements = []
+
+    @event.listens_for(scratch, "before_cursor_execute")
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE", "INSERT")):
+            statements.append((statement, parameters[0] if executemany else parameters))
+
+    with Session(scratch) as db:
+        exercise_crud(db)
+
+    unique_statements = {}
+    for statement, parameters in statements:
+        unique_statements.setdefault(statement, parameters)
+
+    problems = []
+    with engine.connect() as connection:
+        for statement, parameters in unique_statements.items():
+            plan = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+            problems.extend(
+                (statement, row.detail) for row in plan if is_full_scan(row.detail, statement)
+            )
+    return problems
+
+
+def main(argv: list[str]) -> int:
+    command = argv[0] if argv else "upgrade"
+    if command == "upgrade":
+        for migration in migrate():
+            print(f"applied {migration.version}: {migration.description}")
+        return 0
+    if command == "status":
+        with default_engine.connect() as connection:
+            print(f"database at version {current_version(connection)}, latest is {LATEST_VERSION}")
+        return 0
+    if command == "check":
+        with default_engine.connect() as connection:
+            if current_version(connection) < LATEST_VERSION:
+                print("database is not up to date, run 'upgrade' first", file=sys.stderr)
+                return 2
+        problems = check_query_plans()
+        for statement, detail in problems:
+            print(f"{detail}\n    {' '.join(statement.split())}\n")
+        print(f"{len(problems)} full table scans found")
+        return 1 if problems else 0
+
+    print(f"unknown command {command!r}, expected upgrade, status or check", file=sys.stderr)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
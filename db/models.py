@@ -1,11 +1,29 @@
-from sqlalchemy import Column, ForeignKey, Integer, String, Table
+from sqlalchemy import Column, Float, ForeignKey, Index, Integer, String, Table
 from sqlalchemy.orm import relationship
 from .database import Base
 
+# Deleting an author, track or playlist cascades in the database, the
+# relationships below are passive so the ORM does not repeat the work.
+# `position` is a sparse sort key (see crud.POSITION_GAP), not a 0-based index
 association_table = Table(
     'association', Base.metadata,
-    Column('playlist_id', Integer, ForeignKey('playlists.id')),
-    Column('track_id', Integer, ForeignKey('tracks.id'))
+    Column('playlist_id', Integer, ForeignKey('playlists.id', ondelete='CASCADE'), primary_key=True),
+    Column('track_id', Integer, ForeignKey('tracks.id', ondelete='CASCADE'), primary_key=True),
+    Column('position', Integer, nullable=False, default=0),
+    Index('ix_association_playlist_position', 'playlist_id', 'position'),
+    Index('ix_association_track_id', 'track_id')
+)
+
+# Plays per track and chart period, added to in batches by play_recorder.PlayRecorder.
+# `period` is "day" or "week", `start` the ISO date the period starts on
+chart_table = Table(
+    'charts', Base.metadata,
+    Column('period', String, primary_key=True),
+    Column('start', String, primary_key=True),
+    Column('track_id', Integer, ForeignKey('tracks.id', ondelete='CASCADE'), primary_key=True),
+    Column('plays', Integer, nullable=False),
+    Index('ix_charts_period_start_plays', 'period', 'start', 'plays', 'track_id'),
+    Index('ix_charts_track_id', 'track_id')
 )
 
 class Author(Base):
@@ -15,7 +33,7 @@ class Author(Base):
     name = Column(String, unique=True, index=True)
     alias = Column(String, unique=True)
     
-    tracks = relationship("Track", back_populates="parent")
+    tracks = relationship("Track", back_populates="parent", passive_deletes=True)
 
 
 class Track(Base):
@@ -30,11 +48,27 @@ class Track(Base):
     
     track_url = Column(String, unique=True)
     image_url = Column(String)
+    # SHA-256 of files uploaded through handle_post_request.upload_track
+    content_hash = Column(String, unique=True, index=True)
     
-    author_id = Column(Integer, ForeignKey("authors.id"))
+    author_id = Column(Integer, ForeignKey("authors.id", ondelete="CASCADE"), index=True)
+
+    # filled in by metadata_scanner, file_size and file_mtime tell it whether
+    # the file changed since it was last probed
+    duration = Column(Float)
+    bitrate = Column(Integer)
+    sample_rate = Column(Integer)
+    codec = Column(String)
+    mime_type = Column(String)
+    file_size = Column(Integer)
+    file_mtime = Column(Float)
+    # added to in batches by play_recorder.PlayRecorder
+    play_count = Column(Integer, nullable=False, default=0, server_default="0")
     
     parent = relationship("Author",back_populates="tracks")
-    playlists = relationship("Playlist", secondary=association_table, back_populates="tracks")
+    playlists = relationship(
+        "Playlist", secondary=association_table, back_populates="tracks", passive_deletes=True
+    )
 
 class User(Base):
     __tablename__ = "users"
@@ -56,7 +90,13 @@ class Playlist(Base):
     title = Column(String)
     alias = Column(String, unique=True, index=True)
     description = Column(String)
-    creator_id = Column(Integer, ForeignKey("users.id"))
+    creator_id = Column(Integer, ForeignKey("users.id"), index=True)
 
     creator = relationship("User", back_populates="playlists")
-    tracks = relationship("Track", secondary=association_table, back_populates="playlists")
\ No newline at end of file
+    tracks = relationship(
+        "Track",
+        secondary=association_table,
+        back_populates="playlists",
+        order_by=association_table.c.position,
+        passive_deletes=True
+    )
\ No newline at end of file
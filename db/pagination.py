@@ -0,0 +1,110 @@
+import base64
+import json
+from bisect import bisect_left, bisect_right
+from operator import attrgetter
+from typing import Any, NamedTuple
+
+from sqlalchemy import tuple_
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class Page(NamedTuple):
+    items: list
+    next_cursor: str | None
+    prev_cursor: str | None
+
+
+def encode_cursor(direction: str, key: list) -> str:
+    raw = json.dumps([direction, key], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, key_length: int) -> tuple[str, list]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        direction, key = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor("Malformed cursor") from e
+
+    if direction not in ("next", "prev") or not isinstance(key, list) or len(key) != key_length:
+        raise InvalidCursor("Malformed cursor")
+    # lists or objects would reach the database as bound parameters
+    if not all(isinstance(value, (int, float, str)) for value in key):
+        raise InvalidCursor("Malformed cursor")
+    return direction, key
+
+
+def keyset_page(
+    query,
+    key_columns: list,
+    cursor: str | None = None,
+    limit: int = 100,
+    convert=lambda row: row
+) -> Page:
+    """Returns one page of `query` ordered by `key_columns`.
+
+    The last key column must be unique (normally the primary key) so that
+    every row has a distinct position. The cost of a page does not depend
+    on how deep it is, unlike OFFSET.
+    """
+    names = [column.key for column in key_columns]
+    key_expression = tuple_(*key_columns) if len(key_columns) > 1 else key_columns[0]
+
+    direction, key = decode_cursor(cursor, len(key_columns)) if cursor else ("next", None)
+    if key is not None:
+        bound: Any = tuple_(*key) if len(key) > 1 else key[0]
+
+    if direction == "next":
+        if key is not None:
+            query = query.filter(key_expression > bound)
+        rows = query.order_by(*key_columns).limit(limit + 1).all()
+        has_next, has_prev = len(rows) > limit, key is not None
+        rows = rows[:limit]
+    else:
+        query = query.filter(key_expression < bound)
+        rows = query.order_by(*(column.desc() for column in key_columns)).limit(limit + 1).all()
+        has_next, has_prev = True, len(rows) > limit
+        rows = rows[:limit][::-1]
+
+    items = [convert(row) for row in rows]
+    if not items:
+        return Page(items, None, None)
+
+    def key_of(item):
+        return [getattr(item, name) for name in names]
+
+    return Page(
+        items,
+        encode_cursor("next", key_of(items[-1])) if has_next else None,
+        encode_cursor("prev", key_of(items[0])) if has_prev else None,
+    )
+
+
+def list_page(records: list, cursor: str | None = None, limit: int = 100, convert=lambda record: record) -> Page:
+    """keyset_page over a list of records ordered by their unique `id`."""
+    direction, key = decode_cursor(cursor, 1) if cursor else ("next", None)
+    try:
+        if direction == "next":
+            start = 0 if key is None else bisect_right(records, key[0], key=attrgetter("id"))
+            rows = records[start:start + limit + 1]
+            has_next, has_prev = len(rows) > limit, key is not None
+            rows = rows[:limit]
+        else:
+            end = bisect_left(records, key[0], key=attrgetter("id"))
+            rows = records[max(end - limit - 1, 0):end]
+            has_next, has_prev = True, len(rows) > limit
+            rows = rows[-limit:]
+    except TypeError as e:
+        raise InvalidCursor("Malformed cursor") from e
+
+    items = [convert(record) for record in rows]
+    if not items:
+        return Page(items, None, None)
+    return Page(
+        items,
+        encode_cursor("next", [rows[-1].id]) if has_next else None,
+        encode_cursor("prev", [rows[0].id]) if has_prev else None,
+    )
@@ -1,4 +1,8 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from typing import Generic, Literal, TypeVar
+
+T = TypeVar("T")
+
 
 class TrackBase(BaseModel):
     title: str
@@ -12,12 +16,25 @@ class TrackCreate(TrackBase):
     pass
 
 
+# the form fields sent along with an uploaded file, which gives the track_url
+class TrackUpload(BaseModel):
+    title: str
+    alias: str = Field(min_length=3, max_length=50)
+    description: str | None = None
+    image_url: str | None = None
+
+
 class Track(TrackBase):
     id: int
     author_id: int
+    duration: float | None = None
+    bitrate: int | None = None
+    sample_rate: int | None = None
+    codec: str | None = None
+    mime_type: str | None = None
     
     class Config:
-        from_attributed = True
+        from_attributes = True
 
 
 class AuthorBase(BaseModel):
@@ -34,7 +51,14 @@ class Author(AuthorBase):
     tracks: list[Track] = []
     
     class Config:
-        from_attributed = True
+        from_attributes = True
+
+
+class AuthorSummary(AuthorBase):
+    id: int
+
+    class Config:
+        from_attributes = True
 
 
 class UserBase(BaseModel):
@@ -55,7 +79,7 @@ class User(UserBase):
     rights: str = "user"
     
     class Config:
-        from_attributed = True
+        from_attributes = True
 
 
 class PlaylistBase(BaseModel):
@@ -68,9 +92,37 @@ class PlaylistCreate(PlaylistBase):
     pass
 
 
+class PlaylistEdit(BaseModel):
+    op: Literal["insert", "remove", "move"]
+    track: str
+    position: int | None = Field(None, ge=0)
+    # alias of the track to place it after, instead of a position
+    after: str | None = None
+
+
+class PlaylistEdits(BaseModel):
+    operations: list[PlaylistEdit] = Field(max_length=1000)
+
+
 class Playlist(PlaylistBase):
     id: int
     tracks: list[TrackBase] = []
 
     class Config:
-        from_attributed = True
\ No newline at end of file
+        from_attributes = True
+
+
+class PlaylistSummary(PlaylistBase):
+    id: int
+
+    class Config:
+        from_attributes = True
+
+
+class Page(BaseModel, Generic[T]):
+    items: list[T]
+    next_cursor: str | None = None
+    prev_cursor: str | None = None
+
+    class Config:
+        from_attributes = True
@@ -0,0 +1,403 @@
+"""A process-local, read-only copy of all authors and tracks.
+
+Triggers append every change to authors and tracks to ``catalog_changes``,
+whose autoincrement key doubles as the catalog version. A background thread
+polls the version and builds the next state from the new changes, or loads it
+again after a large batch, then swaps it in: readers never see a state
+change. Only sessions from ``ReadSessionLocal`` are served from the snapshot,
+writes always see the database.
+
+After a commit that changed the catalog in this process, reads go to the
+database until the snapshot has caught up, so a process always reads its own
+writes. Other processes' writes show up within CATALOG_REFRESH_INTERVAL.
+"""
+import itertools
+import logging
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left, insort
+from operator import attrgetter
+
+from sqlalchemy import event, select, text
+from sqlalchemy.orm import Session
+
+from . import models
+from .database import engine
+
+logger = logging.getLogger(__name__)
+
+CATALOG_SNAPSHOT = os.environ.get("CATALOG_SNAPSHOT", "0") == "1"
+CATALOG_REFRESH_INTERVAL = float(os.environ.get("CATALOG_REFRESH_INTERVAL", 1.0))  # seconds
+CATALOG_CHANGES_KEPT = int(os.environ.get("CATALOG_CHANGES_KEPT", 100_000))
+# applying more changes than this one by one is slower than loading everything
+FULL_RELOAD_CHANGES = 20_000
+LOAD_BATCH = 10_000
+ID_CHUNK = 500
+
+CHANGE_LOG_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS catalog_changes (
+        version INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        row_id INTEGER NOT NULL
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS authors_changes_insert AFTER INSERT ON authors BEGIN
+        INSERT INTO catalog_changes (kind, row_id) VALUES ('author', new.id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS authors_changes_update AFTER UPDATE OF name, alias ON authors BEGIN
+        INSERT INTO catalog_changes (kind, row_id) VALUES ('author', new.id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS authors_changes_delete AFTER DELETE ON authors BEGIN
+        INSERT INTO catalog_changes (kind, row_id) VALUES ('author', old.id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tracks_changes_insert AFTER INSERT ON tracks BEGIN
+        INSERT INTO catalog_changes (kind, row_id) VALUES ('track', new.id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tracks_changes_update AFTER UPDATE OF
+        title, alias, description, track_url, image_url, author_id,
+        duration, bitrate, sample_rate, codec, mime_type
+    ON tracks BEGIN
+        INSERT INTO catalog_changes (kind, row_id) VALUES ('track', new.id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tracks_changes_delete AFTER DELETE ON tracks BEGIN
+        INSERT INTO catalog_changes (kind, row_id) VALUES ('track', old.id);
+    END
+    """,
+]
+
+
+def create_change_log(connection):
+    for statement in CHANGE_LOG_DDL:
+        connection.execute(text(statement))
+
+
+class AuthorRecord:
+    __slots__ = ("id", "name", "alias", "tracks")
+
+    def __init__(self, id: int, name: str, alias: str):
+        self.id = id
+        self.name = name
+        self.alias = alias
+        self.tracks: list[TrackRecord] = []  # ordered by id
+
+
+class TrackRecord:
+    """Has the attributes of models.Track that schemas.Track and the templates read."""
+
+    __slots__ = (
+        "id", "title", "alias", "description", "track_url", "image_url", "author_id",
+        "duration", "bitrate", "sample_rate", "codec", "mime_type", "author",
+    )
+
+    def set(self, row, author: AuthorRecord | None):
+        (self.id, self.title, self.alias, self.description, self.track_url, self.image_url,
+         self.author_id, self.duration, self.bitrate, self.sample_rate, codec, mime_type) = row
+        # a handful of distinct values shared by every track
+        self.codec = codec and sys.intern(codec)
+        self.mime_type = mime_type and sys.intern(mime_type)
+        self.author = author
+        if author is not None:
+            self.author_id = author.id
+        return self
+
+    def copy(self, author: AuthorRecord | None) -> "TrackRecord":
+        track = TrackRecord()
+        for name in self.__slots__:
+            setattr(track, name, getattr(self, name))
+        track.author = author
+        return track
+
+
+AUTHOR_COLUMNS = (models.Author.id, models.Author.name, models.Author.alias)
+TRACK_COLUMNS = (
+    models.Track.id, models.Track.title, models.Track.alias, models.Track.description,
+    models.Track.track_url, models.Track.image_url, models.Track.author_id,
+    models.Track.duration, models.Track.bitrate, models.Track.sample_rate,
+    models.Track.codec, models.Track.mime_type,
+)
+
+record_id = attrgetter("id")
+
+
+def find(records: list, id: int) -> int | None:
+    """The index of the record with `id` in a list ordered by id."""
+    index = bisect_left(records, id, key=record_id)
+    if index < len(records) and records[index].id == id:
+        return index
+    return None
+
+
+def latest_version(connection) -> int:
+    return connection.execute(text("SELECT max(version) FROM catalog_changes")).scalar() or 0
+
+
+class CatalogState:
+    """One consistent view of the catalog. Tracks are kept in a list ordered by
+    id, which serves both keyset pages and id lookups, so they need no id map."""
+
+    __slots__ = ("version", "authors", "author_list", "author_aliases", "tracks", "track_aliases")
+
+    def __init__(self, version: int):
+        self.version = version
+        self.authors: dict[int, AuthorRecord] = {}
+        self.author_list: list[AuthorRecord] = []
+        self.author_aliases: dict[str, AuthorRecord] = {}
+        self.tracks: list[TrackRecord] = []
+        self.track_aliases: dict[str, TrackRecord] = {}
+
+    @classmethod
+    def load(cls, connection) -> "CatalogState":
+        state = cls(latest_version(connection))
+        for id, name, alias in connection.execute(select(*AUTHOR_COLUMNS).order_by(models.Author.id)):
+            author = AuthorRecord(id, name, alias)
+            state.authors[id] = author
+            state.author_list.append(author)
+            state.author_aliases[alias] = author
+
+        rows = connection.execution_options(yield_per=LOAD_BATCH).execute(
+            select(*TRACK_COLUMNS).order_by(models.Track.id)
+        )
+        for row in rows:
+            author = state.authors.get(row.author_id)
+            track = TrackRecord().set(row, author)
+            state.tracks.append(track)
+            state.track_aliases[track.alias] = track
+            if author is not None:
+                author.tracks.append(track)
+        return state
+
+    def get_author(self, author_id: int | None = None, author_alias: str | None = None) -> AuthorRecord | None:
+        if author_id:
+            return self.authors.get(author_id)
+        if author_alias:
+            return self.author_aliases.get(author_alias)
+
+    def get_track(self, track_id: int | None = None, track_alias: str | None = None) -> TrackRecord | None:
+        if track_id:
+            index = find(self.tracks, track_id)
+            return None if index is None else self.tracks[index]
+        if track_alias:
+            return self.track_aliases.get(track_alias)
+
+    def apply(self, connection, changes: list[tuple[str, int]], version: int) -> "CatalogState":
+        """A new state with `changes` applied. Records are never changed once
+        published, so this one stays intact for the readers that hold it."""
+        author_ids = {row_id for kind, row_id in changes if kind == "author"}
+        track_ids = {row_id for kind, row_id in changes if kind == "track"}
+
+        author_rows = self._fetch(connection, AUTHOR_COLUMNS, models.Author.id, author_ids)
+        for author_id in author_ids - author_rows.keys():
+            # the database cascades the delete, its track changes follow anyway
+            if (author := self.authors.get(author_id)) is not None:
+                track_ids.update(track.id for track in author.tracks)
+        track_rows = self._fetch(connection, TRACK_COLUMNS, models.Track.id, track_ids)
+
+        # tracks point at their author and authors list their tracks, so an
+        # author gets a new record, and so do its tracks, when either changes
+        touched = set(author_ids)
+        for track_id in track_ids:
+            if (track := self.get_track(track_id)) is not None and track.author is not None:
+                touched.add(track.author.id)
+            if (row := track_rows.get(track_id)) is not None and row.author_id is not None:
+                touched.add(row.author_id)
+
+        state = CatalogState(version)
+        state.authors = dict(self.authors)
+        state.author_list = list(self.author_list)
+        state.author_aliases = dict(self.author_aliases)
+        state.tracks = list(self.tracks)
+        state.track_aliases = dict(self.track_aliases)
+
+        for author_id in touched:
+            state._remove_author(author_id)
+            row = author_rows.get(author_id) if author_id in author_ids else self.authors.get(author_id)
+            if row is not None:
+                state._add_author(AuthorRecord(row.id, row.name, row.alias))
+
+        state._remove_tracks(track_ids - track_rows.keys())
+        for row in track_rows.values():
+            state._put_track(TrackRecord().set(row, state.authors.get(row.author_id)))
+
+        for author_id in touched:
+            if (author := state.authors.get(author_id)) is None or (old := self.authors.get(author_id)) is None:
+                continue
+            for track in old.tracks:
+                if track.id not in track_ids:
+                    state._put_track(track.copy(author))
+        return state
+
+    @staticmethod
+    def _fetch(connection, columns, id_column, ids: set[int]) -> dict:
+        ids = sorted(ids)
+        rows = {}
+        for start in range(0, len(ids), ID_CHUNK):
+            statement = select(*columns).where(id_column.in_(ids[start:start + ID_CHUNK]))
+            rows.update((row.id, row) for row in connection.execute(statement))
+        return rows
+
+    # the rest only change a state that is not published yet
+
+    def _add_author(self, author: AuthorRecord):
+        self.authors[author.id] = author
+        insort(self.author_list, author, key=record_id)
+        self.author_aliases[author.alias] = author
+
+    def _remove_author(self, id: int):
+        author = self.authors.pop(id, None)
+        if author is None:
+            return
+        if self.author_aliases.get(author.alias) is author:
+            del self.author_aliases[author.alias]
+        del self.author_list[find(self.author_list, id)]
+
+    def _put_track(self, track: TrackRecord):
+        index = find(self.tracks, track.id)
+        if index is None:
+            insort(self.tracks, track, key=record_id)
+        else:
+            replaced = self.tracks[index]
+            if self.track_aliases.get(replaced.alias) is replaced:
+                del self.track_aliases[replaced.alias]
+            self.tracks[index] = track
+        self.track_aliases[track.alias] = track
+        if track.author is not None:
+            # a new record of this state, its list is not shared
+            insort(track.author.tracks, track, key=record_id)
+
+    def _remove_tracks(self, ids: set[int]):
+        if not ids:
+            return
+        for id in ids:
+            if (track := self.get_track(id)) is not None and self.track_aliases.get(track.alias) is track:
+                del self.track_aliases[track.alias]
+        # in one pass, deleting them one at a time would move the rest every time
+        self.tracks = [track for track in self.tracks if track.id not in ids]
+
+
+class CatalogSnapshot:
+    def __init__(self, enabled: bool, interval: float):
+        self.enabled = enabled
+        self.interval = interval
+        self.state: CatalogState | None = None
+        # commits that changed the catalog in this process, and how many of
+        # them the snapshot has caught up with
+        self.commits = itertools.count(1)
+        self.requested = 0
+        self.applied = 0
+        self.loaded = threading.Event()
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.refreshes = 0
+        self.full_loads = 0
+        self.last_refresh_seconds = None
+
+    def serving(self, db: Session) -> CatalogState | None:
+        """The state to read from, or None if `db` has to query the database."""
+        if self.state is None or self.requested != self.applied or not db.info.get("snapshot_reads"):
+            return None
+        return self.state
+
+    def changed(self):
+        self.requested = next(self.commits)
+        self.wakeup.set()
+
+    def refresh(self):
+        started = time.perf_counter()
+        requested = self.requested
+        with engine.connect() as connection, connection.begin():
+            state = self.state
+            oldest, latest = connection.execute(
+                text("SELECT min(version), max(version) FROM catalog_changes")
+            ).one()
+            if state is None or (latest or 0) - state.version > FULL_RELOAD_CHANGES or (
+                oldest is not None and oldest > state.version + 1
+            ):
+                # loaded on the side and swapped in, readers keep the old state meanwhile
+                self.state = CatalogState.load(connection)
+                self.full_loads += 1
+            elif latest is not None and latest > state.version:
+                changes = connection.execute(
+                    text("SELECT kind, row_id FROM catalog_changes WHERE version > :version ORDER BY version"),
+                    {"version": state.version}
+                ).all()
+                # built on the side as well, a reader never sees it half done
+                self.state = state.apply(connection, changes, latest)
+        self.applied = requested
+        self.loaded.set()
+
+        if oldest is not None and latest - oldest >= CATALOG_CHANGES_KEPT * 1.1:
+            with engine.begin() as connection:
+                connection.execute(
+                    text("DELETE FROM catalog_changes WHERE version <= :version"),
+                    {"version": latest - CATALOG_CHANGES_KEPT}
+                )
+
+        self.refreshes += 1
+        self.last_refresh_seconds = time.perf_counter() - started
+
+    def run(self):
+        while not self.stopping.is_set():
+            self.wakeup.clear()
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Catalog snapshot refresh failed")
+            self.wakeup.wait(self.interval)
+
+    def start(self):
+        if self.enabled and self.thread is None:
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self.run, name="catalog-snapshot", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+            self.thread = None
+
+    def stats(self):
+        state = self.state
+        return {
+            "version": state.version if state else None,
+            "authors": len(state.author_list) if state else 0,
+            "tracks": len(state.tracks) if state else 0,
+            "refreshes": self.refreshes,
+            "full_loads": self.full_loads,
+            "last_refresh_seconds": self.last_refresh_seconds,
+        }
+
+
+catalog_snapshot = CatalogSnapshot(CATALOG_SNAPSHOT, CATALOG_REFRESH_INTERVAL)
+
+
+def mark_catalog_changed(db: Session):
+    """Called by crud functions that write authors or tracks, before the commit."""
+    db.info["catalog_changed"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def notify_snapshot(session: Session):
+    if session.info.pop("catalog_changed", False):
+        catalog_snapshot.changed()
+
+
+@event.listens_for(Session, "after_rollback")
+def forget_changes(session: Session):
+    session.info.pop("catalog_changed", None)
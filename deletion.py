@@ -1,10 +1,13 @@
 from fastapi import Depends, HTTPException, APIRouter, Path
 from typing import Annotated
 from sqlalchemy.orm import Session
-from db import models, crud
+from db import crud
 
 from handle_db import *
+from query_budget import query_budget
 from security import get_current_user, check_admin_rights
+from page_cache import invalidate
+from principal_cache import Principal
 
 deletion_router = APIRouter()
 
@@ -16,20 +19,32 @@ def handle_deletion(crud_func, db: Session, identifier: str, entity_name: str):
 
 
 @deletion_router.delete("/tracks/{track_alias}")
-async def delete_track(
+@query_budget(3)
+def delete_track(
     track_alias: Annotated[str, Path(min_length=3, max_length=50)],
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
     check_admin_rights(current_user)
-    return handle_deletion(crud.delete_track, db, track_alias, "Track")
+    track = crud.get_track(db, track_alias=track_alias)
+    if track is None:
+        raise HTTPException(404, "Track not found")
+
+    author_id = track.author_id
+    result = handle_deletion(crud.delete_track, db, track_alias, "Track")
+    invalidate(
+        "authors", "tracks", "playlists", "charts",
+        f"track:{track_alias}", f"author:{author_id}"
+    )
+    return result
 
 
 @deletion_router.delete("/playlists/{playlist_alias}")
-async def delete_playlist(
+@query_budget(5)
+def delete_playlist(
     playlist_alias: Annotated[str, Path(min_length=3, max_length=50)],
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
     playlist = crud.get_playlist(db, playlist_alias=playlist_alias)
     if not playlist:
@@ -42,18 +57,30 @@ async def delete_playlist(
         )
 
     crud.delete_playlist(db, None, playlist_alias)
+    invalidate("playlists")
     return "Success"
 
 
 @deletion_router.delete("/authors/{author_alias}")
-async def delete_author(
+@query_budget(3)
+def delete_author(
     author_alias: Annotated[str, Path(min_length=3, max_length=50)],
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
 ):
     check_admin_rights(current_user)
-    return handle_deletion(
+    author = crud.get_author(db, author_alias=author_alias)
+    if author is None:
+        raise HTTPException(404, "Author not found")
+
+    author_id = author.id
+    result = handle_deletion(
         crud.delete_author_with_tracks,
         db, author_alias,
         "Author"
     )
+    invalidate(
+        "authors", "tracks", "playlists", "charts",
+        f"author:{author_id}", f"author-tracks:{author_id}"
+    )
+    return result
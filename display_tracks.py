@@ -1,4 +1,4 @@
-from fastapi import Path, Depends, HTTPException, APIRouter
+from fastapi import Path, Query, Depends, HTTPException, APIRouter
 from fastapi.templating import Jinja2Templates
 
 from starlette.requests import Request
@@ -8,82 +8,124 @@ from sqlalchemy.orm import Session
 from db import crud, schemas
 
 from handle_db import *
+from query_budget import query_budget
 from app_initialize import templates
+from page_cache import cache_page
+from audio_metadata import guess_mime_type
 
 tracks_router = APIRouter()
 
-def change_track_data(tracks, db):
-    for track in tracks:
-        track.track_url = f"audio/{track.track_url}"
-        track.image_url = f"img/{track.image_url}"
-        track.author = crud.get_author(db, track.author_id).name
-    return tracks
+def change_track_data(tracks: list[crud.TrackRow]):
+    return [
+        track._replace(
+            track_url=f"audio/{track.track_url}",
+            image_url=f"img/{track.image_url}",
+            # until the metadata scanner has seen the file
+            mime_type=track.mime_type or guess_mime_type(track.track_url)
+        )
+        for track in tracks
+    ]
 
 # GET PAGES WITH AUTHORS
 
 
 @tracks_router.get("/", response_model=list[schemas.Author])
-async def read_authors(
+@query_budget(2)
+def read_authors(
     request: Request,
-    skip: int = 0,
-    limit: int = 100,
-    db: Session = Depends(get_db)
+    cursor: str | None = None,
+    limit: Annotated[int, Query(ge=1, le=500)] = 100,
+    db: Session = Depends(get_read_db)
 ):
-    authors = crud.get_authors(db, skip=skip, limit=limit)
+    page = crud.get_authors(db, cursor=cursor, limit=limit, with_tracks=True)
+    cache_page(request, "authors")
     return templates.TemplateResponse(
         "authors.html",
-        {"request": request, "authors": authors}
+        {"request": request, "authors": page.items, "page": page}
     )
 
 
 @tracks_router.get("/authors/{author_alias}", response_model=schemas.Author)
-async def read_author(
+@query_budget(2)
+def read_author(
         request: Request,
         author_alias: Annotated[str, Path(min_length=3, max_length=50)],
-        db: Session = Depends(get_db)
+        cursor: str | None = None,
+        limit: Annotated[int, Query(ge=1, le=500)] = 100,
+        db: Session = Depends(get_read_db)
 ):
     db_author = crud.get_author(db, author_alias=author_alias)
 
     if db_author is None:
         raise HTTPException(404, "Author not found")
 
-    tracks = change_track_data(
-        crud.get_tracks_by_an_author(db, db_author.id),
-        db
-    )
+    page = crud.list_tracks_by_an_author(db, db_author.id, cursor=cursor, limit=limit)
+    cache_page(request, f"author:{db_author.id}")
     return templates.TemplateResponse(
         "songs_by_authors.html",
-        {"request": request, "author_name": db_author.name, "songs": tracks}
+        {"request": request,
+         "author_name": db_author.name,
+         "songs": change_track_data(page.items),
+         "page": page}
     )
 
 # GET PAGES WITH TRACKS
 
 
 @tracks_router.get('/tracks/all', response_model=list[schemas.Track])
-async def read_tracks(
+@query_budget(1)
+def read_tracks(
     request: Request,
-    skip: int = 0,
-    limit: int = 100,
-    db: Session = Depends(get_db)
+    cursor: str | None = None,
+    limit: Annotated[int, Query(ge=1, le=500)] = 100,
+    db: Session = Depends(get_read_db)
 ):
-    tracks = change_track_data(crud.get_tracks(db, skip=skip, limit=limit), db)
+    page = crud.list_tracks(db, cursor=cursor, limit=limit)
+    cache_page(request, "tracks")
     return templates.TemplateResponse(
         "songs.html",
-        {"request": request, "songs": tracks}
+        {"request": request, "songs": change_track_data(page.items), "page": page}
     )
 
 
 @tracks_router.get("/tracks/{track_alias}")
-async def display_song(
+@query_budget(1)
+def display_song(
         request: Request,
         track_alias: Annotated[str, Path(min_length=3, max_length=50)],
-        db: Session = Depends(get_db)
+        db: Session = Depends(get_read_db)
 ):
-    track = change_track_data(
-        [crud.get_track(db, track_alias=track_alias)],
-        db
-    )[0]
+    track = crud.get_track_row(db, track_alias)
+
+    if track is None:
+        raise HTTPException(404, "Track not found")
+
+    cache_page(request, f"track:{track_alias}", f"author-tracks:{track.author_id}")
+    track = change_track_data([track])[0]
     return templates.TemplateResponse(
         "song.html",
         {"request": request, "track": track}
     )
+
+
+@tracks_router.get("/tracks/{track_alias}/related")
+@query_budget(3)
+def display_related_songs(
+        request: Request,
+        track_alias: Annotated[str, Path(min_length=3, max_length=50)],
+        limit: Annotated[int, Query(ge=1, le=50)] = 20,
+        db: Session = Depends(get_read_db)
+):
+    track = crud.get_track_row(db, track_alias)
+
+    if track is None:
+        raise HTTPException(404, "Track not found")
+
+    related = crud.get_related_tracks(db, track.id, limit=limit)
+    return templates.TemplateResponse(
+        "related.html",
+        {"request": request,
+         "track": track,
+         "songs": change_track_data([entry.track for entry in related]),
+         "playlists": [entry.playlists for entry in related]}
+    )
@@ -1,4 +1,4 @@
-from db.database import SessionLocal
+from db.database import SessionLocal, ReadSessionLocal
 
 
 def get_db():
@@ -7,3 +7,11 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
@@ -1,35 +1,106 @@
 from fastapi import Path, Depends, HTTPException, APIRouter
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from db import crud, models, schemas
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from db import crud, schemas
 from typing import Annotated
 
+from audio_upload import AudioUpload
+from streaming import AUDIO_DIRECTORY
+
 from security import get_current_user, check_admin_rights
+from principal_cache import Principal
 from handle_db import get_db
+from query_budget import query_budget
+from page_cache import invalidate
+from metadata_scanner import metadata_scanner
 
 post_router = APIRouter()
 
+ALLOWED_EXTENSIONS = ('mp3', 'ogg', 'wav', 'm4a')
+
 
 @post_router.post("/authors/", response_model=schemas.Author)
-async def create_author(
+@query_budget(4)
+def create_author(
     author: schemas.AuthorCreate,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
     check_admin_rights(current_user)
-    return crud.create_author(db=db, author=author)
+    db_author = crud.create_author(db=db, author=author)
+    invalidate("authors")
+    return db_author
 
 
 @post_router.post("/authors/{author_alias}/", response_model=schemas.Track)
-async def create_track(
+@query_budget(4)
+def create_track(
     author_alias: Annotated[str, Path(min_length=3, max_length=50)],
     track: schemas.TrackCreate,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
     check_admin_rights(current_user)
-    allowed_extensions = ('mp3', 'ogg', 'wav', 'm4a')
     file_extension = track.track_url.split(".")[-1]
-    if file_extension not in allowed_extensions:
+    if file_extension not in ALLOWED_EXTENSIONS:
         raise HTTPException(400, "The file extension is not allowed")
 
-    return crud.create_track(db=db, track=track, author_alias=author_alias)
+    db_track = crud.create_track(db=db, track=track, author_alias=author_alias)
+    invalidate("authors", "tracks", f"author:{db_track.author_id}")
+    metadata_scanner.wake()
+    return db_track
+
+
+def create_uploaded_track(db: Session, upload: AudioUpload, track: schemas.TrackUpload, author_id: int):
+    if duplicate := crud.get_track_by_content_hash(db, upload.content_hash):
+        upload.discard()
+        raise HTTPException(409, f"This file was already uploaded as track '{duplicate.alias}'")
+    if crud.get_track(db, track_alias=track.alias):
+        upload.discard()
+        raise HTTPException(400, "Track with this alias already exists")
+
+    stored = upload.store()
+    try:
+        return crud.create_track(
+            db,
+            schemas.TrackCreate(**track.model_dump(), track_url=stored.track_url),
+            author_id=author_id,
+            content_hash=upload.content_hash
+        )
+    except IntegrityError:
+        # lost a race with an identical upload or the same alias
+        db.rollback()
+        if stored.created:
+            (AUDIO_DIRECTORY / stored.track_url).unlink(missing_ok=True)
+        raise HTTPException(409, "Track conflicts with an existing track")
+
+
+# multipart/form-data with the audio in `file` and the TrackUpload fields
+@post_router.post("/authors/{author_alias}/upload", response_model=schemas.Track)
+async def upload_track(
+    request: Request,
+    author_alias: Annotated[str, Path(min_length=3, max_length=50)],
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    check_admin_rights(current_user)
+    author = await run_in_threadpool(crud.get_author, db, author_alias=author_alias)
+    if author is None:
+        raise HTTPException(404, "Author not found")
+
+    upload = AudioUpload(request.headers, "file", ALLOWED_EXTENSIONS)
+    await upload.receive(request.stream())
+    try:
+        track = schemas.TrackUpload(**upload.fields)
+    except ValidationError as e:
+        await run_in_threadpool(upload.discard)
+        raise RequestValidationError(e.errors())
+
+    db_track = await run_in_threadpool(create_uploaded_track, db, upload, track, author.id)
+    invalidate("authors", "tracks", f"author:{author.id}", f"author-tracks:{author.id}")
+    metadata_scanner.wake()
+    return db_track
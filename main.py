@@ -7,10 +7,13 @@ from display_tracks import tracks_router
 from playlists import playlist_router
 from deletion import deletion_router
 from account_management import account_router
-
-# imports for re-creating the db
-from db import models
-from db.database import engine
+from streaming import stream_router
+from search import search_router
+from api import api_router
+from bulk_import import import_router
+from waveform import waveform_router
+from metrics import metrics_router
+from charts import charts_router
 
 app.include_router(post_router)
 app.include_router(security_router)
@@ -18,6 +21,13 @@ app.include_router(tracks_router)
 app.include_router(playlist_router)
 app.include_router(deletion_router)
 app.include_router(account_router)
+app.include_router(stream_router)
+app.include_router(search_router)
+app.include_router(api_router)
+app.include_router(import_router)
+app.include_router(waveform_router)
+app.include_router(metrics_router)
+app.include_router(charts_router)
 
-# run when models are changed
-# models.Base.metadata.create_all(bind=engine)
+# the schema is created and upgraded by db/migrations.py, at startup
+# (unless MIGRATE_ON_STARTUP=0) or with `python -m db.migrations upgrade`
@@ -0,0 +1,174 @@
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from db import crud
+from db.database import SessionLocal
+from audio_metadata import UnsupportedAudio, guess_mime_type, probe
+from page_cache import invalidate
+from streaming import resolve_audio_path
+import waveform
+
+logger = logging.getLogger(__name__)
+
+# Probing reads a few headers per file, so the work is I/O bound and a small
+# thread pool keeps a slow disk from holding up the whole scan.
+SCAN_WORKERS = int(os.environ.get("SCAN_WORKERS", 4))
+SCAN_INTERVAL = float(os.environ.get("SCAN_INTERVAL", 600))  # seconds, 0 only scans when woken
+SCAN_BATCH_SIZE = int(os.environ.get("SCAN_BATCH_SIZE", 500))
+METADATA_SCANNER = os.environ.get("METADATA_SCANNER", "1") == "1"
+
+
+def check_track(track: crud.TrackFile, force: bool = False) -> dict | None:
+    """Returns the metadata update for `track`, or None if its file is missing or unchanged.
+
+    Also writes the track's waveform peaks when they are missing or older than the file.
+    """
+    path = resolve_audio_path(track.track_url)
+    if path is None:
+        return None
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        return None
+
+    # waveform peaks are a separate sidecar file, kept as fresh as the audio
+    if waveform.has_peaks_source(track.track_url) and (
+        force or waveform.needs_peaks(track.track_url, stat_result.st_mtime)
+    ):
+        try:
+            waveform.write_peaks(track.track_url, path)
+        except (OSError, ValueError) as e:
+            logger.warning("Could not compute the waveform of track %s: %s", track.alias, e)
+
+    if not force and (track.file_size, track.file_mtime) == (stat_result.st_size, stat_result.st_mtime):
+        return None
+
+    metadata = {
+        "id": track.id,
+        "file_size": stat_result.st_size,
+        "file_mtime": stat_result.st_mtime,
+    }
+    try:
+        info = probe(path)
+    except (OSError, UnsupportedAudio) as e:
+        # remember the size and mtime anyway, so the file is not probed again until it changes
+        logger.warning("Could not read audio metadata of track %s: %s", track.alias, e)
+        return metadata | {
+            "duration": None,
+            "bitrate": None,
+            "sample_rate": None,
+            "codec": None,
+            "mime_type": guess_mime_type(track.track_url),
+        }
+    return metadata | info._asdict()
+
+
+class MetadataScanner:
+    def __init__(self, workers: int, interval: float, batch_size: int = SCAN_BATCH_SIZE):
+        self.workers = workers
+        self.interval = interval
+        self.batch_size = batch_size
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.scans = 0
+        self.updated = 0
+        self.last_scan_seconds = None
+
+    def scan(self, force: bool = False) -> int:
+        started = time.perf_counter()
+        updated = 0
+        db = SessionLocal()
+        try:
+            with ThreadPoolExecutor(self.workers, thread_name_prefix="metadata-scan") as executor:
+                after_id = 0
+                while not self.stopping.is_set():
+                    tracks = crud.get_track_files(db, after_id=after_id, limit=self.batch_size)
+                    if not tracks:
+                        break
+                    after_id = tracks[-1].id
+                    # the read transaction is not needed while the files are probed
+                    db.rollback()
+
+                    results = executor.map(lambda track: check_track(track, force), tracks)
+                    metadata = [result for result in results if result is not None]
+                    if not metadata:
+                        continue
+
+                    crud.update_track_metadata(db, metadata)
+                    db.commit()
+                    updated += len(metadata)
+
+                    changed_ids = {result["id"] for result in metadata}
+                    tags = {"authors", "tracks", "playlists"}
+                    for track in tracks:
+                        if track.id in changed_ids:
+                            tags.update((
+                                f"track:{track.alias}",
+                                f"author:{track.author_id}",
+                                f"author-tracks:{track.author_id}",
+                            ))
+                    invalidate(*tags)
+        finally:
+            db.close()
+
+        self.scans += 1
+        self.updated += updated
+        self.last_scan_seconds = time.perf_counter() - started
+        return updated
+
+    def wake(self):
+        self.wakeup.set()
+
+    def run(self):
+        while not self.stopping.is_set():
+            self.wakeup.clear()
+            try:
+                self.scan()
+            except Exception:
+                logger.exception("Audio metadata scan failed")
+            self.wakeup.wait(self.interval or None)
+
+    def start(self):
+        if self.thread is None:
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self.run, name="metadata-scanner", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+            self.thread = None
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "scans": self.scans,
+            "updated": self.updated,
+            "last_scan_seconds": self.last_scan_seconds,
+        }
+
+
+metadata_scanner = MetadataScanner(SCAN_WORKERS, SCAN_INTERVAL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read duration, bitrate and codec of every track file.")
+    parser.add_argument("--force", action="store_true", help="probe files even if they did not change")
+    args = parser.parse_args()
+
+    scanner = MetadataScanner(SCAN_WORKERS, interval=0)
+    updated = scanner.scan(force=args.force)
+    print(f"{updated} tracks updated in {scanner.last_scan_seconds:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
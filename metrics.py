@@ -0,0 +1,317 @@
+import logging
+import os
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from contextvars import ContextVar
+from time import perf_counter
+
+import jinja2
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import event
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from db.database import engine, read_engine
+from db.snapshot import catalog_snapshot
+from metadata_scanner import metadata_scanner
+from page_cache import page_cache
+from password_pool import password_pool
+from play_recorder import play_recorder
+
+logger = logging.getLogger(__name__)
+
+metrics_router = APIRouter()
+
+# Requests slower than this are logged with their SQL, 0 turns the log off
+SLOW_REQUEST_SECONDS = float(os.environ.get("SLOW_REQUEST_SECONDS", 0))
+SLOW_REQUEST_STATEMENTS = 10  # how many of the slowest statements are logged
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+METRICS = {
+    "http_requests_total": ("counter", "Requests by route and status"),
+    "http_request_duration_seconds": ("histogram", "Request latency up to the last body chunk"),
+    "http_request_sql_statements": ("histogram", "SQL statements per request"),
+    "http_request_sql_seconds_total": ("counter", "Time spent in SQL statements"),
+    "http_request_template_seconds_total": ("counter", "Time spent rendering templates"),
+    "http_request_pool_checkouts_total": ("counter", "Connections checked out of the pool"),
+    "template_render_seconds": ("histogram", "Render time by template"),
+    "admission_rejected_total": ("counter", "Requests shed by admission control, by route class and reason"),
+    "admission_queue_seconds": ("histogram", "Time admitted requests waited for a slot of their route class"),
+    "db_statements_total": ("counter", "SQL statements, including those outside requests"),
+    "db_statement_seconds_total": ("counter", "Time spent in SQL statements, including outside requests"),
+    "db_pool_checkouts_total": ("counter", "Connections checked out of the pool"),
+    "db_pool_checked_out": ("gauge", "Connections currently checked out"),
+    "db_pool_size": ("gauge", "Connections the pool keeps open"),
+    "db_pool_overflow": ("gauge", "Connections open beyond the pool size"),
+    "password_pool_active": ("gauge", "Password hashes being computed"),
+    "password_pool_queued": ("gauge", "Password hashes waiting for a worker"),
+    "password_pool_completed_total": ("counter", "Password hashes computed"),
+    "password_pool_rejected_total": ("counter", "Logins rejected because the queue was full"),
+    "metadata_scanner_scans_total": ("counter", "Finished audio metadata scans"),
+    "metadata_scanner_updated_total": ("counter", "Tracks updated by the metadata scanner"),
+    "metadata_scanner_last_scan_seconds": ("gauge", "Duration of the last metadata scan"),
+    "page_cache_entries": ("gauge", "Pages in the page cache"),
+    "page_cache_bytes": ("gauge", "Size of the cached pages"),
+    "plays_recorded_total": ("counter", "Plays reported by the players"),
+    "plays_dropped_total": ("counter", "Plays dropped because the play buffer was full"),
+    "plays_pending": ("gauge", "Plays not yet written to the database"),
+    "play_flushes_total": ("counter", "Batches of plays written to the database"),
+    "play_last_flush_seconds": ("gauge", "Duration of the last write of plays"),
+    "catalog_snapshot_version": ("gauge", "Catalog change the snapshot has applied"),
+    "catalog_snapshot_authors": ("gauge", "Authors in the catalog snapshot"),
+    "catalog_snapshot_tracks": ("gauge", "Tracks in the catalog snapshot"),
+    "catalog_snapshot_refreshes_total": ("counter", "Catalog snapshot refreshes"),
+    "catalog_snapshot_full_loads_total": ("counter", "Catalog snapshot refreshes that loaded everything"),
+    "catalog_snapshot_last_refresh_seconds": ("gauge", "Duration of the last catalog snapshot refresh"),
+}
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class RequestStats:
+    __slots__ = ("statements", "sql_seconds", "template_seconds", "checkouts", "queries")
+
+    def __init__(self, keep_queries: bool):
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        self.checkouts = 0
+        # statement -> [count, seconds], only kept for the slow request log
+        self.queries: dict[str, list] | None = defaultdict(lambda: [0, 0.0]) if keep_queries else None
+
+
+# set by MetricsMiddleware for the duration of a request; anyio copies the
+# context into worker threads, so the sync handlers see it too
+current_request: ContextVar[RequestStats | None] = ContextVar("current_request", default=None)
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: dict[tuple[str, tuple], float] = defaultdict(float)
+        self.histograms: dict[tuple[str, tuple], Histogram] = {}
+
+    def inc(self, name: str, labels: tuple = (), value: float = 1):
+        with self.lock:
+            self.counters[name, labels] += value
+
+    def observe(self, name: str, labels: tuple, value: float, buckets: tuple[float, ...]):
+        with self.lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = self.histograms[name, labels] = Histogram(buckets)
+            histogram.observe(value)
+
+    def record_request(self, method: str, route: str, status: int, seconds: float, stats: RequestStats):
+        labels = (("method", method), ("route", route))
+        with self.lock:
+            self.counters["http_requests_total", labels + (("status", str(status)),)] += 1
+            self.counters["http_request_sql_seconds_total", labels] += stats.sql_seconds
+            self.counters["http_request_template_seconds_total", labels] += stats.template_seconds
+            self.counters["http_request_pool_checkouts_total", labels] += stats.checkouts
+        self.observe("http_request_duration_seconds", labels, seconds, LATENCY_BUCKETS)
+        self.observe("http_request_sql_statements", labels, stats.statements, STATEMENT_BUCKETS)
+
+    def render(self, gauges: dict[tuple[str, tuple], float]) -> str:
+        with self.lock:
+            samples = defaultdict(list)
+            for (name, labels), value in sorted(list(self.counters.items()) + list(gauges.items())):
+                samples[name].append(f"{name}{format_labels(labels)} {format_value(value)}")
+            for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                    cumulative += count
+                    le = (("le", "+Inf" if bound == float("inf") else format_value(bound)),)
+                    samples[name].append(f"{name}_bucket{format_labels(labels + le)} {cumulative}")
+                samples[name].append(f"{name}_sum{format_labels(labels)} {format_value(histogram.sum)}")
+                samples[name].append(f"{name}_count{format_labels(labels)} {cumulative}")
+
+        lines = []
+        for name in sorted(samples):
+            kind, description = METRICS[name]
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(samples[name])
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in labels) + "}"
+
+
+def format_value(value: float) -> str:
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def route_name(scope: Scope) -> str:
+    """The path template of the route that handles `scope`, so aliases do not become labels."""
+    # matched again here because page cache hits never reach the router
+    for route in scope["app"].router.routes:
+        match, _ = route.matches(scope)
+        if match != Match.NONE:
+            return route.path
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(keep_queries=SLOW_REQUEST_SECONDS > 0)
+        token = current_request.set(stats)
+        status = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            seconds = perf_counter() - started
+            current_request.reset(token)
+            route = route_name(scope)
+            metrics.record_request(scope["method"], route, status, seconds, stats)
+            if SLOW_REQUEST_SECONDS and seconds >= SLOW_REQUEST_SECONDS:
+                log_slow_request(scope, route, status, seconds, stats)
+
+
+def log_slow_request(scope: Scope, route: str, status: int, seconds: float, stats: RequestStats):
+    slowest = sorted(stats.queries.items(), key=lambda item: item[1][1], reverse=True)
+    queries = "".join(
+        f"\n  {count}x {total * 1000:.1f} ms  {' '.join(statement.split())}"
+        for statement, (count, total) in slowest[:SLOW_REQUEST_STATEMENTS]
+    )
+    query_string = scope["query_string"].decode("latin-1")
+    logger.warning(
+        "Slow request %s %s%s (%s) returned %d in %.3fs: %d SQL statements took %.3fs, templates %.3fs%s",
+        scope["method"], scope["path"], f"?{query_string}" if query_string else "", route, status,
+        seconds, stats.statements, stats.sql_seconds, stats.template_seconds, queries,
+    )
+
+
+class TimedTemplate(jinja2.Template):
+    """Used as the environment's template class, so every render is timed."""
+
+    def render(self, *args, **kwargs) -> str:
+        started = perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            seconds = perf_counter() - started
+            metrics.observe("template_render_seconds", (("template", self.name or ""),), seconds, LATENCY_BUCKETS)
+            if (stats := current_request.get()) is not None:
+                stats.template_seconds += seconds
+
+
+def instrument_engine(engine):
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_statement(conn, cursor, statement, parameters, context, executemany):
+        conn.info["statement_started"] = perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def end_statement(conn, cursor, statement, parameters, context, executemany):
+        seconds = perf_counter() - conn.info.pop("statement_started")
+        metrics.inc("db_statements_total")
+        metrics.inc("db_statement_seconds_total", value=seconds)
+        if (stats := current_request.get()) is not None:
+            stats.statements += 1
+            stats.sql_seconds += seconds
+            if stats.queries is not None:
+                query = stats.queries[statement]
+                query[0] += 1
+                query[1] += seconds
+
+    @event.listens_for(engine.pool, "checkout")
+    def count_checkout(dbapi_connection, connection_record, connection_proxy):
+        metrics.inc("db_pool_checkouts_total")
+        if (stats := current_request.get()) is not None:
+            stats.checkouts += 1
+
+
+def collect_gauges(engines) -> dict[tuple[str, tuple], float]:
+    gauges = {}
+    for name, engine in engines.items():
+        labels = (("engine", name),)
+        # pools for in-memory databases have no size
+        for metric, method in (
+            ("db_pool_checked_out", "checkedout"),
+            ("db_pool_size", "size"),
+            ("db_pool_overflow", "overflow"),
+        ):
+            if hasattr(engine.pool, method):
+                gauges[metric, labels] = getattr(engine.pool, method)()
+
+    pool = password_pool.stats()
+    gauges["password_pool_active", ()] = pool["active"]
+    gauges["password_pool_queued", ()] = pool["queued"]
+    gauges["password_pool_completed_total", ()] = pool["completed"]
+    gauges["password_pool_rejected_total", ()] = pool["rejected"]
+
+    scanner = metadata_scanner.stats()
+    gauges["metadata_scanner_scans_total", ()] = scanner["scans"]
+    gauges["metadata_scanner_updated_total", ()] = scanner["updated"]
+    if scanner["last_scan_seconds"] is not None:
+        gauges["metadata_scanner_last_scan_seconds", ()] = scanner["last_scan_seconds"]
+
+    plays = play_recorder.stats()
+    gauges["plays_recorded_total", ()] = plays["recorded"]
+    gauges["plays_dropped_total", ()] = plays["dropped"]
+    gauges["plays_pending", ()] = plays["pending"]
+    gauges["play_flushes_total", ()] = plays["flushes"]
+    if plays["last_flush_seconds"] is not None:
+        gauges["play_last_flush_seconds", ()] = plays["last_flush_seconds"]
+
+    if catalog_snapshot.enabled:
+        snapshot = catalog_snapshot.stats()
+        if snapshot["version"] is not None:
+            gauges["catalog_snapshot_version", ()] = snapshot["version"]
+        gauges["catalog_snapshot_authors", ()] = snapshot["authors"]
+        gauges["catalog_snapshot_tracks", ()] = snapshot["tracks"]
+        gauges["catalog_snapshot_refreshes_total", ()] = snapshot["refreshes"]
+        gauges["catalog_snapshot_full_loads_total", ()] = snapshot["full_loads"]
+        if snapshot["last_refresh_seconds"] is not None:
+            gauges["catalog_snapshot_last_refresh_seconds", ()] = snapshot["last_refresh_seconds"]
+
+    gauges["page_cache_entries", ()] = len(page_cache.entries)
+    gauges["page_cache_bytes", ()] = page_cache.size
+    return gauges
+
+
+@metrics_router.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    engines = {"write": engine} if read_engine is engine else {"write": engine, "read": read_engine}
+    return PlainTextResponse(
+        metrics.render(collect_gauges(engines)),
+        media_type="text/plain; version=0.0.4"
+    )
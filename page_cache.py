@@ -0,0 +1,164 @@
+import os
+import threading
+from collections import OrderedDict
+from hashlib import blake2b
+from typing import NamedTuple
+from urllib.parse import parse_qsl, urlencode
+
+from starlette.requests import Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+PAGE_CACHE_BYTES = int(os.environ.get("PAGE_CACHE_BYTES", 32 * 1024 * 1024))
+
+
+class CachedPage(NamedTuple):
+    status: int
+    headers: list[tuple[bytes, bytes]]
+    body: bytes
+    etag: bytes
+    tags: frozenset[str]
+
+
+class PageCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries: OrderedDict[str, CachedPage] = OrderedDict()
+        self.by_tag: dict[str, set[str]] = {}
+        # bumped by every invalidation, so a page rendered before a write
+        # is never stored after it
+        self.version = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> CachedPage | None:
+        with self.lock:
+            page = self.entries.get(key)
+            if page is not None:
+                self.entries.move_to_end(key)
+            return page
+
+    def put(self, key: str, page: CachedPage, version: int):
+        if len(page.body) > self.max_bytes:
+            return
+
+        with self.lock:
+            if version != self.version:
+                return
+            self._remove(key)
+            self.entries[key] = page
+            self.size += len(page.body)
+            for tag in page.tags:
+                self.by_tag.setdefault(tag, set()).add(key)
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+
+    def invalidate(self, *tags: str):
+        with self.lock:
+            self.version += 1
+            for tag in tags:
+                for key in self.by_tag.pop(tag, ()):
+                    self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.version += 1
+            self.entries.clear()
+            self.by_tag.clear()
+            self.size = 0
+
+    def _remove(self, key: str):
+        page = self.entries.pop(key, None)
+        if page is None:
+            return
+        self.size -= len(page.body)
+        for tag in page.tags:
+            keys = self.by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.by_tag[tag]
+
+
+page_cache = PageCache(PAGE_CACHE_BYTES)
+
+
+def cache_page(request: Request, *tags: str):
+    """Marks the response of a GET handler as cacheable under `tags`."""
+    request.state.cache_tags = frozenset(tags)
+
+
+def invalidate(*tags: str):
+    page_cache.invalidate(*tags)
+
+
+def cache_key(scope: Scope) -> str:
+    query = sorted(parse_qsl(scope["query_string"].decode("latin-1"), keep_blank_values=True))
+    return f"{scope['path']}?{urlencode(query)}"
+
+
+def etag_matches(scope: Scope, etag: bytes) -> bool:
+    for name, value in scope["headers"]:
+        if name == b"if-none-match":
+            tags = [tag.strip().removeprefix(b"W/") for tag in value.split(b",")]
+            return etag in tags or b"*" in tags
+    return False
+
+
+class PageCacheMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] != "GET":
+            await self.app(scope, receive, send)
+            return
+
+        key = cache_key(scope)
+        if (page := page_cache.get(key)) is not None:
+            await self.send_page(page, scope, send)
+            return
+
+        version = page_cache.version
+        start: Message | None = None
+        body: list[bytes] = []
+
+        async def send_wrapper(message: Message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                tags = scope.get("state", {}).get("cache_tags")
+                if tags is not None and message["status"] == 200:
+                    start = message
+                    return
+            elif start is not None:
+                body.append(message.get("body", b""))
+                if message.get("more_body", False):
+                    return
+
+                content = b"".join(body)
+                page = CachedPage(
+                    start["status"],
+                    list(start["headers"]),
+                    content,
+                    b'"' + blake2b(content, digest_size=16).hexdigest().encode() + b'"',
+                    scope["state"]["cache_tags"],
+                )
+                page_cache.put(key, page, version)
+                await self.send_page(page, scope, send)
+                return
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    async def send_page(self, page: CachedPage, scope: Scope, send: Send):
+        validators = [(b"etag", page.etag), (b"cache-control", b"no-cache")]
+        if etag_matches(scope, page.etag):
+            await send({"type": "http.response.start", "status": 304, "headers": validators})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        await send({
+            "type": "http.response.start",
+            "status": page.status,
+            "headers": page.headers + validators,
+        })
+        await send({"type": "http.response.body", "body": page.body})
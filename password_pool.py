@@ -0,0 +1,61 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from fastapi import HTTPException
+
+# bcrypt releases the GIL, so a small dedicated thread pool is enough to keep
+# hashing off the event loop and out of the pool that serves catalog routes.
+HASH_POOL_SIZE = int(os.environ.get("HASH_POOL_SIZE", os.cpu_count() or 2))
+HASH_QUEUE_LIMIT = int(os.environ.get("HASH_QUEUE_LIMIT", 32))
+
+
+class PasswordPool:
+    def __init__(self, workers: int, queue_limit: int):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix="password-hash"
+        )
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    async def run(self, func, *args, **kwargs):
+        if self.in_flight >= self.workers + self.queue_limit:
+            self.rejected += 1
+            raise HTTPException(
+                503,
+                "Too many authentication requests, try again later",
+                headers={"Retry-After": "1"}
+            )
+
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self.executor,
+                partial(func, *args, **kwargs)
+            )
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "queue_limit": self.queue_limit,
+            "active": min(self.in_flight, self.workers),
+            "queued": max(self.in_flight - self.workers, 0),
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "saturation": self.in_flight / (self.workers + self.queue_limit),
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+password_pool = PasswordPool(HASH_POOL_SIZE, HASH_QUEUE_LIMIT)
@@ -0,0 +1,131 @@
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timezone
+
+from db import crud
+from db.database import SessionLocal
+from page_cache import invalidate
+
+logger = logging.getLogger(__name__)
+
+# Plays are counted in memory and written in one transaction per flush, so a
+# play costs the single SQLite writer nothing. A crash loses at most the plays
+# of the last PLAY_FLUSH_SECONDS.
+PLAY_FLUSH_SECONDS = float(os.environ.get("PLAY_FLUSH_SECONDS", 5))
+PLAY_FLUSH_EVENTS = int(os.environ.get("PLAY_FLUSH_EVENTS", 1000))
+# distinct (track, day) pairs held between flushes, plays of further tracks are dropped
+PLAY_BUFFER_LIMIT = int(os.environ.get("PLAY_BUFFER_LIMIT", 100_000))
+CHART_DAYS_KEPT = 30
+CHART_WEEKS_KEPT = 12
+
+
+def today() -> date:
+    return datetime.now(timezone.utc).date()
+
+
+class PlayRecorder:
+    def __init__(self, interval: float, flush_events: int, buffer_limit: int):
+        self.interval = interval
+        self.flush_events = flush_events
+        self.buffer_limit = buffer_limit
+        self.lock = threading.Lock()
+        self.pending: Counter[tuple[str, date]] = Counter()
+        self.pending_events = 0
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.recorded = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.last_flush_seconds = None
+        self.pruned_on = None
+        self.chart_day = today()
+
+    def record(self, track_alias: str):
+        key = (track_alias, today())
+        with self.lock:
+            if key not in self.pending and len(self.pending) >= self.buffer_limit:
+                self.dropped += 1
+                return
+            self.pending[key] += 1
+            self.pending_events += 1
+            self.recorded += 1
+            full = self.pending_events >= self.flush_events
+        if full:
+            self.wakeup.set()
+
+    def flush(self) -> int:
+        if self.chart_day != (day := today()):
+            # the cached chart pages are yesterday's, under the same URLs
+            invalidate("charts")
+            self.chart_day = day
+
+        with self.lock:
+            plays, self.pending = self.pending, Counter()
+            events, self.pending_events = self.pending_events, 0
+        if not plays:
+            return 0
+
+        started = time.perf_counter()
+        db = SessionLocal()
+        try:
+            crud.add_plays(db, plays)
+            if self.pruned_on != day:
+                crud.prune_charts(db, day, CHART_DAYS_KEPT, CHART_WEEKS_KEPT)
+                self.pruned_on = day
+            db.commit()
+        except Exception:
+            # kept for the next flush, the database may only have been busy
+            with self.lock:
+                self.pending.update(plays)
+                self.pending_events += events
+            raise
+        finally:
+            db.close()
+
+        invalidate("charts")
+        self.flushes += 1
+        self.last_flush_seconds = time.perf_counter() - started
+        return events
+
+    def run(self):
+        while not self.stopping.is_set():
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Writing play counts failed")
+
+    def start(self):
+        if self.thread is None:
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self.run, name="play-recorder", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+            self.thread = None
+        # whatever came in since the thread's last flush
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Writing play counts failed")
+
+    def stats(self):
+        return {
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "pending": self.pending_events,
+            "flushes": self.flushes,
+            "last_flush_seconds": self.last_flush_seconds,
+        }
+
+
+play_recorder = PlayRecorder(PLAY_FLUSH_SECONDS, PLAY_FLUSH_EVENTS, PLAY_BUFFER_LIMIT)
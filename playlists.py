@@ -1,21 +1,26 @@
-from fastapi import Depends, HTTPException, APIRouter
+from fastapi import Depends, HTTPException, APIRouter, Query
 from fastapi.templating import Jinja2Templates
 
 from sqlalchemy.orm import Session
 from starlette.requests import Request
-from db import crud, models, schemas
+from typing import Annotated
+from db import crud, schemas
 
 from handle_db import *
+from query_budget import query_budget
 from security import get_current_user
+from principal_cache import Principal
 from display_tracks import change_track_data
 from app_initialize import templates
+from page_cache import cache_page, invalidate
 
 playlist_router = APIRouter()
 
 @playlist_router.post("/playlists/", response_model=schemas.Playlist)
-async def create_playlist(
+@query_budget(5)
+def create_playlist(
     playlist: schemas.PlaylistCreate,
-    current_user: models.User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     if playlist := crud.create_playlist(
@@ -25,68 +30,102 @@ async def create_playlist(
         playlist.description,
         current_user.id
     ):
+        invalidate("playlists")
         return playlist
 
     raise HTTPException(400, "Playlist with this alias already exists")
 
 
-@playlist_router.post("/playlists/{playlist_alias}/tracks/{track_alias}")
-async def add_track_to_playlist(
-    playlist_alias: str,
-    track_alias: str,
-    current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
-    playlist = crud.get_playlist(db, playlist_alias=playlist_alias)
+def get_editable_playlist(db: Session, playlist_alias: str, current_user: Principal):
+    playlist = crud.get_playlist(db, playlist_alias=playlist_alias, load_tracks=False)
 
     if not playlist:
         raise HTTPException(404, "Playlist not found")
 
     if current_user.rights != "admin" and current_user.id != playlist.creator_id:
         raise HTTPException(403, "You are not allowed to modify this playlist")
+    return playlist
+
+
+@playlist_router.post("/playlists/{playlist_alias}/tracks/{track_alias}")
+@query_budget(7)
+def add_track_to_playlist(
+    playlist_alias: str,
+    track_alias: str,
+    current_user: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    playlist = get_editable_playlist(db, playlist_alias, current_user)
 
     if added_track := crud.add_track_to_playlist(
         db,
-        playlist_alias=playlist_alias,
+        playlist_id=playlist.id,
         track_alias=track_alias
     ):
+        invalidate("playlists")
         return added_track
 
     raise HTTPException(404, "Track not found")
 
 
-@playlist_router.get("/playlists/all")
-async def get_playlists(request: Request, db: Session = Depends(get_db)):
-    playlists = crud.get_playlists(db)
-
-    playlists_data = []
-    for playlist in playlists:
-        playlist_info = {
-            "title": playlist.title,
-            "alias": playlist.alias,
-            "creator": playlist.creator.username,
-            "tracks": playlist.tracks[:5] if playlist.tracks else [],
-            "description": playlist.description
-        }
-        playlists_data.append(playlist_info)
+@playlist_router.patch("/playlists/{playlist_alias}/tracks")
+# every operation looks up and writes its own rows
+@query_budget(None, repeat_limit=None)
+def edit_playlist_tracks(
+    playlist_alias: str,
+    edits: schemas.PlaylistEdits,
+    current_user: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    playlist = get_editable_playlist(db, playlist_alias, current_user)
+
+    operations = [crud.PlaylistEdit(**edit.model_dump()) for edit in edits.operations]
+    try:
+        track_count = crud.edit_playlist(db, playlist.id, operations)
+    except crud.PlaylistEditError as e:
+        raise HTTPException(404 if e.not_found else 409, str(e))
+
+    invalidate("playlists")
+    return {"applied": len(operations), "track_count": track_count}
+
 
+@playlist_router.get("/playlists/all")
+@query_budget(2)
+def get_playlists(
+    request: Request,
+    cursor: str | None = None,
+    limit: Annotated[int, Query(ge=1, le=500)] = 100,
+    db: Session = Depends(get_read_db)
+):
+    page = crud.get_playlist_overview(db, cursor=cursor, limit=limit)
+    cache_page(request, "playlists")
     return templates.TemplateResponse(
         "all_playlists.html",
-        {"request": request, "playlists": playlists_data}
+        {"request": request, "playlists": page.items, "page": page}
     )
 
 
 @playlist_router.get("/playlists/{playlist_alias}")
-async def get_playlist(
+@query_budget(3)
+def get_playlist(
     request: Request,
     playlist_alias: str,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    playlist = crud.get_playlist(db, playlist_alias=playlist_alias)
-    playlist.tracks = change_track_data(playlist.tracks, db)
+    playlist = crud.get_playlist(
+        db,
+        playlist_alias=playlist_alias,
+        load_tracks=False
+    )
+
+    if not playlist:
+        raise HTTPException(404, "Playlist not found")
+
+    tracks = change_track_data(crud.list_playlist_tracks(db, playlist.id))
     return templates.TemplateResponse(
         "playlist.html",
         {"request": request,
          "playlist": playlist,
+         "tracks": tracks,
          "creator": playlist.creator.username}
     )
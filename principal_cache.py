@@ -0,0 +1,63 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+PRINCIPAL_CACHE_TTL = float(os.environ.get("PRINCIPAL_CACHE_TTL", 60))
+PRINCIPAL_CACHE_SIZE = int(os.environ.get("PRINCIPAL_CACHE_SIZE", 10_000))
+
+
+class Principal(NamedTuple):
+    id: int
+    username: str
+    rights: str
+    bio: str | None
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, user.username, user.rights, user.bio)
+
+
+class PrincipalCache:
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries: OrderedDict[str, tuple[Principal, float]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, username: str) -> Principal | None:
+        with self.lock:
+            entry = self.entries.get(username)
+            if entry is None:
+                return None
+
+            principal, expires_at = entry
+            if expires_at <= time.time():
+                del self.entries[username]
+                return None
+
+            self.entries.move_to_end(username)
+            return principal
+
+    def put(self, principal: Principal, token_expires_at: float | None = None):
+        expires_at = time.time() + self.ttl
+        if token_expires_at is not None:
+            expires_at = min(expires_at, token_expires_at)
+
+        with self.lock:
+            self.entries[principal.username] = (principal, expires_at)
+            self.entries.move_to_end(principal.username)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, username: str):
+        with self.lock:
+            self.entries.pop(username, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+principal_cache = PrincipalCache(PRINCIPAL_CACHE_TTL, PRINCIPAL_CACHE_SIZE)
@@ -0,0 +1,170 @@
+import logging
+import os
+import re
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, NamedTuple
+
+from sqlalchemy import event
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from db.database import engine, read_engine
+
+logger = logging.getLogger(__name__)
+
+# A development aid: "log" warns and "raise" fails the request with a 500
+# when a route goes over its declared budget or repeats a statement.
+QUERY_BUDGET_MODE = os.environ.get("QUERY_BUDGET_MODE", "off")
+# a statement shape run more often than this in one request is likely an N+1
+QUERY_REPEAT_LIMIT = int(os.environ.get("QUERY_REPEAT_LIMIT", 3))
+
+IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+
+class QueryBudget(NamedTuple):
+    statements: int | None
+    repeat_limit: int | None = QUERY_REPEAT_LIMIT
+
+
+def query_budget(statements: int | None, repeat_limit: int | None = QUERY_REPEAT_LIMIT):
+    """Declares how many SQL statements the decorated route may run per request.
+
+    None turns a check off, for routes whose work grows with the request.
+    """
+    def decorate(endpoint):
+        endpoint.query_budget = QueryBudget(statements, repeat_limit)
+        return endpoint
+    return decorate
+
+
+def statement_shape(statement: str) -> str:
+    # selectinload batches differ only in the length of their IN lists
+    return IN_LIST.sub("(?...)", " ".join(statement.split()))
+
+
+def find_problems(statements: list[str], budget: QueryBudget) -> list[str]:
+    problems = []
+    if budget.statements is not None and len(statements) > budget.statements:
+        problems.append(f"{len(statements)} SQL statements, the budget is {budget.statements}")
+    if budget.repeat_limit is None:
+        return problems
+    for shape, count in Counter(map(statement_shape, statements)).most_common():
+        if count <= budget.repeat_limit:
+            break
+        problems.append(f"the same statement ran {count} times, likely an N+1: {shape}")
+    return problems
+
+
+current_statements: ContextVar[list[str] | None] = ContextVar("current_statements", default=None)
+
+
+def watch_engine(db_engine):
+    @event.listens_for(db_engine, "before_cursor_execute")
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        if (statements := current_statements.get()) is not None:
+            statements.append(statement)
+
+
+class QueryBudgetMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        statements = []
+        token = current_statements.set(statements)
+
+        # checked when the response starts, so "raise" can still turn it into
+        # a 500; statements of a streaming body after that are not counted
+        async def send_wrapper(message: Message):
+            if message["type"] == "http.response.start":
+                check_request(scope, statements)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_statements.reset(token)
+
+
+def check_request(scope: Scope, statements: list[str]):
+    budget = getattr(scope.get("endpoint"), "query_budget", QueryBudget(None))
+    problems = find_problems(statements, budget)
+    if not problems:
+        return
+
+    report = f"{scope['method']} {scope['path']}: " + "; ".join(problems)
+    if QUERY_BUDGET_MODE == "raise":
+        raise QueryBudgetExceeded(report)
+    logger.warning(report)
+
+
+# TEST HELPERS
+
+
+captured_statements: ContextVar[list[str] | None] = ContextVar("captured_statements", default=None)
+
+
+@contextmanager
+def capture_statements(*engines) -> Iterator[list[str]]:
+    """Collects the statements run on `engines` inside the block.
+
+    Like QueryBudgetMiddleware it counts only its own context, which requests
+    of a TestClient inherit, so background threads such as the play recorder
+    flush are left out.
+    """
+    engines = engines or {engine, read_engine}
+    statements = []
+    token = captured_statements.set(statements)
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if captured_statements.get() is statements:
+            statements.append(statement)
+
+    for db_engine in engines:
+        event.listen(db_engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        for db_engine in engines:
+            event.remove(db_engine, "before_cursor_execute", record)
+        captured_statements.reset(token)
+
+
+@contextmanager
+def assert_max_queries(budget: int | None, repeat_limit: int | None = QUERY_REPEAT_LIMIT, engines=()):
+    """Fails if the block runs more than `budget` statements or repeats one too often.
+
+        with assert_max_queries(2):
+            client.get("/")
+    """
+    with capture_statements(*engines) as statements:
+        yield statements
+    problems = find_problems(statements, QueryBudget(budget, repeat_limit))
+    assert not problems, "\n".join(problems)
+
+
+def find_endpoint(app, url: str, method: str = "GET"):
+    path = url.partition("?")[0]
+    scope = {"type": "http", "method": method, "path": path, "root_path": ""}
+    return next(
+        (route.endpoint for route in app.router.routes
+         if route.matches(scope)[0] == Match.FULL and hasattr(route, "endpoint")),
+        None
+    )
+
+
+def assert_route_budget(client, url: str, method: str = "GET", **kwargs):
+    """Requests `url` with a TestClient and holds it to its route's declared budget."""
+    budget = getattr(find_endpoint(client.app, url, method), "query_budget", QueryBudget(None))
+    with assert_max_queries(*budget):
+        return client.request(method, url, **kwargs)
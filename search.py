@@ -0,0 +1,37 @@
+from fastapi import Depends, APIRouter, Query
+from starlette.requests import Request
+from typing import Annotated
+
+from sqlalchemy.orm import Session
+from db import fulltext
+
+from handle_db import get_read_db
+from query_budget import query_budget
+from app_initialize import templates
+
+search_router = APIRouter()
+
+RESULT_URLS = {
+    "track": "/tracks/{}",
+    "author": "/authors/{}",
+    "playlist": "/playlists/{}",
+}
+
+
+@search_router.get("/search")
+# the hits, then the tracks, authors and playlists among them
+@query_budget(4)
+def search(
+    request: Request,
+    q: Annotated[str, Query(max_length=200)] = "",
+    limit: Annotated[int, Query(ge=1, le=200)] = 50,
+    db: Session = Depends(get_read_db)
+):
+    results = fulltext.search(db, q, limit=limit)
+    return templates.TemplateResponse(
+        "search.html",
+        {"request": request,
+         "query": q,
+         "results": results,
+         "urls": RESULT_URLS}
+    )
@@ -4,6 +4,7 @@ from jose import JWTError, jwt
 from passlib.context import CryptContext
 from datetime import datetime, timedelta, timezone
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from starlette.concurrency import run_in_threadpool
 from starlette.requests import Request
 
 from handle_db import get_db
@@ -11,6 +12,8 @@ from sqlalchemy.orm import Session
 from db import crud, schemas
 from secret_key import SECRET_KEY # excluded in gitignore
 from app_initialize import templates
+from password_pool import password_pool
+from principal_cache import Principal, principal_cache
 
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
@@ -28,7 +31,10 @@ def token_create(data: dict, expires_delta: timedelta = timedelta(minutes=ACCESS
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
-def get_current_user(request: Request, db: Session = Depends(get_db)):
+def get_current_user(request: Request, db: Session = Depends(get_db)) -> Principal:
+    if user := getattr(request.state, "principal", None):
+        return user
+
     try:
         token = request.cookies.get("access_token")
         if token is None:
@@ -38,17 +44,29 @@ def get_current_user(request: Request, db: Session = Depends(get_db)):
         username: str = payload.get("sub")
         if username is None:
             raise HTTPException(401, detail="Could not validate credentials")
-        user = crud.get_user(db, username=username)
+
+        user = principal_cache.get(username)
         if user is None:
-            raise HTTPException(401, detail="Could not validate credentials")
+            db_user = crud.get_user(db, username=username)
+            if db_user is None:
+                raise HTTPException(401, detail="Could not validate credentials")
+            user = Principal.from_user(db_user)
+            principal_cache.put(user, payload.get("exp"))
+
+        request.state.principal = user
         return user
     except JWTError as e:
         raise HTTPException(401, detail="Could not validate credentials") from e
 
 @security_router.post("/token")
 async def token_get(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = crud.authenticate_user(db, form_data.username, form_data.password)
-    if not user:
+    user = await run_in_threadpool(crud.get_user, db, form_data.username)
+    if not user or not await password_pool.run(
+        crud.verify_password,
+        form_data.password,
+        user.hashed_password,
+        user.salt
+    ):
         raise HTTPException(status_code=401, detail="Incorrect username or password")
     access_token = token_create(data={"sub": user.username},)
 
@@ -56,11 +74,28 @@ async def token_get(form_data: OAuth2PasswordRequestForm = Depends(), db: Sessio
     response.set_cookie(key="access_token", value=access_token, httponly=True)
     return response
 
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    if crud.get_user(db, user['username']):
+async def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+    if await run_in_threadpool(crud.get_user, db, user['username']):
         raise HTTPException(400, "Such username already exists")
 
-    return crud.create_user(db, user['username'], user['password'])
+    salt = crud.make_salt()
+    hashed_password = await password_pool.run(
+        crud.get_password_hash,
+        user['password'] + salt
+    )
+    db_user = await run_in_threadpool(
+        crud.create_user_with_hash,
+        db,
+        user['username'],
+        hashed_password,
+        salt
+    )
+    principal_cache.invalidate(db_user.username)
+    return db_user
+
+@security_router.get("/metrics/password-pool")
+async def password_pool_metrics():
+    return password_pool.stats()
 
 @security_router.get("/auth")
 async def auth_page(request: Request):
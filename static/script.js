@@ -62,4 +62,67 @@ window.addEventListener('DOMContentLoaded', () => {
     }
 
     modeSwitch.addEventListener('change', toggleDarkMode);
-});
\ No newline at end of file
+});
+
+
+// Draws the peaks served by /tracks/{alias}/peaks on a canvas.waveform and
+// uses it to seek the <audio> element next to it.
+window.addEventListener('DOMContentLoaded', () => {
+    document.querySelectorAll('canvas.waveform').forEach(async canvas => {
+        const audio = canvas.parentElement.querySelector('audio');
+        const response = await fetch(canvas.dataset.peaks);
+        if (!audio || !response.ok) {
+            return;
+        }
+
+        // audiowaveform .dat v1: a 20 byte header, then (min, max) int8 pairs
+        const buffer = await response.arrayBuffer();
+        const length = new DataView(buffer).getUint32(16, true);
+        const peaks = new Int8Array(buffer, 20, length * 2);
+
+        canvas.hidden = false;
+        canvas.width = canvas.clientWidth;
+        const context = canvas.getContext('2d');
+
+        const draw = () => {
+            const { width, height } = canvas;
+            const played = audio.duration ? audio.currentTime / audio.duration : 0;
+            context.clearRect(0, 0, width, height);
+            for (let x = 0; x < width; x++) {
+                const i = Math.floor(x / width * length) * 2;
+                const top = (1 - peaks[i + 1] / 128) * height / 2;
+                const bottom = (1 - peaks[i] / 128) * height / 2;
+                context.fillStyle = x / width < played ? '#0d6efd' : '#adb5bd';
+                context.fillRect(x, top, 1, Math.max(bottom - top, 1));
+            }
+        };
+
+        draw();
+        audio.addEventListener('timeupdate', draw);
+        canvas.addEventListener('click', event => {
+            if (audio.duration) {
+                audio.currentTime = event.offsetX / canvas.clientWidth * audio.duration;
+            }
+        });
+    });
+});
+
+
+// Reports a play of an <audio data-track> to /tracks/{alias}/play once half of
+// it, or 30 seconds, was reached, and again when it is replayed after ending.
+window.addEventListener('DOMContentLoaded', () => {
+    document.querySelectorAll('audio[data-track]').forEach(audio => {
+        let reported = false;
+
+        audio.addEventListener('timeupdate', () => {
+            const threshold = Math.min(30, (audio.duration || 60) / 2);
+            if (!reported && audio.currentTime >= threshold) {
+                reported = true;
+                navigator.sendBeacon(`/tracks/${encodeURIComponent(audio.dataset.track)}/play`);
+            }
+        });
+        audio.addEventListener('ended', () => {
+            reported = false;
+        });
+    });
+});
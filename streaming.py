@@ -0,0 +1,200 @@
+import mmap
+import os
+import stat
+from email.utils import formatdate, parsedate_to_datetime
+from hashlib import md5
+from mimetypes import guess_type
+from pathlib import Path as FilePath
+
+import anyio
+from fastapi import Depends, HTTPException, APIRouter, Path
+from fastapi.responses import Response
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.types import Receive, Scope, Send
+from typing import Annotated
+
+from sqlalchemy.orm import Session
+from db import crud
+
+from handle_db import get_read_db
+
+stream_router = APIRouter()
+
+AUDIO_DIRECTORY = FilePath("static/audio")
+CHUNK_SIZE = 256 * 1024
+
+
+# Sends the file (or one byte range of it) through the ASGI zerocopysend or
+# pathsend extensions when the server offers them, otherwise in slices of a
+# memory-mapped file.
+class AudioFileResponse(Response):
+    def __init__(
+        self,
+        path: FilePath,
+        stat_result: os.stat_result,
+        headers: dict[str, str],
+        byte_range: tuple[int, int] | None = None,
+        media_type: str | None = None,
+    ):
+        self.path = path
+        self.byte_range = byte_range
+        self.status_code = 206 if byte_range else 200
+        self.media_type = media_type
+        self.background = None
+
+        size = stat_result.st_size
+        start, end = byte_range or (0, size - 1)
+        self.offset = start
+        self.count = end - start + 1 if size else 0
+
+        self.init_headers(headers)
+        self.headers["content-length"] = str(self.count)
+        if byte_range:
+            self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        extensions = scope.get("extensions") or {}
+
+        if scope["method"].upper() == "HEAD" or not self.count:
+            await send({"type": "http.response.body", "body": b""})
+        elif "http.response.zerocopysend" in extensions:
+            with open(self.path, "rb") as file:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": file.fileno(),
+                    "offset": self.offset,
+                    "count": self.count,
+                })
+        elif self.byte_range is None and "http.response.pathsend" in extensions:
+            await send({"type": "http.response.pathsend", "path": str(self.path)})
+        else:
+            await self._send_mapped(send)
+
+    async def _send_mapped(self, send: Send):
+        with open(self.path, "rb") as file, \
+                mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            position = self.offset
+            end = self.offset + self.count
+            while position < end:
+                chunk_end = min(position + CHUNK_SIZE, end)
+                chunk = await anyio.to_thread.run_sync(
+                    mapped.__getitem__, slice(position, chunk_end)
+                )
+                position = chunk_end
+                await send({
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": position < end,
+                })
+
+
+def resolve_audio_path(track_url: str) -> FilePath | None:
+    root = AUDIO_DIRECTORY.resolve()
+    path = (root / track_url).resolve()
+    if root not in path.parents:
+        return None
+    return path
+
+
+def make_etag(stat_result: os.stat_result) -> str:
+    etag_base = f"{stat_result.st_mtime}-{stat_result.st_size}"
+    return f'"{md5(etag_base.encode(), usedforsecurity=False).hexdigest()}"'
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    candidates = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+def is_not_modified(request: Request, etag: str, mtime: float) -> bool:
+    if if_none_match := request.headers.get("if-none-match"):
+        return etag_matches(if_none_match, etag)
+
+    if if_modified_since := request.headers.get("if-modified-since"):
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(mtime) <= since
+    return False
+
+
+# only single ranges are honoured, multi-range requests get the whole file
+def parse_range(header: str, size: int) -> tuple[int, int] | None:
+    unit, _, ranges = header.partition("=")
+    if unit.strip() != "bytes" or "," in ranges:
+        return None
+
+    start, _, end = ranges.strip().partition("-")
+    try:
+        if not start:
+            suffix = int(end)
+            if suffix <= 0:
+                raise ValueError
+            start, end = max(size - suffix, 0), size - 1
+        else:
+            start = int(start)
+            end = int(end) if end else size - 1
+    except ValueError:
+        return None
+
+    # an empty file has no byte to satisfy a suffix range with either
+    if start >= size or end < start:
+        raise HTTPException(
+            416,
+            "Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, min(end, size - 1)
+
+
+@stream_router.api_route("/stream/{track_alias}", methods=["GET", "HEAD"])
+async def stream_track(
+    request: Request,
+    track_alias: Annotated[str, Path(min_length=3, max_length=50)],
+    db: Session = Depends(get_read_db)
+):
+    track = await run_in_threadpool(crud.get_track, db, track_alias=track_alias)
+    if track is None:
+        raise HTTPException(404, "Track not found")
+
+    path = resolve_audio_path(track.track_url)
+    stat_result = None
+    if path is not None:
+        try:
+            stat_result = await anyio.to_thread.run_sync(os.stat, path)
+        except FileNotFoundError:
+            pass
+    if stat_result is None or not stat.S_ISREG(stat_result.st_mode):
+        raise HTTPException(404, "Audio file not found")
+
+    etag = make_etag(stat_result)
+    headers = {
+        "accept-ranges": "bytes",
+        "etag": etag,
+        "last-modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "cache-control": "public, max-age=86400",
+    }
+
+    if is_not_modified(request, etag, stat_result.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    byte_range = None
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range == etag):
+        byte_range = parse_range(range_header, stat_result.st_size)
+
+    return AudioFileResponse(
+        path,
+        stat_result,
+        headers,
+        byte_range=byte_range,
+        media_type=track.mime_type or guess_type(path.name)[0] or "application/octet-stream",
+    )
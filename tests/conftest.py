@@ -0,0 +1,19 @@
+import os
+import sys
+import tempfile
+
+# Settings are read on import, so they are set before the app's modules load.
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/audio_server.db")
+os.environ.update({
+    "METADATA_SCANNER": "0",
+    "RATE_LIMITS": "0",
+    # every request does all of its work, as on a cold cache
+    "PAGE_CACHE_BYTES": "0",
+    "PRINCIPAL_CACHE_TTL": "0",
+    "RELATED_CACHE_TTL": "0",
+    # no background flushes while statements are counted
+    "PLAY_FLUSH_SECONDS": "3600",
+    "CATALOG_SNAPSHOT": "0",
+})
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,97 @@
+import random
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from db import cooccurrence, crud, migrations, schemas
+from db.database import make_engine
+
+LIMIT = cooccurrence.MAX_PLAYLIST_TRACKS
+
+
+def pairs(connection):
+    return connection.execute(text("SELECT low_id, high_id, playlists FROM track_pairs ORDER BY 1, 2")).all()
+
+
+def rebuilt_pairs(engine):
+    with engine.connect() as connection:
+        for statement in cooccurrence.REBUILD_COOCCURRENCE:
+            connection.execute(text(statement))
+        rebuilt = pairs(connection)
+        connection.rollback()
+    return rebuilt
+
+
+def fill_playlist(db, user_id: int, name: str, aliases: list[str]) -> int:
+    playlist = crud.create_playlist(db, name, name, "", user_id)
+    crud.edit_playlist(db, playlist.id, [crud.PlaylistEdit("insert", alias) for alias in aliases])
+    return playlist.id
+
+
+def random_edit(rng: random.Random, tracks: list[str], aliases: list[str]) -> crud.PlaylistEdit:
+    # playlists drift around the limit, so they keep crossing it both ways
+    grow = len(tracks) < LIMIT or rng.random() < 0.45
+    outside = [alias for alias in aliases if alias not in tracks]
+    if outside and (grow or len(tracks) < 2) and rng.random() < 0.7:
+        edit = crud.PlaylistEdit("insert", rng.choice(outside), rng.randint(0, len(tracks)))
+        tracks.insert(edit.position, edit.track)
+        return edit
+
+    alias = rng.choice(tracks)
+    tracks.remove(alias)
+    if rng.random() < 0.5 or not tracks:
+        return crud.PlaylistEdit("remove", alias)
+    if rng.random() < 0.5:
+        edit = crud.PlaylistEdit("move", alias, rng.randint(0, len(tracks)))
+        tracks.insert(edit.position, alias)
+        return edit
+    edit = crud.PlaylistEdit("move", alias, after=rng.choice(tracks))
+    tracks.insert(tracks.index(edit.after) + 1, alias)
+    return edit
+
+
+def test_random_edits_match_a_full_rebuild(tmp_path):
+    engine = make_engine(f"sqlite:///{tmp_path / 'pairs.db'}")
+    migrations.migrate(engine)
+    rng = random.Random(1)
+
+    with Session(engine) as db:
+        user = crud.create_user_with_hash(db, "editor", "hash", "salt")
+        author = crud.create_author(db, schemas.AuthorCreate(name="Pairs", alias="pairs"))
+        aliases = []
+        for serial in range(LIMIT + 30):
+            track = schemas.TrackCreate(title=f"t{serial}", alias=f"t{serial}", track_url=f"t{serial}.mp3")
+            aliases.append(crud.create_track(db, track, author_id=author.id).alias)
+
+        playlists = {}
+        for serial, size in enumerate([LIMIT - 3, LIMIT, LIMIT + 3, 20]):
+            tracks = rng.sample(aliases, size)
+            playlists[fill_playlist(db, user.id, f"list{serial}", tracks)] = tracks
+        assert pairs(db.connection()) == rebuilt_pairs(engine)
+
+        for step in range(80):
+            action = rng.random()
+            if action < 0.05:
+                playlist_id = rng.choice(list(playlists))
+                crud.delete_playlist(db, playlist_id)
+                del playlists[playlist_id]
+                tracks = rng.sample(aliases, rng.randint(LIMIT - 5, LIMIT + 5))
+                playlists[fill_playlist(db, user.id, f"refill{step}", tracks)] = tracks
+            elif action < 0.1:
+                alias = rng.choice(aliases)
+                crud.delete_track(db, track_alias=alias)
+                aliases.remove(alias)
+                for tracks in playlists.values():
+                    if alias in tracks:
+                        tracks.remove(alias)
+            else:
+                playlist_id = rng.choice(list(playlists))
+                tracks = playlists[playlist_id]
+                edits = [random_edit(rng, tracks, aliases) for _ in range(rng.randint(1, 3))]
+                crud.edit_playlist(db, playlist_id, edits)
+
+            assert pairs(db.connection()) == rebuilt_pairs(engine), f"step {step}"
+            db.commit()
+
+        for playlist_id, tracks in playlists.items():
+            assert [track.alias for track in crud.list_playlist_tracks(db, playlist_id)] == tracks
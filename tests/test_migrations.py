@@ -0,0 +1,188 @@
+import logging
+import sqlite3
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from db import fulltext, migrations, models
+from db.database import make_engine
+
+# The schema of the first release, before any migration existed.
+BASELINE_SCHEMA = """
+CREATE TABLE authors (
+    id INTEGER NOT NULL,
+    name VARCHAR,
+    alias VARCHAR,
+    PRIMARY KEY (id),
+    UNIQUE (alias)
+);
+CREATE INDEX ix_authors_id ON authors (id);
+CREATE UNIQUE INDEX ix_authors_name ON authors (name);
+CREATE TABLE users (
+    id INTEGER NOT NULL,
+    username VARCHAR,
+    hashed_password VARCHAR,
+    rights VARCHAR,
+    salt VARCHAR,
+    bio VARCHAR,
+    PRIMARY KEY (id)
+);
+CREATE UNIQUE INDEX ix_users_username ON users (username);
+CREATE INDEX ix_users_id ON users (id);
+CREATE TABLE tracks (
+    id INTEGER NOT NULL,
+    title VARCHAR,
+    alias VARCHAR,
+    description VARCHAR,
+    track_url VARCHAR,
+    image_url VARCHAR,
+    author_id INTEGER,
+    PRIMARY KEY (id),
+    UNIQUE (alias),
+    UNIQUE (track_url),
+    FOREIGN KEY(author_id) REFERENCES authors (id)
+);
+CREATE INDEX ix_tracks_id ON tracks (id);
+CREATE TABLE playlists (
+    id INTEGER NOT NULL,
+    title VARCHAR,
+    alias VARCHAR,
+    description VARCHAR,
+    creator_id INTEGER,
+    PRIMARY KEY (id),
+    FOREIGN KEY(creator_id) REFERENCES users (id)
+);
+CREATE INDEX ix_playlists_id ON playlists (id);
+CREATE UNIQUE INDEX ix_playlists_alias ON playlists (alias);
+CREATE TABLE association (
+    playlist_id INTEGER,
+    track_id INTEGER,
+    FOREIGN KEY(playlist_id) REFERENCES playlists (id),
+    FOREIGN KEY(track_id) REFERENCES tracks (id)
+);
+"""
+
+SAMPLE_ROWS = """
+INSERT INTO users VALUES (1, 'alice', 'hash', 'admin', 'salt', '');
+INSERT INTO authors VALUES (1, 'Glass Harbour', 'glass-harbour'), (2, 'Low Tide', 'low-tide');
+INSERT INTO tracks VALUES
+    (1, 'Morning', 'morning', 'first light', 'morning.mp3', NULL, 1),
+    (2, 'Noon', 'noon', NULL, 'noon.mp3', 'noon.png', 1),
+    (3, 'Evening', 'evening', NULL, 'evening.mp3', NULL, 2);
+INSERT INTO playlists VALUES (1, 'Day', 'day', 'all day long', 1), (2, 'Night', 'night', NULL, 1);
+INSERT INTO association VALUES (1, 3), (1, 1), (1, 3), (1, 2), (2, 3), (2, 3), (NULL, 1);
+"""
+
+
+def build_database(path, rows=SAMPLE_ROWS):
+    connection = sqlite3.connect(path)
+    connection.executescript(BASELINE_SCHEMA + rows)
+    connection.close()
+    return make_engine(f"sqlite:///{path}")
+
+
+def schema_of(engine) -> dict:
+    """Columns, foreign keys and indexed columns of every table, index and trigger."""
+    shape = {}
+    with engine.connect() as connection:
+        objects = connection.execute(text(
+            "SELECT name, type FROM sqlite_master WHERE name NOT LIKE 'sqlite_%'"
+        )).all()
+        for name, kind in objects:
+            if kind == "table":
+                columns = connection.exec_driver_sql(f"PRAGMA table_info('{name}')")
+                foreign_keys = connection.exec_driver_sql(f"PRAGMA foreign_key_list('{name}')")
+                shape[name] = (
+                    sorted((row.name, row.type, row.notnull, row.pk) for row in columns),
+                    sorted((row.table, row[3], row.on_delete) for row in foreign_keys),
+                )
+            elif kind == "index":
+                shape[name] = [row.name for row in connection.exec_driver_sql(f"PRAGMA index_info('{name}')")]
+            else:
+                shape[name] = kind
+    return shape
+
+
+def test_upgrade_baseline_database(tmp_path):
+    engine = build_database(tmp_path / "baseline.db")
+
+    applied = migrations.migrate(engine)
+
+    assert [migration.version for migration in applied] == [m.version for m in migrations.MIGRATIONS]
+    fresh = make_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+    migrations.migrate(fresh)
+    assert schema_of(engine) == schema_of(fresh)
+
+    with engine.connect() as connection:
+        assert migrations.current_version(connection) == migrations.LATEST_VERSION
+        assert not connection.exec_driver_sql("PRAGMA foreign_key_check").all()
+        # duplicates and the entry without a playlist are gone, the first insertion order stays
+        entries = connection.execute(text(
+            "SELECT playlist_id, track_id FROM association ORDER BY playlist_id, position"
+        )).all()
+        assert entries == [(1, 3), (1, 1), (1, 2), (2, 3)]
+        assert connection.execute(text("SELECT description FROM playlists WHERE alias = 'night'")).scalar() is None
+        assert connection.execute(text("SELECT sum(play_count) FROM tracks")).scalar() == 0
+        pairs = connection.execute(text("SELECT low_id, high_id, playlists FROM track_pairs ORDER BY 1, 2")).all()
+        assert pairs == [(1, 2, 1), (1, 3, 1), (2, 3, 1)]
+
+    with Session(engine) as db:
+        assert [(hit.kind, hit.alias) for hit in fulltext.search(db, "evening")] == [("track", "evening")]
+        migrations.exercise_crud(db)
+
+    assert migrations.migrate(engine) == []
+
+
+def test_migrations_match_the_models(tmp_path):
+    migrated = make_engine(f"sqlite:///{tmp_path / 'migrated.db'}")
+    migrations.migrate(migrated)
+    created = make_engine(f"sqlite:///{tmp_path / 'created.db'}")
+    models.Base.metadata.create_all(created)
+
+    expected = schema_of(created)
+    assert {name: shape for name, shape in schema_of(migrated).items() if name in expected} == expected
+
+
+def test_upgrade_removes_references_left_by_old_deletions(tmp_path):
+    engine = build_database(tmp_path / "baseline.db", SAMPLE_ROWS + """
+        INSERT INTO tracks VALUES (4, 'Orphan', 'orphan', NULL, 'orphan.mp3', NULL, 99);
+        INSERT INTO association VALUES (3, 1), (1, 98);
+    """)
+
+    migrations.migrate(engine)
+
+    with engine.connect() as connection:
+        assert not connection.exec_driver_sql("PRAGMA foreign_key_check").all()
+        assert connection.execute(text("SELECT count(*) FROM tracks WHERE alias = 'orphan'")).scalar() == 0
+
+
+def test_upgrade_reports_inconsistent_data(tmp_path, caplog):
+    engine = build_database(tmp_path / "baseline.db", SAMPLE_ROWS + """
+        INSERT INTO playlists VALUES (3, 'Lost', 'lost', NULL, 42);
+    """)
+
+    with caplog.at_level(logging.WARNING, logger=migrations.__name__):
+        migrations.migrate(engine)
+
+    with engine.connect() as connection:
+        assert migrations.current_version(connection) == migrations.LATEST_VERSION
+    assert "already inconsistent" in caplog.text
+    assert "1 in playlists to users" in caplog.text
+
+
+def test_migration_that_breaks_a_foreign_key_is_rolled_back(tmp_path, monkeypatch):
+    engine = build_database(tmp_path / "baseline.db")
+    migrations.migrate(engine)
+
+    def drop_an_author(connection):
+        connection.execute(text("DELETE FROM authors WHERE id = 1"))
+
+    version = migrations.LATEST_VERSION + 1
+    monkeypatch.setattr(migrations, "MIGRATIONS", [migrations.Migration(version, "broken", drop_an_author)])
+    with pytest.raises(RuntimeError, match=f"migration {version} broke foreign keys: 2 in tracks to authors"):
+        migrations.migrate(engine, target=version)
+
+    with engine.connect() as connection:
+        assert migrations.current_version(connection) == migrations.LATEST_VERSION
+        assert connection.execute(text("SELECT count(*) FROM authors")).scalar() == 2
@@ -0,0 +1,92 @@
+from datetime import date
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from db import crud, schemas
+from db.database import SessionLocal
+from query_budget import assert_route_budget, find_endpoint
+
+AUTHORS = {"low-tide": "Low Tide", "glass-harbour": "Glass Harbour"}
+
+# In order, the writes at the end work on what the earlier ones created.
+REQUESTS = [
+    ("GET", "/", {}),
+    ("GET", "/authors/low-tide", {}),
+    ("GET", "/tracks/all", {}),
+    ("GET", "/tracks/low-tide-0", {}),
+    ("GET", "/tracks/low-tide-0/related", {}),
+    ("GET", "/playlists/all", {}),
+    ("GET", "/playlists/lofi-mix", {}),
+    ("GET", "/search?q=lo", {}),
+    ("GET", "/search?q=glass", {}),
+    ("GET", "/account", {}),
+    ("GET", "/charts", {}),
+    ("GET", "/charts?period=week", {}),
+    ("GET", "/api/v1/authors", {}),
+    ("GET", "/api/v1/authors?fields=alias,name", {}),
+    ("GET", "/api/v1/authors/low-tide", {}),
+    ("GET", "/api/v1/authors/low-tide/tracks", {}),
+    ("GET", "/api/v1/tracks", {}),
+    ("GET", "/api/v1/tracks/low-tide-0", {}),
+    ("GET", "/api/v1/playlists", {}),
+    ("GET", "/api/v1/playlists?fields=alias,tracks", {}),
+    ("GET", "/api/v1/playlists/lofi-mix", {}),
+    ("POST", "/tracks/low-tide-0/play", {}),
+    ("POST", "/playlists/", {"json": {"title": "Later", "alias": "later", "description": ""}}),
+    ("POST", "/playlists/later/tracks/low-tide-1", {}),
+    ("PATCH", "/playlists/later/tracks", {"json": {"operations": [
+        {"op": "insert", "track": "glass-harbour-0", "position": 0},
+        {"op": "move", "track": "low-tide-1", "position": 0},
+        {"op": "move", "track": "glass-harbour-0", "after": "low-tide-1"},
+    ]}}),
+    ("POST", "/authors/", {"json": {"name": "Short Lived", "alias": "short-lived"}}),
+    ("POST", "/authors/short-lived/", {"json": {
+        "title": "Brief", "alias": "brief", "track_url": "brief.mp3"
+    }}),
+    ("DELETE", "/tracks/brief", {}),
+    ("DELETE", "/playlists/later", {}),
+    ("DELETE", "/authors/short-lived", {}),
+]
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(main.app) as client:
+        seed_catalog()
+        token = client.post("/token", data={"username": "admin", "password": "secret"}).json()["access_token"]
+        client.headers["Authorization"] = f"Bearer {token}"
+        yield client
+
+
+def seed_catalog():
+    with SessionLocal() as db:
+        admin = crud.create_user(db, "admin", "secret", rights="admin")
+        for alias, name in AUTHORS.items():
+            crud.create_author(db, schemas.AuthorCreate(name=name, alias=alias))
+            for i in range(3):
+                crud.create_track(db, schemas.TrackCreate(
+                    title=f"{name} {i}", alias=f"{alias}-{i}", track_url=f"{alias}-{i}.mp3"
+                ), author_alias=alias)
+
+        playlist = crud.create_playlist(db, "Lofi mix", "lofi-mix", "slow ones", admin.id)
+        for track in ("low-tide-0", "low-tide-2", "glass-harbour-1"):
+            crud.add_track_to_playlist(db, playlist.id, track_alias=track)
+        crud.add_plays(db, {("low-tide-0", date.today()): 3, ("glass-harbour-1", date.today()): 1})
+        db.commit()
+
+
+@pytest.mark.parametrize("method, url, kwargs", REQUESTS, ids=[f"{m} {u}" for m, u, _ in REQUESTS])
+def test_route_stays_within_budget(client, method, url, kwargs):
+    response = assert_route_budget(client, url, method, **kwargs)
+    assert response.status_code < 400, response.text
+
+
+def test_every_budgeted_route_is_requested(client):
+    requested = {find_endpoint(client.app, url, method) for method, url, _ in REQUESTS}
+    budgeted = {
+        route.endpoint for route in client.app.router.routes
+        if hasattr(getattr(route, "endpoint", None), "query_budget")
+    }
+    assert not {endpoint.__name__ for endpoint in budgeted - requested}
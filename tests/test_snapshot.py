@@ -0,0 +1,73 @@
+import random
+
+from sqlalchemy import text
+
+from db import migrations
+from db.database import make_engine
+from db.snapshot import CatalogState, latest_version
+
+
+def contents(state: CatalogState):
+    """Everything a reader can reach from `state`, checking its indexes agree."""
+    assert [author.id for author in state.author_list] == sorted(state.authors)
+    assert all(state.authors[author.id] is author for author in state.author_list)
+    assert all(state.author_aliases[author.alias] is author for author in state.author_list)
+    assert len(state.author_aliases) == len(state.author_list)
+    assert all(state.track_aliases[track.alias] is track for track in state.tracks)
+    assert len(state.track_aliases) == len(state.tracks)
+    assert all(state.get_track(track.id) is track for author in state.author_list for track in author.tracks)
+    assert all(track.author is None or state.authors[track.author.id] is track.author for track in state.tracks)
+    return (
+        [(author.id, author.name, author.alias, [track.id for track in author.tracks]) for author in state.author_list],
+        [(track.id, track.title, track.alias, track.author_id, track.author and track.author.name)
+         for track in state.tracks],
+    )
+
+
+def random_changes(connection, rng: random.Random, serial: int):
+    author_ids = connection.execute(text("SELECT id FROM authors")).scalars().all()
+    track_ids = connection.execute(text("SELECT id FROM tracks")).scalars().all()
+    name = f"n{serial}"
+    statements = [("INSERT INTO authors (name, alias) VALUES (:name, :name)", {})]
+    if author_ids:
+        statements += [
+            ("INSERT INTO tracks (title, alias, track_url, author_id) VALUES (:name, :name, :name, :id)",
+             {"id": rng.choice(author_ids)}),
+            ("UPDATE authors SET name = :name, alias = :name WHERE id = :id", {"id": rng.choice(author_ids)}),
+        ] * 2
+        statements.append(("DELETE FROM authors WHERE id = :id", {"id": rng.choice(author_ids)}))
+    if track_ids:
+        statements += [
+            ("UPDATE tracks SET title = :name, alias = :name WHERE id = :id", {"id": rng.choice(track_ids)}),
+            ("DELETE FROM tracks WHERE id = :id", {"id": rng.choice(track_ids)}),
+        ]
+        if author_ids:
+            statements.append(("UPDATE tracks SET author_id = :author WHERE id = :id",
+                               {"id": rng.choice(track_ids), "author": rng.choice(author_ids)}))
+    statement, parameters = rng.choice(statements)
+    connection.execute(text(statement), {"name": name, **parameters})
+
+
+def test_applied_changes_match_a_full_load_and_leave_the_old_state_alone(tmp_path):
+    engine = make_engine(f"sqlite:///{tmp_path / 'catalog.db'}")
+    migrations.migrate(engine)
+    rng = random.Random(1)
+    with engine.connect() as connection:
+        state = CatalogState.load(connection)
+
+    for step in range(150):
+        with engine.begin() as connection:
+            for serial in range(rng.randint(1, 5)):
+                random_changes(connection, rng, step * 10 + serial)
+
+        with engine.connect() as connection:
+            changes = connection.execute(
+                text("SELECT kind, row_id FROM catalog_changes WHERE version > :version ORDER BY version"),
+                {"version": state.version}
+            ).all()
+            before = contents(state)
+            applied = state.apply(connection, changes, latest_version(connection))
+            assert contents(state) == before
+            assert contents(applied) == contents(CatalogState.load(connection))
+        state = applied
+    assert state.tracks
@@ -0,0 +1,160 @@
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from math import ceil
+from email.utils import formatdate
+from pathlib import Path as FilePath
+from typing import Annotated
+
+import anyio
+from fastapi import Depends, HTTPException, APIRouter, Path
+from fastapi.responses import Response
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+
+from db import crud
+
+from audio_metadata import UnsupportedAudio, wav_layout
+from handle_db import get_read_db
+from streaming import AUDIO_DIRECTORY, AudioFileResponse, is_not_modified, make_etag
+
+waveform_router = APIRouter()
+
+# Peaks are stored in audiowaveform's .dat version 1 layout, which
+# waveform-data.js and peaks.js read as is: a header, then one signed 8-bit
+# (min, max) pair per column.
+PEAKS_DIRECTORY = AUDIO_DIRECTORY / ".peaks"
+PEAK_COUNT = int(os.environ.get("WAVEFORM_PEAKS", 1000))
+READ_SIZE = 4 * 1024 * 1024
+PEAKS_MAX_AGE = int(os.environ.get("PEAKS_MAX_AGE", 7 * 86400))
+
+# version, flags (1 means 8-bit values), sample rate, samples per peak, peak count
+DAT_HEADER = struct.Struct("<iIiiI")
+
+# array typecode, the value of silence and the largest magnitude, by
+# (format tag, bits per sample). 24-bit samples are read as their top 16 bits.
+SAMPLE_FORMATS = {
+    (1, 8): ("B", 128, 128),
+    (1, 16): ("h", 0, 32768),
+    (1, 24): ("h", 0, 32768),
+    (1, 32): ("i", 0, 2 ** 31),
+    (3, 32): ("f", 0, 1.0),
+    (3, 64): ("d", 0, 1.0),
+}
+
+
+def peaks_path(track_url: str) -> FilePath:
+    return PEAKS_DIRECTORY / f"{track_url}.dat"
+
+
+def has_peaks_source(track_url: str) -> bool:
+    return track_url.lower().endswith(".wav")
+
+
+def needs_peaks(track_url: str, audio_mtime: float) -> bool:
+    try:
+        return peaks_path(track_url).stat().st_mtime < audio_mtime
+    except FileNotFoundError:
+        return True
+
+
+def _decode(block: bytes, typecode: str, bits: int) -> array:
+    if bits == 24:
+        high = bytearray(len(block) // 3 * 2)
+        high[0::2] = block[1::3]
+        high[1::2] = block[2::3]
+        block = high
+    samples = array(typecode)
+    samples.frombytes(block)
+    if sys.byteorder == "big":
+        samples.byteswap()
+    return samples
+
+
+def compute_peaks(path: str | os.PathLike, peak_count: int = PEAK_COUNT) -> bytes:
+    with open(path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        if file.read(12)[8:12] != b"WAVE":
+            raise UnsupportedAudio("Waveforms are only computed for WAV files")
+        try:
+            layout = wav_layout(file, size)
+        except struct.error as e:
+            raise UnsupportedAudio("Truncated WAV header") from e
+        sample_format = SAMPLE_FORMATS.get((layout.format_tag, layout.bits_per_sample))
+        if sample_format is None or layout.data_offset is None or not layout.block_align:
+            raise UnsupportedAudio(
+                f"Unsupported WAV sample format {layout.format_tag}/{layout.bits_per_sample} bit"
+            )
+        typecode, silence, full_scale = sample_format
+        scale = 128 / full_scale
+
+        frames = layout.data_size // layout.block_align
+        frames_per_peak = max(ceil(frames / peak_count), 1)
+        samples_per_peak = frames_per_peak * layout.channels
+        bucket_bytes = frames_per_peak * layout.block_align
+
+        # Whole buckets are read at once and each one is reduced by min() and
+        # max() over a slice of the sample array, which loop in C.
+        peaks = array("b")
+        remaining = frames * layout.block_align
+        file.seek(layout.data_offset)
+        while remaining > 0:
+            block = file.read(min(max(READ_SIZE // bucket_bytes, 1) * bucket_bytes, remaining))
+            block = block[:len(block) - len(block) % layout.block_align]
+            if not block:
+                break
+            remaining -= len(block)
+
+            samples = memoryview(_decode(block, typecode, layout.bits_per_sample))
+            for start in range(0, len(samples), samples_per_peak):
+                bucket = samples[start:start + samples_per_peak]
+                peaks.append(max(int((min(bucket) - silence) * scale), -128))
+                peaks.append(min(int((max(bucket) - silence) * scale), 127))
+
+    header = DAT_HEADER.pack(1, 1, layout.sample_rate, frames_per_peak, len(peaks) // 2)
+    return header + peaks.tobytes()
+
+
+def write_peaks(track_url: str, audio_path: str | os.PathLike) -> FilePath:
+    data = compute_peaks(audio_path)
+    path = peaks_path(track_url)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    descriptor, temp_path = tempfile.mkstemp(dir=path.parent)
+    try:
+        with os.fdopen(descriptor, "wb") as file:
+            file.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return path
+
+
+@waveform_router.get("/tracks/{track_alias}/peaks")
+async def track_peaks(
+    request: Request,
+    track_alias: Annotated[str, Path(min_length=3, max_length=50)],
+    db: Session = Depends(get_read_db)
+):
+    track = await run_in_threadpool(crud.get_track, db, track_alias=track_alias)
+    if track is None:
+        raise HTTPException(404, "Track not found")
+
+    path = peaks_path(track.track_url)
+    try:
+        stat_result = await anyio.to_thread.run_sync(os.stat, path)
+    except FileNotFoundError:
+        raise HTTPException(404, "No waveform for this track yet")
+
+    etag = make_etag(stat_result)
+    headers = {
+        "etag": etag,
+        "last-modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "cache-control": f"public, max-age={PEAKS_MAX_AGE}",
+    }
+    if is_not_modified(request, etag, stat_result.st_mtime):
+        return Response(status_code=304, headers=headers)
+    return AudioFileResponse(path, stat_result, headers, media_type="application/octet-stream")